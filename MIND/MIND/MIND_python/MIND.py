@@ -1,201 +1,1241 @@
-import os
-import subprocess
-from pathlib import Path
-import sys
-import pickle
-import json
-import datetime
-from dotenv import load_dotenv
-import logging
-import re
-import configparser
-import smtplib
-from email.mime.text import MIMEText
-
-# Load environment variables from MIND.env file
-load_dotenv(dotenv_path='C:/MIND/MIND/MIND_config/MIND.env')
-
-def setup_logging(log_file_path):
-    logging.basicConfig(
-        filename=log_file_path,
-        level=logging.DEBUG,
-        format='%(asctime)s %(levelname)s:%(message)s'
-    )
-
-def send_email(subject, message, recipient):
-    msg = MIMEText(message)
-    msg['Subject'] = subject
-    msg['From'] = os.getenv('EMAIL_smtp_email')
-    msg['To'] = recipient
-    server = smtplib.SMTP(os.getenv('EMAIL_smtp_server'), int(os.getenv('EMAIL_smtp_port')))
-    server.starttls()
-    server.send_message(msg)
-    server.quit()
-
-def run_script(script_path, data, parameters, log_file, first_script=False):
-    try:
-        cwd = script_path.parent
-
-        temp_file = cwd / 'temp_data.pkl'
-        temp_param_file = cwd / 'temp_params.json'
-        
-        if first_script:
-            # Save data only for the first script
-            with open(temp_file, 'wb') as f:
-                pickle.dump(data, f)
-        
-        # Merge parameters and save them
-        if temp_param_file.exists():
-            with open(temp_param_file, 'r') as f:
-                existing_params = json.load(f)
-                parameters.update(existing_params)
-        
-        with open(temp_param_file, 'w') as f:
-            json.dump(parameters, f)
-
-        logging.debug("Running script: %s with parameters: %s", script_path, parameters)
-        
-        result = subprocess.run(
-            ['python', str(script_path), str(temp_file), str(temp_param_file)],
-            cwd=cwd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            env=os.environ
-        )
-        
-        stdout_output = result.stdout
-        stderr_output = result.stderr
-
-        with open(log_file, 'a') as log:
-            log.write(f"Output of {script_path}:\n")
-            log.write(stdout_output)
-            log.write(stderr_output)
-            log.write("\n\n")
-        
-        if result.returncode != 0:
-            logging.error(f"Script {script_path} returned non-zero exit status {result.returncode}")
-            logging.error(stderr_output)
-            raise subprocess.CalledProcessError(result.returncode, result.args, stdout_output, stderr_output)
-        
-        if temp_file.exists():
-            with open(temp_file, 'rb') as f:
-                data = pickle.load(f)
-        
-        return data, stdout_output, False  # False indicates no error
-    
-    except subprocess.CalledProcessError as e:
-        error_message = f"Error running {script_path}: {e}\n{e.output}\n{e.stderr}"
-        logging.error(error_message)
-        with open(log_file, 'a') as log:
-            log.write(error_message)
-            log.write("\n\n")
-        email_subject = f'FATAL ERROR: {script_path.name} HAS ENCOUNTERED A FATAL ERROR'
-        email_body = f'Log file path: {log_file}'
-        send_email(email_subject, email_body, os.getenv('EMAIL_error_to_email'))
-        return None, error_message, True  # True indicates an error
-
-    except Exception as e:
-        error_message = f"Unexpected error running {script_path}: {e}"
-        logging.error(error_message)
-        with open(log_file, 'a') as log:
-            log.write(error_message)
-            log.write("\n\n")
-        email_subject = f'FATAL ERROR: {script_path.name} HAS ENCOUNTERED A FATAL ERROR'
-        email_body = f'Log file path: {log_file}'
-        send_email(email_subject, email_body, os.getenv('EMAIL_error_to_email'))
-        return None, error_message, True  # True indicates an error
-
-def run_scripts_sequentially(scripts, parameters, log_file):
-    data = None
-    for index, script in enumerate(scripts):
-        first_script = (index == 0)
-        data, output, error = run_script(script, data, parameters, log_file, first_script=first_script)
-
-        if error:
-            print(f"Error: {script} encountered an error.")
-            logging.error("Error: %s encountered an error.", script)
-            sys.exit(1)  # Exit on error
-
-        print(f"Output of {script}: {output}")
-
-    return True
-
-def numeric_sort_key(script_path):
-    """Extracts the numeric part of the filename for sorting."""
-    match = re.search(r'(\d+)', script_path.stem)
-    return int(match.group(1)) if match else float('inf')
-
-def main(base_dir=None, start_step=None, end_step=None, parameters=None):
-    if not base_dir:
-        print("Usage: python MIND.py <base_directory> [start_step] [end_step] [parameters...]")
-        logging.error("Base directory is required.")
-        sys.exit(1)
-
-    base_dir = Path(base_dir).resolve()
-    python_dir = base_dir / 'python'
-    config_dir = base_dir / 'config'
-    log_dir = base_dir.parents[1] / 'MIND_logs' / base_dir.name
-    config_file = config_dir / 'config.ini'
-
-    log_dir.mkdir(parents=True, exist_ok=True)
-    timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-    log_file_path = log_dir / f"log_{timestamp}.txt"
-    
-    setup_logging(log_file_path)
-
-    if not config_file.exists() or not config_file.is_file():
-        raise FileNotFoundError(f"The config file {config_file} does not exist.")
-
-    config = configparser.ConfigParser()
-    config.read(config_file)
-
-    parameters_dict = {
-        "report_config_file_path": str(config_file),
-    }
-
-    for section in config.sections():
-        for key, value in config.items(section):
-            parameters_dict[key] = value
-
-    # Only include scripts with a two-digit number at the end before .py
-    scripts = [script for script in sorted(python_dir.glob('*.py'), key=numeric_sort_key) if re.search(r'\d{2}\.py$', script.name)]
-
-    if start_step is not None:
-        start_step = int(start_step)
-        start_index = next((i for i, script in enumerate(scripts) if numeric_sort_key(script) >= start_step), None)
-        if start_index is not None:
-            scripts = scripts[start_index:]
-        else:
-            print(f"Error: No script found for starting step {start_step}")
-            logging.error("No script found for starting step %s", start_step)
-            sys.exit(1)
-
-    if end_step is not None:
-        end_step = int(end_step)
-        end_index = next((i for i, script in enumerate(scripts) if numeric_sort_key(script) > end_step), None)
-        if end_index is not None:
-            scripts = scripts[:end_index]
-
-    logging.info("Starting MIND script with base directory: %s, start step: %s, end step: %s, and parameters: %s", base_dir, start_step, end_step, parameters_dict)
-    
-    if scripts:
-        success = run_scripts_sequentially(scripts, parameters_dict, log_file_path)
-        if not success:
-            print("Error encountered during script execution.")
-    else:
-        logging.error("No scripts found to execute.")
-        print("No scripts found to execute.")
-
-if __name__ == "__main__":
-    base_directory = Path(sys.argv[1]).resolve() if len(sys.argv) > 1 else None
-    start_step = sys.argv[2] if len(sys.argv) > 2 and sys.argv[2].isdigit() else None
-    end_step = sys.argv[3] if len(sys.argv) > 3 and sys.argv[3].isdigit() else None
-    parameters = sys.argv[4:] if len(sys.argv) > 4 else []
-
-    if not base_directory or not base_directory.exists() or not base_directory.is_dir():
-        print("Usage: python MIND.py <base_directory> [start_step] [end_step] [parameters...]")
-        logging.error("Invalid base directory.")
-        sys.exit(1)
-
-    main(base_directory, start_step, end_step, parameters)
+import os
+import subprocess
+from pathlib import Path
+import sys
+import json
+import datetime
+import time
+from dotenv import load_dotenv
+import logging
+import re
+import shutil
+import configparser
+import smtplib
+import argparse
+import runpy
+import traceback
+import importlib.util
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import redirect_stdout, redirect_stderr, ExitStack
+from email.mime.text import MIMEText
+
+import MIND_handoff
+import MIND_cache
+import MIND_telemetry
+import MIND_rundir
+import MIND_workers
+import MIND_output
+import MIND_limits
+import MIND_profile
+import MIND_memory
+import MIND_metrics
+import MIND_history
+
+# Load environment variables from MIND.env file
+load_dotenv(dotenv_path='C:/MIND/MIND/MIND_config/MIND.env')
+
+MIND_PYTHON_DIR = Path(__file__).resolve().parent
+
+# Steps running side by side share one temp_params.json
+PARAMETERS_LOCK = threading.Lock()
+
+# The manifest of the run in progress, set by main()
+RUN_MANIFEST = None
+
+# Pre-started step processes, set by main() when [MIND] warm_workers is on
+WARM_POOL = None
+
+# Steps to profile, 'all' or a set of step numbers, set by main() from [MIND] profile
+PROFILE_STEPS = None
+
+# Steps whose memory to trace, set by main() from [MIND] trace_memory, and seconds between checkpoints
+MEMORY_STEPS = None
+MEMORY_INTERVAL = 0
+
+# The log file handler of the run in progress, set by setup_logging()
+LOG_HANDLER = None
+
+# Whether failures and slow runs are emailed; run() turns this off unless asked
+SEND_ALERTS = True
+
+def setup_logging(log_file_path):
+    """Sends logging to log_file_path, in place of the log of an earlier run in this process."""
+    global LOG_HANDLER
+    root = logging.getLogger()
+    if LOG_HANDLER is not None:
+        root.removeHandler(LOG_HANDLER)
+        LOG_HANDLER.close()
+    LOG_HANDLER = logging.FileHandler(log_file_path)
+    LOG_HANDLER.setFormatter(logging.Formatter('%(asctime)s %(levelname)s:%(message)s'))
+    root.addHandler(LOG_HANDLER)
+    root.setLevel(logging.DEBUG)
+
+def send_email(subject, message, recipient):
+    if not SEND_ALERTS:
+        logging.info("Not emailing '%s': alerts are off for this run", subject)
+        return
+    msg = MIMEText(message)
+    msg['Subject'] = subject
+    msg['From'] = os.getenv('EMAIL_smtp_email')
+    msg['To'] = recipient
+    server = smtplib.SMTP(os.getenv('EMAIL_smtp_server'), int(os.getenv('EMAIL_smtp_port')))
+    server.starttls()
+    server.send_message(msg)
+    server.quit()
+
+def step_environment():
+    """Environment for step subprocesses; puts MIND_python on the path so steps can import its helpers."""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(MIND_PYTHON_DIR), env.get('PYTHONPATH')]))
+    # Print output as it happens, so it reaches the log while the step runs
+    env['PYTHONUNBUFFERED'] = '1'
+    return env
+
+def write_parameters(temp_param_file, parameters):
+    """Merges the parameters steps have saved so far into parameters and writes them back."""
+    with PARAMETERS_LOCK:
+        if temp_param_file.exists():
+            with open(temp_param_file, 'r') as f:
+                existing_params = json.load(f)
+                parameters.update(existing_params)
+
+        with open(temp_param_file, 'w') as f:
+            json.dump(parameters, f)
+
+def merge_parameters(temp_param_file, step_param_file):
+    """Adds the parameters one step of a step graph saved in its own directory to the run's temp_params.json."""
+    if not step_param_file.exists():
+        return
+    with open(step_param_file, 'r') as f:
+        saved = json.load(f)
+    with PARAMETERS_LOCK:
+        parameters = {}
+        if temp_param_file.exists():
+            with open(temp_param_file, 'r') as f:
+                parameters = json.load(f)
+        parameters.update(saved)
+        with open(temp_param_file, 'w') as f:
+            json.dump(parameters, f)
+
+def record_step(script_path, mode, started, wall_seconds, exit_status, stats=None, data=None):
+    """Adds a step to the run manifest, when there is one."""
+    if RUN_MANIFEST is None:
+        return
+    stats = stats or {}
+    try:
+        frames = MIND_handoff.frame_shapes(data)
+    except Exception as e:
+        logging.warning("Could not measure the output of %s: %s", script_path, e)
+        frames = {}
+    RUN_MANIFEST.add_step(
+        step=script_path.name,
+        mode=mode,
+        started=datetime.datetime.fromtimestamp(started).isoformat(timespec='seconds'),
+        wall_seconds=round(wall_seconds, 3),
+        cpu_seconds=stats.get('cpu_seconds'),
+        peak_rss_bytes=stats.get('peak_rss_bytes'),
+        handoff_bytes_read=stats.get('handoff_bytes_read'),
+        handoff_bytes_written=stats.get('handoff_bytes_written'),
+        calls=stats.get('calls'),
+        frames=frames,
+        exit_status=exit_status,
+    )
+
+def start_step_process(command, cwd, env):
+    """Starts `python <command>` for a step, in a warm worker when there is a pool."""
+    if WARM_POOL is not None:
+        return WARM_POOL.start(command[1:], cwd, env)
+    return subprocess.Popen(
+        ['python'] + command,
+        cwd=cwd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        errors='replace',
+        env=env
+    )
+
+def parse_steps(value):
+    """'all', or the set of step numbers in a list like '03, 05'; None when empty."""
+    value = value.strip().lower()
+    if not value:
+        return None
+    return 'all' if value == 'all' else {int(step) for step in value.replace(',', ' ').split()}
+
+def artifact_prefix(kind, steps, script_path, log_file):
+    """
+    Where a step's profile or memory trace goes when steps includes it, next
+    to the run's log: <kind>_<timestamp>_<step>. None otherwise.
+    """
+    if not steps or (steps != 'all' and step_number(script_path) not in steps):
+        return None
+    timestamp = Path(log_file).stem.replace('log_', '', 1)
+    return Path(log_file).parent / f"{kind}_{timestamp}_{script_path.stem}"
+
+def diagnostics(script_path, log_file):
+    """Environment variables that make MIND_step.py profile or trace a step."""
+    env = {}
+    profile = artifact_prefix('profile', PROFILE_STEPS, script_path, log_file)
+    if profile:
+        env['MIND_PROFILE'] = str(profile)
+    memory = artifact_prefix('memory', MEMORY_STEPS, script_path, log_file)
+    if memory:
+        env['MIND_TRACE_MEMORY'] = str(memory)
+        env['MIND_TRACE_MEMORY_INTERVAL'] = str(MEMORY_INTERVAL)
+    return env
+
+def elapsed_since(started):
+    return str(datetime.timedelta(seconds=round(time.time() - started)))
+
+def run_script(script_path, data, parameters, log_file, first_script=False, handoff_kind='pickle', handoff_file=None, work_dir=None,
+               timeouts=None):
+    started = time.time()
+    try:
+        cwd = work_dir or script_path.parent
+
+        temp_file = cwd / 'temp_data.pkl'
+        temp_param_file = cwd / 'temp_params.json'
+        # Steps always see temp_data.pkl; handoff_file is where the launcher really keeps their data
+        handoff_file = handoff_file or temp_file
+        handoff = MIND_handoff.open_handoff(handoff_kind, handoff_file)
+
+        if first_script:
+            # Save data only for the first script
+            handoff.save(data)
+        
+        write_parameters(temp_param_file, parameters)
+
+        logging.debug("Running script: %s with parameters: %s", script_path, parameters)
+        
+        # The launcher routes temp_data.pkl to the handoff and reports the step's resource use
+        stats_file = cwd / f'{handoff_file.stem}_stats.json'
+        command = [str(MIND_PYTHON_DIR / 'MIND_step.py'), str(script_path), str(temp_file), str(temp_param_file)]
+        env = step_environment()
+        env['MIND_HANDOFF'] = handoff_kind
+        env['MIND_HANDOFF_FILE'] = str(handoff_file)
+        env['MIND_STEP_STATS'] = str(stats_file)
+        env.update(diagnostics(script_path, log_file))
+
+        retry = 0
+        while True:
+            output = MIND_output.StepOutput(script_path, log_file)
+            attempt_started = time.time()
+            process = start_step_process(command, cwd, env)
+            try:
+                returncode = output.follow(process, timeouts.for_step(script_path) if timeouts else None)
+                break
+            except subprocess.TimeoutExpired as e:
+                record_step(script_path, 'subprocess', attempt_started, time.time() - attempt_started, 'timeout',
+                            MIND_telemetry.read_step_stats(stats_file))
+                logging.error("Script %s timed out after %s and was stopped", script_path, elapsed_since(attempt_started))
+                if retry >= timeouts.retries:
+                    e.output = output.text()
+                    raise
+                retry += 1
+                backoff = timeouts.backoff_for(retry)
+                logging.warning("Retrying %s in %.0f seconds (retry %s of %s)", script_path, backoff, retry, timeouts.retries)
+                time.sleep(backoff)
+                # The stopped step may have saved part of its output; start again from its input
+                if data is None and not first_script:
+                    handoff.discard()
+                else:
+                    handoff.save(data)
+        started = attempt_started
+        
+        wall_seconds = time.time() - started
+        stats = MIND_telemetry.read_step_stats(stats_file)
+        
+        if returncode != 0:
+            record_step(script_path, 'subprocess', started, wall_seconds, returncode, stats)
+            logging.error(f"Script {script_path} returned non-zero exit status {returncode}")
+            raise subprocess.CalledProcessError(returncode, ['python'] + command, output.text())
+        
+        if handoff.present:
+            data = handoff.load()
+
+        record_step(script_path, 'subprocess', started, wall_seconds, 0, stats, data)
+        
+        return data, output.text(), False  # False indicates no error
+    
+    except subprocess.CalledProcessError as e:
+        error_message = f"Error running {script_path}: {e}"
+        logging.error(error_message)
+        with open(log_file, 'a') as log:
+            log.write(error_message)
+            log.write("\n\n")
+        email_subject = f'FATAL ERROR: {script_path.name} HAS ENCOUNTERED A FATAL ERROR'
+        email_body = f'Log file path: {log_file}\nElapsed: {elapsed_since(started)}\n\nLast lines of output:\n{e.output}'
+        send_email(email_subject, email_body, os.getenv('EMAIL_error_to_email'))
+        return None, error_message, True  # True indicates an error
+
+    except subprocess.TimeoutExpired as e:
+        error_message = f"Timed out running {script_path}: stopped after {elapsed_since(started)} including retries"
+        logging.error(error_message)
+        with open(log_file, 'a') as log:
+            log.write(error_message)
+            log.write("\n\n")
+        email_subject = f'FATAL ERROR: {script_path.name} HAS TIMED OUT'
+        email_body = f'Log file path: {log_file}\nElapsed: {elapsed_since(started)}\n\nLast lines of output:\n{e.output}'
+        send_email(email_subject, email_body, os.getenv('EMAIL_error_to_email'))
+        return None, error_message, True  # True indicates an error
+
+    except Exception as e:
+        error_message = f"Unexpected error running {script_path}: {e}"
+        logging.error(error_message)
+        with open(log_file, 'a') as log:
+            log.write(error_message)
+            log.write("\n\n")
+        email_subject = f'FATAL ERROR: {script_path.name} HAS ENCOUNTERED A FATAL ERROR'
+        email_body = f'Log file path: {log_file}\nElapsed: {elapsed_since(started)}'
+        send_email(email_subject, email_body, os.getenv('EMAIL_error_to_email'))
+        return None, error_message, True  # True indicates an error
+
+def calls_exit(script_path):
+    """True if the script calls the site builtins exit() / quit() rather than sys.exit()."""
+    source = script_path.read_text(encoding='utf-8', errors='ignore')
+    return re.search(r'(?<![\w.])(exit|quit)\s*\(', source) is not None
+
+def run_script_in_process(script_path, handoff, parameters, log_file, work_dir=None):
+    started = time.time()
+    try:
+        cwd = work_dir or script_path.parent
+
+        temp_file = cwd / 'temp_data.pkl'
+        temp_param_file = cwd / 'temp_params.json'
+
+        write_parameters(temp_param_file, parameters)
+
+        logging.debug("Running script in process: %s with parameters: %s", script_path, parameters)
+
+        output = MIND_output.StepOutput(script_path, log_file)
+        stdout, stderr = output.stream('stdout'), output.stream('stderr')
+        returncode = 0
+        cpu_started = time.process_time()
+        io_started = dict(MIND_handoff.IO_BYTES)
+        calls_started = dict(MIND_metrics.COUNTERS)
+        saved_argv, saved_path, saved_cwd = sys.argv, list(sys.path), os.getcwd()
+        try:
+            os.chdir(cwd)
+            sys.argv = [str(script_path), str(temp_file), str(temp_param_file)]
+            sys.path.insert(0, str(script_path.parent))
+            profile = artifact_prefix('profile', PROFILE_STEPS, script_path, log_file)
+            memory = artifact_prefix('memory', MEMORY_STEPS, script_path, log_file)
+            with MIND_handoff.redirect(temp_file, handoff), redirect_stdout(stdout), redirect_stderr(stderr):
+                try:
+                    with ExitStack() as diagnosing:
+                        if memory:
+                            diagnosing.enter_context(MIND_memory.traced(memory, MEMORY_INTERVAL))
+                        if profile:
+                            diagnosing.enter_context(MIND_profile.profiled(profile))
+                        runpy.run_path(str(script_path), run_name='__main__')
+                except SystemExit as e:
+                    if isinstance(e.code, int):
+                        returncode = e.code
+                    elif e.code is not None:
+                        print(e.code, file=sys.stderr)
+                        returncode = 1
+                except Exception:
+                    traceback.print_exc()
+                    returncode = 1
+        finally:
+            stdout.close()
+            stderr.close()
+            os.chdir(saved_cwd)
+            sys.argv, sys.path[:] = saved_argv, saved_path
+
+        wall_seconds = time.time() - started
+        stats = {
+            'cpu_seconds': time.process_time() - cpu_started,
+            'peak_rss_bytes': MIND_telemetry.peak_rss_bytes(),
+            'handoff_bytes_read': MIND_handoff.IO_BYTES['read'] - io_started['read'],
+            'handoff_bytes_written': MIND_handoff.IO_BYTES['written'] - io_started['written'],
+            'calls': MIND_metrics.since(calls_started),
+        }
+
+        if returncode != 0:
+            record_step(script_path, 'in_process', started, wall_seconds, returncode, stats)
+            logging.error(f"Script {script_path} returned non-zero exit status {returncode}")
+            raise subprocess.CalledProcessError(returncode, [str(script_path)], output.text())
+
+        data = handoff.load()
+        record_step(script_path, 'in_process', started, wall_seconds, 0, stats, data)
+
+        return data, output.text(), False  # False indicates no error
+
+    except subprocess.CalledProcessError as e:
+        error_message = f"Error running {script_path}: {e}"
+        logging.error(error_message)
+        with open(log_file, 'a') as log:
+            log.write(error_message)
+            log.write("\n\n")
+        email_subject = f'FATAL ERROR: {script_path.name} HAS ENCOUNTERED A FATAL ERROR'
+        email_body = f'Log file path: {log_file}\nElapsed: {elapsed_since(started)}\n\nLast lines of output:\n{e.output}'
+        send_email(email_subject, email_body, os.getenv('EMAIL_error_to_email'))
+        return None, error_message, True  # True indicates an error
+
+    except Exception as e:
+        error_message = f"Unexpected error running {script_path}: {e}"
+        logging.error(error_message)
+        with open(log_file, 'a') as log:
+            log.write(error_message)
+            log.write("\n\n")
+        email_subject = f'FATAL ERROR: {script_path.name} HAS ENCOUNTERED A FATAL ERROR'
+        email_body = f'Log file path: {log_file}\nElapsed: {elapsed_since(started)}'
+        send_email(email_subject, email_body, os.getenv('EMAIL_error_to_email'))
+        return None, error_message, True  # True indicates an error
+
+def lookup_cached_step(cache, script, data, digest, parameters, work_dir):
+    """
+    Returns (key, hit) for a step the cache covers, where hit is the cached
+    (data, digest) or None, or (None, None) when the step is not cached.
+    """
+    step = step_number(script)
+    if cache is None or not cache.caches(step):
+        return None, None
+
+    temp_param_file = work_dir / 'temp_params.json'
+    write_parameters(temp_param_file, parameters)
+    if digest is None:
+        digest = MIND_cache.hash_payload(data).hexdigest()
+    key = cache.key(script, digest, parameters)
+    started = time.time()
+    hit = cache.get(key, temp_param_file)
+    if hit is not None:
+        record_step(script, 'cached', started, time.time() - started, 0, data=hit[0])
+        cache.record(step, key)
+        print(f"Skipping {script}: its output for these inputs is cached.")
+        logging.info("Skipping %s: cached output %s", script, key)
+        with open(temp_param_file, 'r') as f:
+            parameters.update(json.load(f))
+    return key, hit
+
+def store_cached_step(cache, key, script, data, work_dir):
+    """Caches a step's output and returns its content hash."""
+    step = step_number(script)
+    digest = cache.put(key, step, data, work_dir / 'temp_params.json')
+    cache.record(step, key)
+    return digest
+
+def resumed_payload(handoff_kind, work_dir):
+    """The payload a resumed run found in its working directory, or None."""
+    stored = MIND_handoff.open_handoff(handoff_kind, work_dir / 'temp_data.pkl')
+    return stored.load() if stored.present else None
+
+def run_scripts_sequentially(scripts, parameters, log_file, in_process=False, handoff_kind='pickle', cache=None, initial=(None, None),
+                             work_dir=None, timeouts=None, save_final=True, resumed=False):
+    """
+    Runs the steps one after another. Returns the last step's payload; exits
+    if a step fails. With resumed, the first step starts from the temp_data.pkl
+    already in work_dir instead of initial.
+    """
+    work_dir = work_dir or scripts[0].parent
+    data, digest = initial
+    if resumed and (in_process or cache is not None or (timeouts and timeouts.limited(scripts[0]))):
+        # Subprocess steps read the file where it is; in memory, for the cache key and to retry from it has to be loaded
+        data = resumed_payload(handoff_kind, work_dir)
+    handoff = MIND_handoff.MemoryHandoff()
+    data_in_memory = False
+    for index, script in enumerate(scripts):
+        first_script = (index == 0) and not resumed
+        temp_file = work_dir / 'temp_data.pkl'
+
+        key, hit = lookup_cached_step(cache, script, data, digest, parameters, work_dir)
+        if hit is not None:
+            data, digest = hit
+            handoff.save(data)
+            data_in_memory = True
+            continue
+
+        # Steps calling exit() close stdin on the way out, and steps with a time limit must be
+        # killable, so both keep their own interpreter
+        if in_process and not calls_exit(script) and not (timeouts and timeouts.limited(script)):
+            if not data_in_memory:
+                handoff.save(data)
+            data, output, error = run_script_in_process(script, handoff, parameters, log_file, work_dir=work_dir)
+            data_in_memory = True
+        else:
+            if in_process:
+                logging.info("Running %s as a subprocess because it calls exit() or has a time limit", script)
+            # The payload only lives in memory after an in-process step, so hand it over on disk
+            data, output, error = run_script(script, data, parameters, log_file, first_script=first_script or data_in_memory,
+                                             handoff_kind=handoff_kind, work_dir=work_dir, timeouts=timeouts)
+            data_in_memory = False
+
+        if error:
+            print(f"Error: {script} encountered an error.")
+            logging.error("Error: %s encountered an error.", script)
+            sys.exit(1)  # Exit on error
+
+        print(f"Output of {script}: {output}")
+
+        digest = store_cached_step(cache, key, script, data, work_dir) if key else None
+
+    # Leave the final payload on disk, as a subprocess run would
+    if save_final and data_in_memory and handoff.present:
+        MIND_handoff.open_handoff(handoff_kind, temp_file).save(data)
+
+    return data
+
+def run_scripts_as_dag(scripts, dependencies, parameters, log_file, in_process=False, handoff_kind='pickle', max_workers=1,
+                       cache=None, initial=(None, None), work_dir=None, timeouts=None, save_final=True, resumed=False):
+    """
+    Runs the steps in dependency order, starting every step whose dependencies
+    have finished, up to max_workers at a time. Each step gets the merged
+    outputs of the steps it depends on and runs in a directory of its own
+    (see MIND_rundir.StepDirectory) with its own temp_data.pkl and
+    temp_params.json, so steps running side by side never see, overwrite or
+    delete each other's. The files a step creates and the parameters it saves
+    are moved back into work_dir when it finishes. With resumed, the steps
+    that depend on nothing start from the temp_data.pkl already in work_dir
+    instead of initial. Returns the merged payloads of the final steps; exits
+    if a step fails.
+    """
+    if in_process and max_workers > 1:
+        # In-process steps share this interpreter's working directory and sys.argv
+        logging.info("Running the step graph one step at a time because in-process mode is on")
+        max_workers = 1
+
+    work_dir = work_dir or scripts[0].parent
+    if resumed:
+        initial = (resumed_payload(handoff_kind, work_dir), None)
+    scripts_by_step = {step_number(script): script for script in scripts}
+    needed = {dependency for needs in dependencies.values() for dependency in needs}
+    pending = dict(dependencies)
+    outputs = {}
+    running = {}
+    failed = False
+
+    digests = {}
+    step_dirs = {step: MIND_rundir.StepDirectory(work_dir, step) for step in scripts_by_step}
+
+    def run_step(step, data, digest):
+        script = scripts_by_step[step]
+        step_dir = step_dirs[step].create().path
+        step_parameters = dict(parameters)
+        key, hit = lookup_cached_step(cache, script, data, digest, step_parameters, step_dir)
+        if hit is not None:
+            digests[step] = hit[1]
+            result = hit[0], "(cached)", False
+        elif in_process and not calls_exit(script) and not (timeouts and timeouts.limited(script)):
+            result = run_script_in_process(script, MIND_handoff.MemoryHandoff(data), step_parameters, log_file, work_dir=step_dir)
+        else:
+            result = run_script(script, data, step_parameters, log_file, first_script=True,
+                                handoff_kind=handoff_kind, work_dir=step_dir, timeouts=timeouts)
+        if key and hit is None and not result[2]:
+            digests[step] = store_cached_step(cache, key, script, result[0], step_dir)
+        if not result[2]:
+            step_dirs[step].publish()
+            merge_parameters(work_dir / 'temp_params.json', step_dir / 'temp_params.json')
+        return result
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while pending or running:
+                if not failed:
+                    for step, needs in list(pending.items()):
+                        if len(running) >= max_workers:
+                            break
+                        if all(dependency in outputs for dependency in needs):
+                            del pending[step]
+                            if needs:
+                                data = MIND_handoff.merge([outputs[dependency] for dependency in needs])
+                                digest = digests.get(needs[0]) if len(needs) == 1 else None
+                            else:
+                                data, digest = initial
+                            logging.info("Starting step %02d after steps %s", step, needs)
+                            running[executor.submit(run_step, step, data, digest)] = step
+
+                if not running:
+                    if pending and not failed:
+                        raise ValueError(f"The steps {sorted(pending)} in [MIND_steps] depend on each other in a cycle.")
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    step = running.pop(future)
+                    data, output, error = future.result()
+                    script = scripts_by_step[step]
+                    if error:
+                        print(f"Error: {script} encountered an error.")
+                        logging.error("Error: %s encountered an error.", script)
+                        failed = True
+                        continue
+                    outputs[step] = data
+                    print(f"Output of {script}: {output}")
+
+        final = None
+        if not failed:
+            final_steps = [step for step in scripts_by_step if step not in needed]
+            final = MIND_handoff.merge([outputs[step] for step in final_steps])
+            if save_final:
+                # Leave the merged outputs of the final steps where a sequential run would
+                handoff = MIND_handoff.open_handoff(handoff_kind, work_dir / 'temp_data.pkl')
+                handoff.save(final)
+                final = handoff.load()
+            elif isinstance(final, MIND_handoff.LazyFrames):
+                # Its frames are still in the step directories, which go next
+                final = dict(final.items())
+    finally:
+        for step_dir in step_dirs.values():
+            step_dir.remove()
+
+    if failed:
+        sys.exit(1)  # Exit on error
+
+    return final
+
+def step_number(script_path):
+    """The two-digit step number at the end of a script name."""
+    return int(re.search(r'(\d{2})$', script_path.stem).group(1))
+
+def load_step_dependencies(config, scripts):
+    """
+    Reads the step graph from the [MIND_steps] section of config.ini, where each
+    key is a step number and its value the step numbers it depends on, e.g.
+
+        [MIND_steps]
+        05 = 03
+        08 = 03, 07
+
+    A step that is not listed depends on the step before it; a step listed with
+    no value depends on nothing. Dependencies outside the steps being run
+    (see start_step / end_step) are ignored. Returns None without the section.
+    """
+    if not config.has_section('MIND_steps'):
+        return None
+
+    declared = {
+        int(key): [int(value) for value in re.split(r'[,\s]+', values) if value]
+        for key, values in config.items('MIND_steps')
+    }
+    steps = [step_number(script) for script in scripts]
+
+    dependencies = {}
+    for index, step in enumerate(steps):
+        needs = declared[step] if step in declared else steps[max(index - 1, 0):index]
+        dependencies[step] = [dependency for dependency in needs if dependency in steps]
+    return dependencies
+
+def numeric_sort_key(script_path):
+    """Extracts the numeric part of the filename for sorting."""
+    match = re.search(r'(\d+)', script_path.stem)
+    return int(match.group(1)) if match else float('inf')
+
+def report_db_connections(report_dir, limit):
+    """How many database connections a report holds while it runs, from [MIND] db_connections (at most limit)."""
+    config = configparser.ConfigParser()
+    config.read(Path(report_dir) / 'config' / 'config.ini')
+    return min(config.getint('MIND', 'db_connections', fallback=1), limit)
+
+def latest_manifest(report_dir, since):
+    """The run manifest a report wrote after since, if any."""
+    log_dir = Path(report_dir).parents[1] / 'MIND_logs' / Path(report_dir).name
+    manifests = [path for path in log_dir.glob('manifest_*.json') if path.stat().st_mtime >= since]
+    return str(max(manifests, key=lambda path: path.stat().st_mtime)) if manifests else None
+
+def run_batch(report_dirs, max_reports=4, max_db_connections=4, options=()):
+    """
+    Runs several reports side by side, each as its own `python MIND.py <report>`
+    process, and writes one summary of them all to MIND_logs/batch.
+
+    Reports start in the order given while fewer than max_reports are running
+    and the database connections of the running reports (their [MIND]
+    db_connections, 1 by default) stay within max_db_connections. Returns True
+    when every report succeeded.
+    """
+    report_dirs = [Path(report_dir).resolve() for report_dir in report_dirs]
+    log_dir = report_dirs[0].parents[1] / 'MIND_logs' / 'batch'
+    log_dir.mkdir(parents=True, exist_ok=True)
+    timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+    log_file_path = log_dir / f"batch_{timestamp}.txt"
+    setup_logging(log_file_path)
+
+    weights = {report_dir: report_db_connections(report_dir, max_db_connections) for report_dir in report_dirs}
+    logging.info("Starting batch of %s reports with up to %s at a time and %s database connections: %s",
+                 len(report_dirs), max_reports, max_db_connections, {str(path): weight for path, weight in weights.items()})
+
+    def run_report(report_dir):
+        started = time.time()
+        result = subprocess.run(
+            ['python', str(MIND_PYTHON_DIR / 'MIND.py'), str(report_dir)] + list(options),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True
+        )
+        finished = time.time()
+        with open(log_file_path, 'a') as log:
+            log.write(f"Output of {report_dir.name}:\n")
+            log.write(result.stdout)
+            log.write("\n\n")
+        return {
+            'report': report_dir.name,
+            'report_dir': str(report_dir),
+            'exit_status': result.returncode,
+            'started': datetime.datetime.fromtimestamp(started).isoformat(timespec='seconds'),
+            'finished': datetime.datetime.fromtimestamp(finished).isoformat(timespec='seconds'),
+            'wall_seconds': round(finished - started, 3),
+            'db_connections': weights[report_dir],
+            'manifest': latest_manifest(report_dir, started),
+        }
+
+    batch_started = time.time()
+    pending = list(report_dirs)
+    running = {}
+    results = []
+    with ThreadPoolExecutor(max_workers=max_reports) as executor:
+        while pending or running:
+            connections = sum(weights[report_dir] for report_dir in running.values())
+            for report_dir in list(pending):
+                if len(running) >= max_reports:
+                    break
+                if connections + weights[report_dir] <= max_db_connections:
+                    pending.remove(report_dir)
+                    connections += weights[report_dir]
+                    logging.info("Starting %s", report_dir.name)
+                    running[executor.submit(run_report, report_dir)] = report_dir
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                report_dir = running.pop(future)
+                result = future.result()
+                results.append(result)
+                if result['exit_status'] != 0:
+                    print(f"Error: {report_dir.name} exited with status {result['exit_status']}.")
+                    logging.error("Error: %s exited with status %s.", report_dir.name, result['exit_status'])
+                else:
+                    print(f"{report_dir.name} finished in {result['wall_seconds']:.0f}s.")
+                    logging.info("%s finished in %.0fs", report_dir.name, result['wall_seconds'])
+
+    summary = {
+        'started': datetime.datetime.fromtimestamp(batch_started).isoformat(timespec='seconds'),
+        'finished': datetime.datetime.now().isoformat(timespec='seconds'),
+        'wall_seconds': round(time.time() - batch_started, 3),
+        'max_reports': max_reports,
+        'max_db_connections': max_db_connections,
+        'log_file': str(log_file_path),
+        'reports': sorted(results, key=lambda result: report_dirs.index(Path(result['report_dir']))),
+    }
+    with open(log_dir / f"batch_{timestamp}.json", 'w') as f:
+        json.dump(summary, f, indent=2)
+
+    return all(result['exit_status'] == 0 for result in results)
+
+def write_metrics(config, base_dir):
+    """Writes the finished run's metrics where node_exporter's textfile collector reads them."""
+    metrics_dir = config.get('MIND', 'metrics_dir', fallback='') or base_dir.parents[1] / 'MIND_logs' / 'metrics'
+    try:
+        MIND_metrics.write_textfile(Path(metrics_dir) / f"mind_{base_dir.name}.prom", RUN_MANIFEST.run)
+    except (OSError, ValueError) as e:
+        logging.warning("Could not write the run's metrics to %s: %s", metrics_dir, e)
+
+def run_mode(start_step, end_step, overrides, resume_from):
+    """The run's mode in the run history: 'override', 'partial' or 'full'. See MIND_history."""
+    if overrides:
+        return 'override'
+    if start_step is not None or end_step is not None or resume_from:
+        return 'partial'
+    return 'full'
+
+def check_for_regressions(config, base_dir):
+    """
+    Adds the finished run, failed or not, to the run history and, for a
+    succeeded full run, emails an alert for steps that ran much slower than
+    their recent runs. See MIND_history.
+    """
+    history_db = config.get('MIND', 'history_db', fallback='') or base_dir.parents[1] / 'MIND_logs' / 'history.sqlite'
+    percent = config.getfloat('MIND', 'regression_alert_percent', fallback=50)
+    try:
+        history = MIND_history.RunHistory(history_db)
+        try:
+            run_id = history.record(RUN_MANIFEST.run)
+            if percent <= 0 or RUN_MANIFEST.run['status'] != 'succeeded' or RUN_MANIFEST.run['settings']['mode'] != 'full':
+                return
+            regressions = history.regressions(run_id, RUN_MANIFEST.run, percent,
+                                              baseline_runs=config.getint('MIND', 'regression_baseline_runs', fallback=10),
+                                              min_seconds=config.getfloat('MIND', 'regression_min_seconds', fallback=30))
+        finally:
+            history.close()
+        if regressions:
+            subject, body = MIND_history.describe(base_dir.name, regressions, percent, RUN_MANIFEST.run['log_file'])
+            logging.warning("%s\n%s", subject, body)
+            send_email(subject, body, os.getenv('EMAIL_error_to_email'))
+    except Exception as e:
+        # The run itself is done; a failed history update or alert must not fail it
+        logging.error("Could not update the run history or send the regression alert: %s", e)
+
+def label_suffix(label):
+    """A run label as it appears at the end of log and manifest file names."""
+    return re.sub(r'[^\w-]', '_', label)
+
+def sweep_values(spec):
+    """
+    The values of a --sweep: a comma-separated list, a range of days
+    2024-01-01..2024-01-31, or a range of whole numbers 2019..2024. Ends are
+    included.
+    """
+    if '..' not in spec:
+        return [value.strip() for value in spec.split(',') if value.strip()]
+    first, last = (part.strip() for part in spec.split('..', 1))
+    if first.isdigit() and last.isdigit():
+        return [str(value) for value in range(int(first), int(last) + 1)]
+    first = datetime.date.fromisoformat(first)
+    last = datetime.date.fromisoformat(last)
+    return [(first + datetime.timedelta(days=days)).isoformat() for days in range((last - first).days + 1)]
+
+def run_sweep(base_dir, key, values, start_step=None, end_step=None, options=()):
+    """
+    Runs a report once for each value of the config.ini setting key, as for a
+    backfill of a date-windowed report, and writes one summary of the runs to
+    MIND_logs/<report>/sweep_<timestamp>.json.
+
+    With [MIND_sweep] fan_out_from set, the steps before that step run only
+    once, with the other [MIND_sweep] keys set for them: each is a config.ini
+    setting whose value may use {first} and {last}, the lowest and highest
+    value of the sweep, so they extract the data for the whole window. Only
+    the steps from fan_out_from on then run for every value, max_parallel (4
+    by default) at a time, each starting from a copy of what that run left.
+    Without fan_out_from every value gets a full run. Returns True when every
+    run succeeded.
+    """
+    base_dir = Path(base_dir).resolve()
+    config = configparser.ConfigParser()
+    config.read(base_dir / 'config' / 'config.ini')
+    settings = dict(config.items('MIND_sweep')) if config.has_section('MIND_sweep') else {}
+    fan_out_from = settings.pop('fan_out_from', None)
+    max_parallel = int(settings.pop('max_parallel', 4))
+
+    log_dir = base_dir.parents[1] / 'MIND_logs' / base_dir.name
+    log_dir.mkdir(parents=True, exist_ok=True)
+    timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+    log_file_path = log_dir / f"sweep_{timestamp}.txt"
+    setup_logging(log_file_path)
+    logging.info("Sweeping %s over %s values of %s: %s", base_dir.name, len(values), key, values)
+
+    mind = ['python', str(MIND_PYTHON_DIR / 'MIND.py'), str(base_dir)]
+
+    def run(label, steps, arguments):
+        started = time.time()
+        result = subprocess.run(
+            mind + steps + list(options) + arguments + ['--run-label', label],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True
+        )
+        finished = time.time()
+        with open(log_file_path, 'a') as log:
+            log.write(f"Output of the {label} run:\n")
+            log.write(result.stdout)
+            log.write("\n\n")
+        manifests = [path for path in log_dir.glob(f"manifest_*_{label_suffix(label)}.json")
+                     if path.stat().st_mtime >= started]
+        manifest = str(max(manifests, key=lambda path: path.stat().st_mtime)) if manifests else None
+        status = 'failed'
+        if result.returncode == 0 and manifest is not None:
+            with open(manifest, 'r') as f:
+                status = json.load(f)['status']
+        return {
+            'run': label,
+            'status': status,
+            'exit_status': result.returncode,
+            'started': datetime.datetime.fromtimestamp(started).isoformat(timespec='seconds'),
+            'finished': datetime.datetime.fromtimestamp(finished).isoformat(timespec='seconds'),
+            'wall_seconds': round(finished - started, 3),
+            'manifest': manifest,
+        }
+
+    sweep_started = time.time()
+    runs = []
+    snapshot = None
+    steps = [start_step or '00', end_step] if end_step else ([start_step] if start_step else [])
+    if fan_out_from is not None:
+        fan_out_from = int(fan_out_from)
+        ordered = sorted(values)
+        window = {setting: template.format(first=ordered[0], last=ordered[-1]) for setting, template in settings.items()}
+        arguments = [argument for setting, value in window.items() for argument in ('--set', f"{setting}={value}")]
+        print(f"Running the steps before {fan_out_from:02d} once for {ordered[0]} to {ordered[-1]}.")
+        logging.info("Running the steps before %02d once with %s", fan_out_from, window)
+        shared = run('shared', [start_step or '00', str(fan_out_from - 1)], arguments)
+        shared['settings'] = window
+        runs.append(shared)
+        if shared['status'] != 'succeeded':
+            logging.error("The shared steps failed; not fanning out.")
+            print("Error: the shared steps failed; not fanning out.")
+        else:
+            # A copy of what the shared steps left, so a run of the report meanwhile cannot change it
+            snapshot = base_dir.parents[1] / 'MIND_runs' / base_dir.name / f"sweep_{timestamp}"
+            snapshot.mkdir(parents=True)
+            for entry in (base_dir / 'python').glob('temp_*'):
+                if entry.is_dir():
+                    shutil.copytree(entry, snapshot / entry.name)
+                else:
+                    shutil.copy2(entry, snapshot / entry.name)
+        steps = [str(fan_out_from)] + ([end_step] if end_step else [])
+
+    if fan_out_from is None or snapshot is not None:
+        resume = ['--resume-from', str(snapshot)] if snapshot is not None else []
+        with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+            futures = {executor.submit(run, value, steps, ['--set', f"{key}={value}"] + resume): value for value in values}
+            for future in futures:
+                result = future.result()
+                result[key] = futures[future]
+                runs.append(result)
+                if result['status'] != 'succeeded':
+                    print(f"Error: the run for {key} = {futures[future]} {result['status']}.")
+                    logging.error("The run for %s = %s %s.", key, futures[future], result['status'])
+                else:
+                    print(f"{key} = {futures[future]} finished in {result['wall_seconds']:.0f}s.")
+                    logging.info("%s = %s finished in %.0fs", key, futures[future], result['wall_seconds'])
+        if snapshot is not None:
+            shutil.rmtree(snapshot, ignore_errors=True)
+
+    summary = {
+        'report': base_dir.name,
+        'key': key,
+        'values': values,
+        'fan_out_from': fan_out_from,
+        'max_parallel': max_parallel,
+        'started': datetime.datetime.fromtimestamp(sweep_started).isoformat(timespec='seconds'),
+        'finished': datetime.datetime.now().isoformat(timespec='seconds'),
+        'wall_seconds': round(time.time() - sweep_started, 3),
+        'log_file': str(log_file_path),
+        'runs': runs,
+    }
+    with open(log_dir / f"sweep_{timestamp}.json", 'w') as f:
+        json.dump(summary, f, indent=2)
+
+    return len(runs) == len(values) + (fan_out_from is not None) and all(run['status'] == 'succeeded' for run in runs)
+
+def apply_overrides(config, overrides):
+    """
+    Sets each key of overrides in every section of config that has it, or in
+    [report] when none does, the way an edit of config.ini would.
+    """
+    for key, value in overrides.items():
+        sections = [section for section in config.sections() if config.has_option(section, key)]
+        if not sections:
+            if not config.has_section('report'):
+                config.add_section('report')
+            sections = ['report']
+        for section in sections:
+            config.set(section, key, str(value))
+
+def load_report_config(base_dir, overrides=None):
+    """
+    Reads a report's config.ini, with overrides applied (see apply_overrides).
+    Returns the ConfigParser and the parameters passed to the steps: every
+    setting outside the runner's own [MIND] sections, and the config file's path.
+    """
+    config_file = Path(base_dir) / 'config' / 'config.ini'
+    if not config_file.exists() or not config_file.is_file():
+        raise FileNotFoundError(f"The config file {config_file} does not exist.")
+
+    config = configparser.ConfigParser()
+    config.read(config_file)
+    if overrides:
+        logging.info("Overriding config.ini settings for this run: %s", overrides)
+        apply_overrides(config, overrides)
+
+    parameters_dict = {
+        "report_config_file_path": str(config_file),
+    }
+
+    # The [MIND] sections configure the runner itself and are not passed to the steps
+    for section in config.sections():
+        if section == 'MIND' or section.startswith('MIND_'):
+            continue
+        for key, value in config.items(section):
+            parameters_dict[key] = value
+
+    return config, parameters_dict
+
+def discover_steps(python_dir, start_step=None, end_step=None):
+    """
+    The step scripts of a report in the order they run: every script in
+    python_dir whose name ends in a two-digit number, from start_step to
+    end_step when given. Raises ValueError when no script is at or after start_step.
+    """
+    # Only include scripts with a two-digit number at the end before .py
+    scripts = [script for script in sorted(Path(python_dir).glob('*.py'), key=numeric_sort_key) if re.search(r'\d{2}\.py$', script.name)]
+
+    if start_step is not None:
+        start_index = next((i for i, script in enumerate(scripts) if numeric_sort_key(script) >= int(start_step)), None)
+        if start_index is None:
+            raise ValueError(f"No script found for starting step {start_step}")
+        scripts = scripts[start_index:]
+
+    if end_step is not None:
+        end_index = next((i for i, script in enumerate(scripts) if numeric_sort_key(script) > int(end_step)), None)
+        if end_index is not None:
+            scripts = scripts[:end_index]
+
+    return scripts
+
+def main(base_dir=None, start_step=None, end_step=None, parameters=None, in_process=False, handoff_kind=None, profile=None,
+         trace_memory=None, overrides=None, resume_from=None, run_label=None, save_final=True, publish=True):
+    """
+    Runs a report's steps from start_step to end_step and returns the final
+    payload. With save_final off it is not also left in the report's
+    temp_data.pkl, and with publish off nothing the run leaves in its run
+    directory is moved back into the report. Exits when a step fails.
+    """
+    if not base_dir:
+        print("Usage: python MIND.py <base_directory> [start_step] [end_step] [parameters...] [--in-process] [--handoff pickle|arrow]")
+        logging.error("Base directory is required.")
+        sys.exit(1)
+
+    base_dir = Path(base_dir).resolve()
+    python_dir = base_dir / 'python'
+    log_dir = base_dir.parents[1] / 'MIND_logs' / base_dir.name
+
+    log_dir.mkdir(parents=True, exist_ok=True)
+    timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+    if run_label:
+        # Runs of one sweep start in the same second
+        timestamp = f"{timestamp}_{label_suffix(run_label)}"
+    # So do runs made one after another through run()
+    stamp, repeat = timestamp, 1
+    while (log_dir / f"log_{timestamp}.txt").exists():
+        repeat += 1
+        timestamp = f"{stamp}_{repeat}"
+    log_file_path = log_dir / f"log_{timestamp}.txt"
+    
+    setup_logging(log_file_path)
+    global RUN_MANIFEST, WARM_POOL, PROFILE_STEPS, MEMORY_STEPS, MEMORY_INTERVAL
+
+    config, parameters_dict = load_report_config(base_dir, overrides)
+
+    in_process = in_process or config.getboolean('MIND', 'in_process', fallback=False)
+    if in_process:
+        # Subprocess steps are counted by MIND_step.py
+        MIND_metrics.instrument()
+    handoff_kind = handoff_kind or config.get('MIND', 'handoff', fallback='pickle').strip().lower() or 'pickle'
+    if handoff_kind not in ('pickle', 'arrow'):
+        raise ValueError(f"Unknown handoff '{handoff_kind}' in {base_dir / 'config' / 'config.ini'}; expected pickle or arrow.")
+    if handoff_kind == 'arrow' and importlib.util.find_spec('pyarrow') is None:
+        print("Warning: handoff = arrow needs pyarrow, which is not installed. Falling back to pickle.")
+        logging.warning("handoff = arrow needs pyarrow, which is not installed. Falling back to pickle.")
+        handoff_kind = 'pickle'
+
+    start_step = int(start_step) if start_step is not None else None
+    end_step = int(end_step) if end_step is not None else None
+    try:
+        scripts = discover_steps(python_dir, start_step, end_step)
+    except ValueError as e:
+        print(f"Error: {e}")
+        logging.error("%s", e)
+        sys.exit(1)
+
+    logging.info("Starting MIND script with base directory: %s, start step: %s, end step: %s, in process: %s, handoff: %s, and parameters: %s", base_dir, start_step, end_step, in_process, handoff_kind, parameters_dict)
+
+    RUN_MANIFEST = MIND_telemetry.RunManifest(log_dir / f"manifest_{timestamp}.json", base_dir.name, log_file_path, {
+        'start_step': start_step, 'end_step': end_step, 'in_process': in_process, 'handoff': handoff_kind,
+        'mode': run_mode(start_step, end_step, overrides, resume_from),
+    })
+    
+    if scripts:
+        # Each run works in a directory of its own, so runs of the same report can overlap
+        runs_dir = base_dir.parents[1] / 'MIND_runs' / base_dir.name
+        MIND_rundir.RunDirectory.prune(base_dir, runs_dir)
+        run_dir = MIND_rundir.RunDirectory(base_dir, runs_dir, f"{timestamp}_{os.getpid()}").create(
+            resume=start_step is not None, resume_from=resume_from, config=config if overrides else None)
+        work_dir = run_dir.python_dir
+        if overrides:
+            # Steps reading config.ini see the run's own copy with the overrides in it
+            parameters_dict['report_config_file_path'] = str(run_dir.path / 'config' / 'config.ini')
+        os.environ['MIND_RUN_DIR'] = str(run_dir.path)
+        # MIND_db keeps each database to the connections the report declares
+        os.environ['MIND_DB_CONNECTIONS'] = str(max(config.getint('MIND', 'db_connections', fallback=1), 1))
+        os.environ['MIND_QUERY_CACHE'] = 'on' if config.getboolean('MIND', 'query_cache', fallback=False) else 'off'
+        os.environ['MIND_NOTES_MIRROR'] = 'on' if config.getboolean('MIND', 'notes_mirror', fallback=True) else 'off'
+        logging.info("Working in run directory %s", run_dir.path)
+
+        warm_workers = config.getint('MIND', 'warm_workers', fallback=0)
+        if warm_workers > 0:
+            logging.info("Keeping %s warm step processes ready", warm_workers)
+            WARM_POOL = MIND_workers.WarmPool(warm_workers, step_environment())
+
+        cache = MIND_cache.StepCache.from_config(config, base_dir.parents[1] / 'MIND_cache' / base_dir.name, handoff_kind,
+                                                 run_id=run_dir.path.name)
+        initial = (None, None)
+        resume_point = None
+        if cache is not None and start_step is not None:
+            # Pick up the output the step before start_step left in the last run
+            resume_point = cache.resume_point(start_step, work_dir / 'temp_params.json')
+            if resume_point is not None:
+                logging.info("Resuming at step %s with the cached output of the step before it", start_step)
+                initial = resume_point
+        # Without a cached resume point, a resumed run starts from the temp_data.pkl copied into its run directory
+        resumed = (start_step is not None or bool(resume_from)) and resume_point is None
+        if resume_from and resumed:
+            # A sweep run picks up the saved parameters the shared steps left, but its own settings win
+            saved = {}
+            if (work_dir / 'temp_params.json').exists():
+                with open(work_dir / 'temp_params.json', 'r') as f:
+                    saved = json.load(f)
+            saved.update(parameters_dict)
+            with open(work_dir / 'temp_params.json', 'w') as f:
+                json.dump(saved, f)
+
+        dependencies = load_step_dependencies(config, scripts)
+        timeouts = MIND_limits.StepTimeouts(config)
+        PROFILE_STEPS = parse_steps(profile or config.get('MIND', 'profile', fallback=''))
+        MEMORY_STEPS = parse_steps(trace_memory or config.get('MIND', 'trace_memory', fallback=''))
+        MEMORY_INTERVAL = config.getfloat('MIND', 'trace_memory_interval_seconds', fallback=0)
+        if PROFILE_STEPS or MEMORY_STEPS:
+            logging.info("Profiling steps: %s; tracing the memory of steps: %s", PROFILE_STEPS, MEMORY_STEPS)
+        status = 'failed'
+        try:
+            # A failed step exits, so getting a payload back means every step succeeded
+            if dependencies is None:
+                payload = run_scripts_sequentially(scripts, parameters_dict, log_file_path, in_process=in_process,
+                                                   handoff_kind=handoff_kind, cache=cache, initial=initial, work_dir=work_dir,
+                                                   timeouts=timeouts, save_final=save_final, resumed=resumed)
+            else:
+                max_workers = config.getint('MIND', 'max_workers', fallback=4)
+                logging.info("Running steps as a graph with up to %s workers: %s", max_workers, dependencies)
+                payload = run_scripts_as_dag(scripts, dependencies, parameters_dict, log_file_path, in_process=in_process,
+                                             handoff_kind=handoff_kind, max_workers=max_workers, cache=cache, initial=initial,
+                                             work_dir=work_dir, timeouts=timeouts, save_final=save_final, resumed=resumed)
+            status = 'succeeded'
+        finally:
+            RUN_MANIFEST.finish(status)
+            write_metrics(config, base_dir)
+            if publish:
+                # Leave the run's files in the report, where a restart from start_step finds them
+                run_dir.publish()
+            run_dir.remove()
+            if WARM_POOL is not None:
+                WARM_POOL.close()
+                WARM_POOL = None
+            if cache is not None:
+                cache.evict()
+            # Failed and timed-out runs go into the history too
+            check_for_regressions(config, base_dir)
+        return payload
+    else:
+        logging.error("No scripts found to execute.")
+        print("No scripts found to execute.")
+        RUN_MANIFEST.finish('failed')
+        write_metrics(config, base_dir)
+
+class StepFailed(Exception):
+    """Raised by run() when a step of the report fails. The run's log has the step's output."""
+
+def run(report_dir, params=None, start_step=None, end_step=None, send_alerts=False):
+    r"""
+    Runs a report from Python and returns its final payload, the DataFrame or
+    dict of DataFrames the last step saved:
+
+        import sys
+        sys.path.append(r'C:\MIND\MIND\MIND_python')
+        import MIND
+        frames = MIND.run(r'C:\MIND\MIND_reports\med_error_report', {'yesterday_sheet': '2024-01-31'}, end_step=11)
+
+    params override config.ini settings for this run, as --set does. The
+    steps run in this interpreter and hand their payloads over in memory,
+    so nothing goes through temp_data.pkl; steps that call exit() or have a
+    time limit still run as subprocesses. The run is logged and recorded
+    like any other, but failures and slow runs are only emailed with
+    send_alerts. Raises StepFailed when a step fails.
+
+    The report's python/ directory is left as it was: temp_params.json and
+    the other files the steps leave are removed with the run directory. The
+    caller's logging handlers, environment variables and libraries are
+    restored when the run ends.
+    """
+    global SEND_ALERTS, LOG_HANDLER
+    root = logging.getLogger()
+    saved_alerts, SEND_ALERTS = SEND_ALERTS, send_alerts
+    saved_logging = (LOG_HANDLER, list(root.handlers), root.level)
+    saved_environ = dict(os.environ)
+    was_instrumented = MIND_metrics.instrumented()
+    # So setup_logging() leaves a handler of the caller's alone
+    LOG_HANDLER = None
+    try:
+        return main(report_dir, start_step, end_step, in_process=True, overrides=params, save_final=False, publish=False)
+    except SystemExit:
+        log_file = RUN_MANIFEST.run['log_file'] if RUN_MANIFEST is not None else None
+        raise StepFailed(f"{Path(report_dir).name} failed; see {log_file or 'its log'}") from None
+    finally:
+        SEND_ALERTS = saved_alerts
+        if LOG_HANDLER is not None:
+            root.removeHandler(LOG_HANDLER)
+            LOG_HANDLER.close()
+        LOG_HANDLER, root.handlers[:], level = saved_logging
+        root.setLevel(level)
+        os.environ.clear()
+        os.environ.update(saved_environ)
+        if not was_instrumented:
+            MIND_metrics.uninstrument()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(usage="python MIND.py <base_directory> [start_step] [end_step] [parameters...] [--in-process] [--handoff pickle|arrow] [--set key=value] [--sweep key=values] | python MIND.py --batch <base_directory>...")
+    parser.add_argument('base_directory', nargs='?')
+    parser.add_argument('start_step', nargs='?')
+    parser.add_argument('end_step', nargs='?')
+    parser.add_argument('parameters', nargs='*')
+    parser.add_argument('--in-process', action='store_true',
+                        help="run the steps inside this interpreter and pass data between them in memory")
+    parser.add_argument('--handoff', choices=['pickle', 'arrow'],
+                        help="how subprocess steps pass data: one temp_data.pkl, or one Arrow file per DataFrame")
+    parser.add_argument('--profile', metavar='STEPS',
+                        help="profile these steps ('all' or step numbers such as 03,05) into files next to the log")
+    parser.add_argument('--trace-memory', metavar='STEPS',
+                        help="trace the memory of these steps ('all' or step numbers) into files next to the log")
+    parser.add_argument('--batch', nargs='+', metavar='base_directory',
+                        help="run several reports side by side; a .txt file lists one report directory per line")
+    parser.add_argument('--max-reports', type=int, default=4,
+                        help="how many reports of a batch may run at the same time")
+    parser.add_argument('--max-db-connections', type=int, default=4,
+                        help="how many database connections the running reports of a batch may hold in total")
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help="override a config.ini setting for this run")
+    parser.add_argument('--sweep', metavar='KEY=VALUES',
+                        help="run once for each value of a config.ini setting: a,b,c or 2024-01-01..2024-01-31 or 2019..2024")
+    parser.add_argument('--resume-from', metavar='DIR', help=argparse.SUPPRESS)
+    parser.add_argument('--run-label', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.batch:
+        report_dirs = []
+        for entry in args.batch:
+            if entry.lower().endswith('.txt'):
+                with open(entry, 'r') as f:
+                    report_dirs += [line.strip() for line in f if line.strip() and not line.startswith('#')]
+            else:
+                report_dirs.append(entry)
+        options = (['--in-process'] if args.in_process else []) + (['--handoff', args.handoff] if args.handoff else []) \
+            + (['--profile', args.profile] if args.profile else []) \
+            + (['--trace-memory', args.trace_memory] if args.trace_memory else [])
+        success = run_batch(report_dirs, max_reports=args.max_reports, max_db_connections=args.max_db_connections, options=options)
+        sys.exit(0 if success else 1)
+
+    base_directory = Path(args.base_directory).resolve() if args.base_directory else None
+    start_step = args.start_step if args.start_step and args.start_step.isdigit() else None
+    end_step = args.end_step if args.end_step and args.end_step.isdigit() else None
+    parameters = args.parameters
+
+    if not base_directory or not base_directory.exists() or not base_directory.is_dir():
+        print("Usage: python MIND.py <base_directory> [start_step] [end_step] [parameters...] [--in-process] [--handoff pickle|arrow]")
+        logging.error("Invalid base directory.")
+        sys.exit(1)
+
+    overrides = {}
+    for setting in args.set:
+        key, separator, value = setting.partition('=')
+        if not separator:
+            parser.error(f"--set expects KEY=VALUE, not '{setting}'")
+        overrides[key.strip().lower()] = value.strip()
+
+    if args.sweep:
+        key, separator, spec = args.sweep.partition('=')
+        if not separator:
+            parser.error(f"--sweep expects KEY=VALUES, not '{args.sweep}'")
+        options = (['--in-process'] if args.in_process else []) + (['--handoff', args.handoff] if args.handoff else []) \
+            + [argument for setting in args.set for argument in ('--set', setting)]
+        success = run_sweep(base_directory, key.strip().lower(), sweep_values(spec), start_step, end_step, options=options)
+        sys.exit(0 if success else 1)
+
+    main(base_directory, start_step, end_step, parameters, in_process=args.in_process, handoff_kind=args.handoff, profile=args.profile,
+         trace_memory=args.trace_memory, overrides=overrides, resume_from=args.resume_from, run_label=args.run_label)
@@ -0,0 +1,209 @@
+import os
+import json
+import time
+import uuid
+import shutil
+import pickle
+import hashlib
+import logging
+import threading
+from pathlib import Path
+
+import MIND_handoff
+
+
+def hash_payload(data, digest=None):
+    """
+    Content hash of a step payload. DataFrames are hashed column-wise with
+    pandas, so a payload is never serialized just to be hashed.
+    """
+    digest = digest or hashlib.sha256()
+    try:
+        import pandas as pd
+    except ImportError:
+        pd = None
+
+    if pd is not None and isinstance(data, pd.DataFrame):
+        digest.update(repr((list(data.columns), [str(dtype) for dtype in data.dtypes])).encode())
+        try:
+            digest.update(pd.util.hash_pandas_object(data, index=True).values.tobytes())
+        except TypeError:
+            # Unhashable cells (lists, dicts) fall back to the pickled bytes
+            digest.update(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+    elif isinstance(data, dict):
+        digest.update(b'dict')
+        for key in data:
+            digest.update(repr(key).encode())
+            hash_payload(data[key], digest)
+    else:
+        digest.update(pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL))
+    return digest
+
+
+class StepCache:
+    """
+    Content-addressed cache of step outputs for one report.
+
+    An entry is keyed by the step's source, the hash of its input payload and
+    its parameters, and holds the payload the step saved plus the
+    temp_params.json it left behind. Entries older than max_age_hours are
+    ignored and removed; beyond max_mb the least recently used go first.
+
+    <directory>/<key>/entry.json      step, digest, created, last_used, size
+    <directory>/<key>/payload.pkl     (or payload_frames/ with the Arrow handoff)
+    <directory>/<key>/params.json
+    <directory>/journal/<run_id>.json step number -> key of the output of one run
+
+    Each run writes a journal of its own, so runs of the report at the same
+    time do not overwrite each other's; a restart reads them oldest first,
+    so the newest output of every step wins.
+    """
+
+    def __init__(self, directory, steps='all', handoff_kind='pickle', max_age_hours=24, max_mb=2048, run_id=None):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.steps = steps
+        self.handoff_kind = handoff_kind
+        self.max_age = max_age_hours * 3600
+        self.max_bytes = max_mb * 1024 * 1024
+        self.journal_dir = self.directory / 'journal'
+        self.run_id = run_id or uuid.uuid4().hex
+        self.run_journal = {}
+        self.journal_lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config, directory, handoff_kind, run_id=None):
+        """The cache configured by [MIND] cache_steps, or None when caching is off."""
+        steps = config.get('MIND', 'cache_steps', fallback='').strip().lower()
+        if not steps:
+            return None
+        if steps != 'all':
+            steps = {int(step) for step in steps.replace(',', ' ').split()}
+        return cls(
+            directory,
+            steps=steps,
+            handoff_kind=handoff_kind,
+            max_age_hours=config.getfloat('MIND', 'cache_max_age_hours', fallback=24),
+            max_mb=config.getfloat('MIND', 'cache_max_mb', fallback=2048),
+            run_id=run_id,
+        )
+
+    def caches(self, step):
+        return self.steps == 'all' or step in self.steps
+
+    def key(self, script_path, input_digest, parameters):
+        digest = hashlib.sha256()
+        digest.update(Path(script_path).read_bytes())
+        digest.update((input_digest or '').encode())
+        digest.update(json.dumps(parameters, sort_keys=True, default=str).encode())
+        digest.update(self.handoff_kind.encode())
+        return digest.hexdigest()
+
+    def _entry(self, key):
+        entry_file = self.directory / key / 'entry.json'
+        if not entry_file.exists():
+            return None
+        with open(entry_file, 'r') as f:
+            entry = json.load(f)
+        if time.time() - entry['created'] > self.max_age:
+            return None
+        return entry
+
+    def get(self, key, temp_param_file):
+        """
+        Returns (data, digest) of a fresh entry and restores the step's
+        temp_params.json, or None on a miss.
+        """
+        entry = self._entry(key)
+        if entry is None:
+            return None
+        entry_dir = self.directory / key
+        data = MIND_handoff.open_handoff(self.handoff_kind, entry_dir / 'payload.pkl').load()
+        shutil.copyfile(entry_dir / 'params.json', temp_param_file)
+
+        entry['last_used'] = time.time()
+        with open(entry_dir / 'entry.json', 'w') as f:
+            json.dump(entry, f)
+        return data, entry['digest']
+
+    def put(self, key, step, data, temp_param_file):
+        """Stores a step's output and returns its content hash."""
+        digest = hash_payload(data).hexdigest()
+        entry_dir = self.directory / key
+        if entry_dir.exists():
+            shutil.rmtree(entry_dir, ignore_errors=True)
+        entry_dir.mkdir(parents=True)
+
+        MIND_handoff.open_handoff(self.handoff_kind, entry_dir / 'payload.pkl').save(data)
+        shutil.copyfile(temp_param_file, entry_dir / 'params.json')
+
+        now = time.time()
+        size = sum(path.stat().st_size for path in entry_dir.rglob('*') if path.is_file())
+        with open(entry_dir / 'entry.json', 'w') as f:
+            json.dump({'step': step, 'digest': digest, 'created': now, 'last_used': now, 'size': size}, f)
+        return digest
+
+    def record(self, step, key):
+        """Remembers which entry holds the latest output of a step, for restarts from start_step."""
+        with self.journal_lock:
+            self.run_journal[str(step)] = key
+            self.journal_dir.mkdir(exist_ok=True)
+            journal_file = self.journal_dir / f"{self.run_id}.json"
+            partial = journal_file.with_name(f"{journal_file.name}.tmp")
+            with open(partial, 'w') as f:
+                json.dump(self.run_journal, f)
+            os.replace(partial, journal_file)
+
+    def resume_point(self, start_step, temp_param_file):
+        """
+        The (data, digest) the step before start_step left in the last run,
+        or None when it is not cached. Restores that step's temp_params.json.
+        """
+        journal = self._journal()
+        earlier = [int(step) for step in journal if int(step) < start_step]
+        if not earlier:
+            return None
+        return self.get(journal[str(max(earlier))], temp_param_file)
+
+    def _journal(self):
+        """The runs' journals laid over each other, oldest first."""
+        journal = {}
+        if not self.journal_dir.exists():
+            return journal
+        for journal_file in sorted(self.journal_dir.glob('*.json'), key=lambda path: path.stat().st_mtime):
+            try:
+                with open(journal_file, 'r') as f:
+                    journal.update(json.load(f))
+            except (OSError, ValueError):
+                # Removed by another run's evict() meanwhile
+                continue
+        return journal
+
+    def evict(self):
+        """
+        Removes expired entries and journals, then the least recently used
+        entries until under the quota.
+        """
+        now = time.time()
+        for journal_file in self.journal_dir.glob('*.json'):
+            try:
+                if now - journal_file.stat().st_mtime > self.max_age:
+                    journal_file.unlink()
+            except OSError:
+                pass
+        entries = []
+        for entry_file in self.directory.glob('*/entry.json'):
+            with open(entry_file, 'r') as f:
+                entry = json.load(f)
+            if now - entry['created'] > self.max_age:
+                shutil.rmtree(entry_file.parent, ignore_errors=True)
+                continue
+            entries.append((entry['last_used'], entry['size'], entry_file.parent))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry_dir in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            logging.info("Evicting cached step output %s", entry_dir.name)
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
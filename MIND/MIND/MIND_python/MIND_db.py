@@ -0,0 +1,492 @@
+"""
+Pooled connections to the Avatar databases for report steps.
+
+    import MIND_db
+    with MIND_db.connection('CWS') as conn:
+        df = pd.read_sql(query, conn)
+
+    df = MIND_db.read_sql(query, 'PM', params=[start, stop])
+
+    frames = MIND_db.read_queries({
+        'notes': (notes_sql, 'CWS', [start, stop]),
+        'coverage': (coverage_sql, 'PM'),
+    })
+
+A database is named by its variable in MIND.env without the `database`
+prefix: 'CWS' is databaseCWS and 'PM' is databasePM. The driver, server,
+port and credentials are the shared database_* variables. A step that
+builds its own connection string can pass that instead of a name.
+
+Connections are kept open in a pool per database for the life of the
+process and handed out again when the `with` block ends, so the queries of
+a step, and every step of an in-process run, share a few connections
+instead of each opening their own. At most MIND_DB_CONNECTIONS connections
+are open to each database (MIND.py sets it from [MIND] db_connections);
+more callers wait for one to be handed back, so do not nest two
+connection() blocks for the same database. A connection that has been idle
+for PROBE_AFTER_SECONDS is checked with a cheap query before it is handed
+out, and replaced if the check fails.
+
+Failed connects are retried with a backoff shared by everyone using the
+database: every failure in a row doubles the wait before the next attempt
+(5s, 10s, 20s ... up to 2 minutes, give or take a fifth), and a success
+resets it, so steps back off together when the server is struggling
+instead of each hammering it on a fixed schedule.
+
+read_queries() runs independent queries side by side, each on a connection
+of its own, so loading them takes about as long as the slowest one instead
+of all of them added up. With the default of one connection per database,
+queries to the same database still run one after another; read_queries()
+warns when that happens, and the report should set [MIND] db_connections.
+
+read_chunks() fetches a large result CHUNK_ROWS rows at a time and yields
+each chunk as a DataFrame, so a step can filter or aggregate the chunks as
+they come and never hold the whole table:
+
+    recent = MIND_db.read_chunked(query, 'CWS', lambda chunk: chunk[chunk.PATID.isin(patids)])
+
+In reports that set query_cache = true in [MIND], read_sql() and
+read_queries() answer queries of the tables listed in
+MIND_config/query_cache.ini from the query cache shared by all reports
+(MIND_querycache), so those reports run in the same window query the server
+once between them. read_chunks() always reads from the database.
+
+read_keyed() runs a query for a list of keys (PATIDs, say) too long to
+write into the query as IN (...): the keys go into a temporary table on the
+connection and the query joins to it.
+"""
+import os
+import sys
+import time
+import atexit
+import random
+import threading
+from contextlib import contextmanager
+
+import pyodbc
+
+import MIND_querycache
+
+PROBE_AFTER_SECONDS = 60
+PROBE_SQL = 'SELECT 1'
+BACKOFF_SECONDS = 5
+MAX_BACKOFF_SECONDS = 120
+CHUNK_ROWS = 50000
+CHUNK_KEYS = 1000
+
+# Keys for read_keyed() are loaded into this table. Its rows belong to the
+# connection that inserted them; the definition stays on the server once created.
+KEY_TABLE = 'MIND_keys'
+KEY_TABLE_DDL = f"CREATE GLOBAL TEMPORARY TABLE {KEY_TABLE} (k VARCHAR(64))"
+
+
+def connection_string(database):
+    """The ODBC connection string of a database, e.g. 'CWS', from the MIND.env variables."""
+    if '=' in database:
+        return database
+    settings = {
+        'DRIVER': os.getenv('database_driver_name'),
+        'SERVER': os.getenv('database_server'),
+        'PORT': os.getenv('database_port'),
+        'DATABASE': os.getenv(f'database{database}'),
+        'UID': os.getenv('database_username'),
+        'PWD': os.getenv('database_password'),
+    }
+    missing = [name for name, value in settings.items() if not value]
+    if missing:
+        raise ValueError(f"Missing database settings for {database} in MIND.env: {', '.join(missing)}")
+    settings['DRIVER'] = f"{{{settings['DRIVER']}}}"
+    return ';'.join(f"{name}={value}" for name, value in settings.items())
+
+
+def pool_size():
+    """How many connections may be open to each database, from MIND_DB_CONNECTIONS (1 by default)."""
+    return max(int(os.getenv('MIND_DB_CONNECTIONS') or 1), 1)
+
+
+def is_connection_error(error):
+    """Whether error, or the database error pandas wrapped in it, means the connection is lost or timed out."""
+    return any(isinstance(e, (pyodbc.OperationalError, pyodbc.InterfaceError))
+               for e in (error, error.__cause__))
+
+
+def _close(connection):
+    try:
+        connection.close()
+    except pyodbc.Error:
+        pass
+
+
+class ConnectionPool:
+    def __init__(self, connection_string, timeout=60, **connect_options):
+        self.connection_string = connection_string
+        self.timeout = timeout
+        self.connect_options = connect_options
+        self.idle = []
+        self.open = 0
+        self.failures = 0
+        self.next_attempt = 0.0
+        self.condition = threading.Condition()
+
+    def _connect(self, retries):
+        for attempt in range(1, retries + 1):
+            with self.condition:
+                wait = self.next_attempt - time.time()
+                failures = self.failures
+            if wait > 0:
+                print(f"[DB] Waiting {wait:.0f}s after {failures} failed connection attempt(s)...")
+                time.sleep(wait)
+            try:
+                connection = pyodbc.connect(self.connection_string, timeout=self.timeout, **self.connect_options)
+            except pyodbc.Error as e:
+                with self.condition:
+                    self.failures += 1
+                    delay = min(BACKOFF_SECONDS * 2 ** (self.failures - 1), MAX_BACKOFF_SECONDS)
+                    self.next_attempt = time.time() + delay * random.uniform(0.8, 1.2)
+                print(f"[DB] Connection attempt {attempt}/{retries} failed: {e}")
+                if attempt == retries:
+                    raise
+            else:
+                with self.condition:
+                    self.failures = 0
+                    self.next_attempt = 0.0
+                return connection
+
+    def _healthy(self, connection):
+        try:
+            cursor = connection.cursor()
+            cursor.execute(PROBE_SQL)
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except pyodbc.Error:
+            return False
+
+    def acquire(self, retries=4):
+        """An open connection: an idle one if there is one, else a new one once fewer than pool_size() are open."""
+        with self.condition:
+            while not self.idle and self.open >= pool_size():
+                self.condition.wait()
+            if self.idle:
+                connection, returned = self.idle.pop()
+            else:
+                connection, returned = None, None
+                self.open += 1
+        if connection is not None:
+            if time.time() - returned < PROBE_AFTER_SECONDS or self._healthy(connection):
+                return connection
+            print("[DB] Replacing a pooled connection that no longer answers.")
+            _close(connection)
+        try:
+            return self._connect(retries)
+        except BaseException:
+            with self.condition:
+                self.open -= 1
+                self.condition.notify()
+            raise
+
+    def release(self, connection, broken=False):
+        """Hands a connection back, ending any transaction left open; a broken one is closed instead."""
+        if not broken:
+            try:
+                connection.rollback()
+            except pyodbc.Error:
+                broken = True
+        with self.condition:
+            if broken:
+                self.open -= 1
+            else:
+                self.idle.append((connection, time.time()))
+            self.condition.notify()
+        if broken:
+            _close(connection)
+
+    def close(self):
+        """Closes the idle connections."""
+        with self.condition:
+            idle, self.idle = self.idle, []
+            self.open -= len(idle)
+        for connection, _ in idle:
+            _close(connection)
+
+
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def pool(database, **connect_options):
+    """The pool of a database's connections opened with connect_options (such as autocommit=True)."""
+    key = (connection_string(database), tuple(sorted(connect_options.items())))
+    with _POOLS_LOCK:
+        if key not in _POOLS:
+            _POOLS[key] = ConnectionPool(key[0], **connect_options)
+        return _POOLS[key]
+
+
+@contextmanager
+def connection(database='CWS', retries=4, **connect_options):
+    """A pooled connection to database for the `with` block, handed back to the pool at its end."""
+    connections = pool(database, **connect_options)
+    conn = connections.acquire(retries)
+    broken = False
+    try:
+        yield conn
+    except Exception as e:
+        broken = is_connection_error(e)
+        raise
+    finally:
+        connections.release(conn, broken)
+
+
+def read_sql(sql, database='CWS', params=None, retries=4, cache=True, **read_options):
+    """
+    pandas.read_sql on a pooled connection. A query that fails because its
+    connection was lost or timed out is run again on a new connection. Not
+    for chunksize, whose chunks are read after the connection is handed back.
+
+    In reports with query_cache on, queries of the tables listed in
+    MIND_config/query_cache.ini are answered from the shared query cache
+    (MIND_querycache) while their result is fresh; cache=False always asks
+    the database.
+    """
+    import pandas as pd
+
+    query_cache = MIND_querycache.shared() if cache and not read_options else None
+    ttl = query_cache.ttl(sql) if query_cache is not None else None
+    if ttl is not None:
+        key = query_cache.key(sql, params, connection_string(database))
+        frame = query_cache.get(key, ttl)
+        if frame is not None:
+            return frame
+
+    for attempt in range(1, retries + 1):
+        try:
+            with connection(database) as conn:
+                frame = pd.read_sql(sql, conn, params=params, **read_options)
+            break
+        except Exception as e:
+            if attempt == retries or not is_connection_error(e):
+                raise
+            print(f"[DB] Query failed ({e}); running it again, attempt {attempt + 1}/{retries}...")
+            time.sleep(BACKOFF_SECONDS)
+    if ttl is not None:
+        query_cache.put(key, frame, sql)
+    return frame
+
+
+class Keys:
+    """The keys of a read_keyed() query: its {keys} becomes `column IN (values)`, or NOT IN with exclude=True."""
+
+    def __init__(self, column, values, exclude=False):
+        self.column = column
+        self.values = list(dict.fromkeys(str(value) for value in values))
+        self.exclude = exclude
+
+
+# Connection strings of the databases KEY_TABLE cannot be used on
+_NO_KEY_TABLE = set()
+
+
+def _load_keys(conn, values):
+    """Loads values into KEY_TABLE on conn, creating it on first use; False when that is not possible."""
+    cursor = conn.cursor()
+    try:
+        try:
+            cursor.execute(f"DELETE FROM {KEY_TABLE}")
+        except pyodbc.Error as e:
+            if is_connection_error(e):
+                raise
+            conn.rollback()
+            try:
+                cursor.execute(KEY_TABLE_DDL)
+                conn.commit()
+            except pyodbc.Error:
+                # Created in the meantime by another connection
+                conn.rollback()
+                cursor.execute(f"DELETE FROM {KEY_TABLE}")
+        cursor.fast_executemany = True
+        cursor.executemany(f"INSERT INTO {KEY_TABLE} (k) VALUES (?)", [(value,) for value in values])
+        return True
+    except pyodbc.Error as e:
+        if is_connection_error(e):
+            raise
+        print(f"[DB] Cannot load keys into {KEY_TABLE} ({e}); sending them in chunks instead")
+        conn.rollback()
+        return False
+    finally:
+        cursor.close()
+
+
+def read_keyed(sql, keys, database='CWS', chunk_keys=CHUNK_KEYS, retries=4):
+    """
+    Runs sql for a set of keys however large, keys being a Keys. {keys} in
+    sql stands for the condition on them:
+
+        notes = MIND_db.read_keyed(
+            "SELECT n.PATID, n.date_of_service FROM SYSTEM.cw_patient_notes n WHERE {keys}",
+            MIND_db.Keys('n.PATID', df['PATID'].unique()), 'CWS')
+
+    The keys are loaded into KEY_TABLE with fast_executemany and the
+    condition becomes `column IN (SELECT k FROM MIND_keys)`, so the query
+    text and its parameters stay the same size however many keys there are.
+    The rows are removed when the connection is handed back.
+
+    Where the table cannot be created or loaded (no right to create tables,
+    a driver without fast_executemany), the query runs once per chunk_keys
+    keys with the keys as parameters and the results are put together, so
+    each row must belong to one key (no totals across keys). An exclude
+    query then runs once without the condition, and the rows of the keys,
+    and those where the column is NULL as NOT IN would, are dropped here by
+    the column's name in the result.
+    """
+    import pandas as pd
+
+    operator = 'NOT IN' if keys.exclude else 'IN'
+    if not keys.values:
+        return read_sql(sql.replace('{keys}', '1=1' if keys.exclude else '1=0'), database, retries=retries)
+
+    if connection_string(database) not in _NO_KEY_TABLE:
+        keyed_sql = sql.replace('{keys}', f"{keys.column} {operator} (SELECT k FROM {KEY_TABLE})")
+        for attempt in range(1, retries + 1):
+            try:
+                with connection(database) as conn:
+                    if _load_keys(conn, keys.values):
+                        return pd.read_sql(keyed_sql, conn)
+                _NO_KEY_TABLE.add(connection_string(database))
+                break
+            except Exception as e:
+                if attempt == retries or not is_connection_error(e):
+                    raise
+                print(f"[DB] Query failed ({e}); running it again, attempt {attempt + 1}/{retries}...")
+                time.sleep(BACKOFF_SECONDS)
+
+    if keys.exclude:
+        frame = read_sql(sql.replace('{keys}', '1=1'), database, retries=retries)
+        column = frame[keys.column.split('.')[-1]]
+        return frame[column.notna() & ~column.astype(str).isin(keys.values)].reset_index(drop=True)
+    frames = []
+    for start in range(0, len(keys.values), chunk_keys):
+        chunk = keys.values[start:start + chunk_keys]
+        chunk_sql = sql.replace('{keys}', f"{keys.column} IN ({', '.join('?' * len(chunk))})")
+        frames.append(read_sql(chunk_sql, database, params=chunk, retries=retries))
+    return pd.concat(frames, ignore_index=True)
+
+
+def read_queries(queries, max_workers=8):
+    """
+    Runs independent queries side by side and returns their DataFrames by
+    name. queries maps each name to (sql, database) or (sql, database,
+    params), where params may be a Keys for a read_keyed() query. No more
+    than pool_size() run at once against a database; the others wait for a
+    connection, with a warning when that leaves them running one at a time.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    def run(name, sql, database, params=None):
+        started = time.time()
+        if isinstance(params, Keys):
+            frame = read_keyed(sql, params, database)
+        else:
+            frame = read_sql(sql, database, params=params)
+        print(f"[DB] {name}: {len(frame):,} rows in {time.time() - started:.1f}s")
+        return frame
+
+    if not queries:
+        return {}
+    if pool_size() == 1:
+        databases = [query[1] for query in queries.values()]
+        for database in dict.fromkeys(databases):
+            if databases.count(database) > 1:
+                print(f"[DB] WARNING: {databases.count(database)} queries on {database} run one at a time; "
+                      f"set [MIND] db_connections above 1 to run them side by side")
+    started = time.time()
+    frames = {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(queries)), thread_name_prefix='MIND_db') as executor:
+        futures = {executor.submit(run, name, *query): name for name, query in queries.items()}
+        for future in as_completed(futures):
+            try:
+                frames[futures[future]] = future.result()
+            except Exception as e:
+                print(f"[DB] {futures[future]} failed: {e}")
+                executor.shutdown(cancel_futures=True)
+                raise
+    print(f"[DB] {len(queries)} queries in {time.time() - started:.1f}s")
+    return {name: frames[name] for name in queries}
+
+
+def _chunk_frame(rows, description):
+    """A DataFrame of fetched rows, built as pandas.read_sql builds its result."""
+    import pandas as pd
+
+    return pd.DataFrame.from_records(rows, columns=[column[0] for column in description], coerce_float=True)
+
+
+def read_chunks(sql, database='CWS', params=None, chunk_rows=CHUNK_ROWS, progress=None):
+    """
+    Yields the result of a query as DataFrames of up to chunk_rows rows,
+    fetched with cursor.fetchmany, and at least one (empty) DataFrame. The
+    connection is held until the last chunk has been read. progress, if
+    given, is called with the number of rows read so far after each chunk.
+    Unlike read_sql, a query that fails is not run again.
+
+    Each chunk has the dtypes read_sql would give those rows, so a column can
+    differ between chunks: an integer column is float64 in a chunk where it
+    holds a NULL, and object in a chunk where it holds nothing else.
+    read_chunked() puts the chunks together with the dtypes of read_sql.
+    """
+    metrics = sys.modules.get('MIND_metrics')
+    with connection(database) as conn:
+        cursor = conn.cursor()
+        try:
+            started = time.time()
+            if params:
+                cursor.execute(sql, params)
+            else:
+                cursor.execute(sql)
+            if metrics:
+                metrics.COUNTERS['queries'] += 1
+            rows_read = 0
+            while True:
+                rows = cursor.fetchmany(chunk_rows)
+                if metrics:
+                    metrics.COUNTERS['query_seconds'] += time.time() - started
+                    metrics.COUNTERS['query_rows'] += len(rows)
+                if not rows:
+                    if not rows_read:
+                        yield _chunk_frame(rows, cursor.description)
+                    break
+                rows_read += len(rows)
+                if progress is not None:
+                    progress(rows_read)
+                yield _chunk_frame(rows, cursor.description)
+                started = time.time()
+        finally:
+            cursor.close()
+
+
+def read_chunked(sql, database='CWS', each=None, params=None, chunk_rows=CHUNK_ROWS, progress=None):
+    """
+    The result of a query, read with read_chunks and with each applied to
+    every chunk (to filter it, or to aggregate it partially) before the
+    chunks are put together. Only what each returns is kept in memory.
+    """
+    import pandas as pd
+
+    parts = [each(chunk) if each is not None else chunk
+             for chunk in read_chunks(sql, database, params, chunk_rows, progress)]
+    frame = pd.concat(parts, ignore_index=True)
+    if len(parts) > 1:
+        # A column that is all NULL in one chunk is object there; infer it again over all the rows, as read_sql would
+        frame = frame.infer_objects()
+    return frame
+
+
+def close_all():
+    """Closes every pool's idle connections."""
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+    for connections in pools:
+        connections.close()
+
+
+atexit.register(close_all)
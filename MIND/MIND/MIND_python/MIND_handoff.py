@@ -0,0 +1,420 @@
+import os
+import re
+import json
+import uuid
+import pickle
+from pathlib import Path
+from contextlib import contextmanager
+
+# The real implementations, kept so redirected calls can fall through to them
+_pickle_load = pickle.load
+_pickle_dump = pickle.dump
+
+_UNSAFE_CHARS = re.compile(r'[^\w-]')
+
+# Bytes moved through the handoff by this process, reported in the run manifest
+IO_BYTES = {'read': 0, 'written': 0}
+
+
+class MemoryHandoff:
+    """Keeps the payload passed between steps as a live Python object."""
+
+    def __init__(self, data=None):
+        self.data = data
+        self.present = True
+
+    def load(self):
+        return self.data
+
+    def save(self, data):
+        self.data = data
+        self.present = True
+
+    def discard(self):
+        self.data = None
+        self.present = False
+
+
+class PickleHandoff:
+    """The original handoff: the whole payload pickled into temp_data.pkl."""
+
+    def __init__(self, temp_file):
+        self.temp_file = Path(temp_file)
+
+    @property
+    def present(self):
+        return self.temp_file.exists()
+
+    def load(self):
+        return read_pickle(self.temp_file)
+
+    def save(self, data):
+        write_pickle(self.temp_file, data)
+
+    def discard(self):
+        if self.temp_file.exists():
+            self.temp_file.unlink()
+
+
+class _FrameRef:
+    """A DataFrame stored in an Arrow IPC file that has not been read yet."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+
+class LazyFrames(dict):
+    """
+    A dict payload whose DataFrames are read from the handoff store on first access.
+
+    Frames a step never touches are never read, and are written back by
+    reference when the step saves the payload again.
+    """
+
+    def _resolve(self, key):
+        value = dict.__getitem__(self, key)
+        if isinstance(value, _FrameRef):
+            value = _read_arrow(value.path)
+            dict.__setitem__(self, key, value)
+        return value
+
+    def __getitem__(self, key):
+        return self._resolve(key)
+
+    def __iter__(self):
+        # Defining __iter__ stops dict(payload) and {**payload} copying the unread references
+        return dict.__iter__(self)
+
+    def get(self, key, default=None):
+        return self._resolve(key) if key in self else default
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self._resolve(key)
+
+    def pop(self, key, *default):
+        if key in self:
+            value = self._resolve(key)
+            del self[key]
+            return value
+        return dict.pop(self, key, *default)
+
+    def values(self):
+        return [self._resolve(key) for key in self]
+
+    def items(self):
+        return [(key, self._resolve(key)) for key in self]
+
+    def copy(self):
+        return LazyFrames(dict.items(self))
+
+    def frame(self, key, columns=None):
+        """Returns one frame, reading only the given columns if it has not been loaded yet."""
+        value = dict.__getitem__(self, key)
+        if isinstance(value, _FrameRef):
+            return _read_arrow(value.path, columns)
+        return value[columns] if columns is not None else value
+
+    def __reduce__(self):
+        return (dict, (dict(self.items()),))
+
+    def __repr__(self):
+        return repr({key: (f"<not loaded: {value.path.name}>" if isinstance(value, _FrameRef) else value)
+                     for key, value in dict.items(self)})
+
+
+def frame(payload, key, columns=None):
+    """
+    Returns payload[key], limited to columns. With the Arrow handoff only
+    those columns are read from disk; with any other handoff this is a
+    plain column selection.
+    """
+    if isinstance(payload, LazyFrames):
+        return payload.frame(key, columns)
+    value = payload[key]
+    return value[columns] if columns is not None else value
+
+
+def _read_arrow(path, columns=None):
+    import pyarrow as pa
+
+    # The file is memory-mapped, so columns that are not selected are never read
+    with pa.memory_map(str(path), 'r') as source:
+        table = pa.ipc.open_file(source).read_all()
+        if columns is not None:
+            table = table.select(list(columns))
+        IO_BYTES['read'] += table.nbytes
+        return table.to_pandas()
+
+
+def _arrow_shape(path):
+    """(rows, columns) of a stored frame, from the file's metadata alone."""
+    import pyarrow as pa
+
+    with pa.memory_map(str(path), 'r') as source:
+        reader = pa.ipc.open_file(source)
+        rows = sum(reader.get_batch(index).num_rows for index in range(reader.num_record_batches))
+        columns = [name for name in reader.schema.names if not name.startswith('__index_level_')]
+    return rows, len(columns)
+
+
+def frame_shapes(payload):
+    """
+    {key: [rows, columns]} for every DataFrame in a payload, with '' as the key
+    of a bare DataFrame. Frames the Arrow handoff has not read are measured
+    without being read.
+    """
+    try:
+        import pandas as pd
+    except ImportError:
+        return {}
+
+    if isinstance(payload, pd.DataFrame):
+        return {'': list(payload.shape)}
+    if not isinstance(payload, dict):
+        return {}
+    shapes = {}
+    for key, value in dict.items(payload):
+        if isinstance(value, _FrameRef):
+            shapes[str(key)] = list(_arrow_shape(value.path))
+        elif isinstance(value, pd.DataFrame):
+            shapes[str(key)] = list(value.shape)
+    return shapes
+
+
+class ArrowHandoff:
+    """
+    Stores the payload in a directory with one Arrow IPC file per DataFrame.
+
+    A DataFrame payload is stored as a single frame, a dict payload keeps one
+    file per DataFrame value, and anything that is not a DataFrame (or that
+    Arrow cannot represent) is pickled into a single objects file. Every save
+    writes new file names, so files still memory-mapped by a reader are never
+    overwritten.
+    """
+
+    MANIFEST = 'manifest.json'
+
+    def __init__(self, directory):
+        import pyarrow  # noqa: F401  fail early when pyarrow is not installed
+        self.directory = Path(directory)
+
+    @property
+    def present(self):
+        return (self.directory / self.MANIFEST).exists()
+
+    def load(self):
+        with open(self.directory / self.MANIFEST, 'r') as f:
+            manifest = json.load(f)
+
+        objects = {}
+        if manifest['objects']:
+            objects = read_pickle(self.directory / manifest['objects'])
+
+        if manifest['kind'] == 'frame':
+            return _read_arrow(self.directory / manifest['frames']['__frame__'])
+        if manifest['kind'] == 'object':
+            return objects['__object__']
+
+        payload = LazyFrames()
+        for key in manifest['keys']:
+            if key in manifest['frames']:
+                dict.__setitem__(payload, key, _FrameRef(self.directory / manifest['frames'][key]))
+            else:
+                dict.__setitem__(payload, key, objects[key])
+        return payload
+
+    def save(self, data):
+        import pandas as pd
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        token = uuid.uuid4().hex[:8]
+        frames, objects = {}, {}
+
+        if isinstance(data, pd.DataFrame):
+            kind, items = 'frame', [('__frame__', data)]
+        elif isinstance(data, dict) and all(isinstance(key, str) for key in data):
+            kind, items = 'dict', list(dict.items(data))
+        else:
+            kind, items = 'object', [('__object__', data)]
+
+        for index, (key, value) in enumerate(items):
+            if isinstance(value, _FrameRef) and value.path.parent == self.directory:
+                frames[key] = value.path.name
+                continue
+            if isinstance(value, _FrameRef):
+                value = _read_arrow(value.path)
+            if isinstance(value, pd.DataFrame):
+                file_name = f"{index:03d}_{_UNSAFE_CHARS.sub('_', key)}_{token}.arrow"
+                if self._write_arrow(self.directory / file_name, value):
+                    frames[key] = file_name
+                    continue
+            objects[key] = value
+
+        if kind == 'frame' and not frames:
+            kind, objects = 'object', {'__object__': data}
+
+        objects_file = None
+        if objects:
+            objects_file = f"objects_{token}.pkl"
+            write_pickle(self.directory / objects_file, objects)
+
+        manifest = {
+            'kind': kind,
+            'keys': [key for key, _ in items] if kind == 'dict' else [],
+            'frames': frames,
+            'objects': objects_file,
+        }
+        with open(self.directory / self.MANIFEST, 'w') as f:
+            json.dump(manifest, f)
+
+        self._remove_unreferenced(set(frames.values()) | {objects_file, self.MANIFEST})
+
+    def discard(self):
+        if self.present:
+            (self.directory / self.MANIFEST).unlink()
+        self._remove_unreferenced({None})
+        try:
+            self.directory.rmdir()
+        except OSError:
+            pass
+
+    @staticmethod
+    def _write_arrow(path, df):
+        import pyarrow as pa
+
+        try:
+            table = pa.Table.from_pandas(df)
+        except (pa.ArrowException, TypeError, ValueError):
+            # Mixed-type object columns and the like stay pickled
+            return False
+        with pa.OSFile(str(path), 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        IO_BYTES['written'] += os.path.getsize(path)
+        return True
+
+    def _remove_unreferenced(self, keep):
+        for path in self.directory.glob('*'):
+            if path.name in keep:
+                continue
+            try:
+                path.unlink()
+            except OSError:
+                # Still memory-mapped by a reader (Windows); removed on a later save
+                pass
+
+
+def merge(payloads):
+    """
+    Combines the outputs of several steps into the input of the step that
+    needs them all. Dict payloads are merged key by key, later payloads
+    winning; anything else can only be passed on from a single step.
+    """
+    if not payloads:
+        return None
+    if len(payloads) == 1:
+        return payloads[0]
+    if not all(isinstance(payload, dict) for payload in payloads):
+        raise ValueError("Only dict payloads can be merged; steps that run side by side must each save a dict of frames.")
+
+    merged = LazyFrames()
+    for payload in payloads:
+        # dict.items keeps frames that have not been read as references
+        dict.update(merged, dict.items(payload))
+    return merged
+
+
+def open_handoff(kind, temp_file):
+    """The on-disk handoff for a step whose payload file is temp_file."""
+    temp_file = Path(temp_file)
+    if kind == 'arrow':
+        return ArrowHandoff(temp_file.with_name(temp_file.stem + '_frames'))
+    return PickleHandoff(temp_file)
+
+
+def _is_temp_file(target, temp_file):
+    """True when target (a path or an open file object) points at temp_file."""
+    name = getattr(target, 'name', target)
+    if not isinstance(name, (str, os.PathLike)):
+        return False
+    return os.path.normcase(os.path.abspath(name)) == os.path.normcase(os.path.abspath(temp_file))
+
+
+def write_pickle(temp_file, data):
+    """Writes data to temp_file with the real pickle, bypassing any redirect."""
+    with open(temp_file, 'wb') as f:
+        _pickle_dump(data, f)
+    IO_BYTES['written'] += os.path.getsize(temp_file)
+
+
+def read_pickle(temp_file):
+    """Reads temp_file with the real pickle, bypassing any redirect."""
+    IO_BYTES['read'] += os.path.getsize(temp_file)
+    with open(temp_file, 'rb') as f:
+        return _pickle_load(f)
+
+
+@contextmanager
+def redirect(temp_file, handoff):
+    """
+    Routes every pickle.load / pickle.dump / pd.read_pickle / DataFrame.to_pickle
+    on temp_file to handoff.load() / handoff.save() while the block runs.
+
+    Steps keep their existing temp_data.pkl code; only the file on disk is
+    skipped. The file itself is kept as an empty placeholder so that existence
+    checks in the steps behave the same, and deleting it clears the payload.
+    """
+    temp_file = str(temp_file)
+
+    def load(file, *args, **kwargs):
+        if _is_temp_file(file, temp_file):
+            return handoff.load()
+        return _pickle_load(file, *args, **kwargs)
+
+    def dump(obj, file, *args, **kwargs):
+        if _is_temp_file(file, temp_file):
+            handoff.save(obj)
+            return
+        _pickle_dump(obj, file, *args, **kwargs)
+
+    patches = [(pickle, 'load', load), (pickle, 'dump', dump)]
+
+    try:
+        import pandas as pd
+        from pandas.core.generic import NDFrame
+    except ImportError:
+        pd = None
+
+    if pd is not None:
+        pd_read_pickle = pd.read_pickle
+        pd_to_pickle = NDFrame.to_pickle
+
+        def read_pickle_redirected(filepath_or_buffer, *args, **kwargs):
+            if _is_temp_file(filepath_or_buffer, temp_file):
+                return handoff.load()
+            return pd_read_pickle(filepath_or_buffer, *args, **kwargs)
+
+        def to_pickle_redirected(self, path, *args, **kwargs):
+            if _is_temp_file(path, temp_file):
+                handoff.save(self)
+                return
+            pd_to_pickle(self, path, *args, **kwargs)
+
+        patches += [(pd, 'read_pickle', read_pickle_redirected), (NDFrame, 'to_pickle', to_pickle_redirected)]
+
+    originals = [(owner, name, getattr(owner, name)) for owner, name, _ in patches]
+    for owner, name, replacement in patches:
+        setattr(owner, name, replacement)
+
+    if handoff.present and not os.path.exists(temp_file):
+        open(temp_file, 'wb').close()
+
+    try:
+        yield handoff
+    finally:
+        for owner, name, original in originals:
+            setattr(owner, name, original)
+        if not os.path.exists(temp_file):
+            handoff.discard()
@@ -0,0 +1,140 @@
+"""
+History of every run's step timings and row counts, in one SQLite database
+shared by all reports (MIND_logs/history.sqlite, or [MIND] history_db), and
+the regression check made against it as each run finishes.
+
+Every run is recorded, failed and timed-out ones included, with its
+status and mode: 'full', 'partial' for a run of some steps only
+(start_step, end_step or a sweep's resumed runs) or 'override' for a run
+with settings changed by --set, a sweep or MIND.run().
+
+A step has regressed when its wall time is more than
+regression_alert_percent above its baseline: the median of its last
+regression_baseline_runs successful runs in full runs (cached steps, and
+partial and override runs, do not count). Only succeeded full runs are
+checked. Steps
+with fewer than 3 earlier runs, or that are slower by less than
+regression_min_seconds, are not reported, so short steps do not alert on
+noise.
+"""
+import sqlite3
+import statistics
+import datetime
+from pathlib import Path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    report TEXT NOT NULL,
+    started TEXT,
+    finished TEXT,
+    status TEXT,
+    log_file TEXT,
+    mode TEXT
+);
+CREATE TABLE IF NOT EXISTS steps (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    report TEXT NOT NULL,
+    step TEXT NOT NULL,
+    mode TEXT,
+    started TEXT,
+    wall_seconds REAL,
+    cpu_seconds REAL,
+    peak_rss_bytes INTEGER,
+    output_rows INTEGER,
+    query_rows INTEGER,
+    exit_status TEXT
+);
+CREATE INDEX IF NOT EXISTS steps_by_step ON steps (report, step, started);
+"""
+
+MIN_BASELINE_RUNS = 3
+
+
+class RunHistory:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Reports of a batch finish side by side
+        self.connection = sqlite3.connect(self.path, timeout=60)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript(SCHEMA)
+        # Histories from before runs had a mode; their runs count as full
+        if 'mode' not in [column[1] for column in self.connection.execute("PRAGMA table_info(runs)")]:
+            self.connection.execute("ALTER TABLE runs ADD COLUMN mode TEXT")
+
+    def close(self):
+        self.connection.close()
+
+    def baseline(self, report, step, before_run, runs):
+        """Median wall seconds and output rows of the step's last successful runs in full runs before before_run, or None."""
+        rows = self.connection.execute(
+            "SELECT s.wall_seconds, s.output_rows FROM steps s JOIN runs r ON r.id = s.run_id "
+            "WHERE s.report = ? AND s.step = ? AND s.run_id < ? AND s.exit_status = '0' AND s.mode != 'cached' "
+            "AND COALESCE(r.mode, 'full') = 'full' "
+            "ORDER BY s.run_id DESC LIMIT ?",
+            (report, step, before_run, runs)
+        ).fetchall()
+        if len(rows) < MIN_BASELINE_RUNS:
+            return None
+        output_rows = [row[1] for row in rows if row[1] is not None]
+        return {
+            'runs': len(rows),
+            'wall_seconds': statistics.median(row[0] for row in rows),
+            'output_rows': statistics.median(output_rows) if output_rows else None,
+        }
+
+    def record(self, run):
+        """Stores a finished run, a RunManifest's run record. Returns the new run's id."""
+        with self.connection:
+            run_id = self.connection.execute(
+                "INSERT INTO runs (report, started, finished, status, log_file, mode) VALUES (?, ?, ?, ?, ?, ?)",
+                (run['report'], run['started'], run['finished'], run['status'], run['log_file'],
+                 run.get('settings', {}).get('mode', 'full'))
+            ).lastrowid
+            self.connection.executemany(
+                "INSERT INTO steps (run_id, report, step, mode, started, wall_seconds, cpu_seconds, peak_rss_bytes, "
+                "output_rows, query_rows, exit_status) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(run_id, run['report'], step['step'], step['mode'], step['started'], step['wall_seconds'],
+                  step.get('cpu_seconds'), step.get('peak_rss_bytes'),
+                  sum(shape[0] for shape in step.get('frames', {}).values()) if step.get('frames') else None,
+                  (step.get('calls') or {}).get('query_rows'), str(step['exit_status']))
+                 for step in run['steps']]
+            )
+        return run_id
+
+    def regressions(self, run_id, run, percent, baseline_runs=10, min_seconds=30):
+        """The steps of the run that were slower than their baseline by more than percent and min_seconds."""
+        found = []
+        for step in run['steps']:
+            if str(step['exit_status']) != '0' or step['mode'] == 'cached':
+                continue
+            baseline = self.baseline(run['report'], step['step'], run_id, baseline_runs)
+            if baseline is None:
+                continue
+            slower = step['wall_seconds'] - baseline['wall_seconds']
+            if slower > min_seconds and slower > baseline['wall_seconds'] * percent / 100:
+                frames = step.get('frames') or {}
+                found.append({
+                    'step': step['step'],
+                    'wall_seconds': step['wall_seconds'],
+                    'baseline_seconds': baseline['wall_seconds'],
+                    'baseline_runs': baseline['runs'],
+                    'output_rows': sum(shape[0] for shape in frames.values()) if frames else None,
+                    'baseline_rows': baseline['output_rows'],
+                })
+        return found
+
+
+def describe(report, regressions, percent, log_file):
+    """Subject and body of the alert email for a run's regressions."""
+    subject = f"SLOW RUN: {report} has {len(regressions)} step(s) more than {percent:g}% slower than usual"
+    lines = [f"Run of {report} finished {datetime.datetime.now():%Y-%m-%d %H:%M}.", f"Log file path: {log_file}", ""]
+    for regression in regressions:
+        line = (f"{regression['step']}: {regression['wall_seconds']:.1f}s against a median of "
+                f"{regression['baseline_seconds']:.1f}s over its last {regression['baseline_runs']} runs")
+        if regression['output_rows'] is not None and regression['baseline_rows']:
+            line += (f"; output {regression['output_rows']:,} rows against a median of "
+                     f"{regression['baseline_rows']:,.0f} ({regression['output_rows'] / regression['baseline_rows'] - 1:+.0%})")
+        lines.append(line)
+    return subject, "\n".join(lines)
@@ -0,0 +1,191 @@
+"""
+Measures what every step script spends on starting up and importing.
+
+    python MIND_importtime.py [reports_dir] [--repeat 3] [--report <name>]
+
+For each *_NN.py step under <reports_dir>/*/python, the step's top-level
+imports are run on their own under `python -X importtime`, from the step's
+directory as MIND runs it, so no database or email is touched. The table
+lists, per step:
+
+    startup    wall time of the interpreter running just those imports
+    imports    the part of it spent importing, and the heaviest modules
+    share      imports as a share of the step's median wall time, from the
+               run history (MIND_history), when the step has run
+    lazy       heavy modules bound at the top but only used inside functions,
+               or not used at all: candidates for MIND_lazy.module(). A step
+               unpickling DataFrames imports pandas regardless.
+
+Each measurement is the fastest of --repeat runs. The full results are
+written to MIND_logs/imports/importtime_<timestamp>.json.
+"""
+import os
+import re
+import ast
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import datetime
+import statistics
+import subprocess
+from pathlib import Path
+
+MIND_PYTHON_DIR = Path(__file__).resolve().parent
+
+# Modules worth deferring; the standard library imports too fast to matter
+HEAVY = {'pandas', 'numpy', 'pyodbc', 'openpyxl', 'PIL', 'dateutil', 'paramiko', 'pyarrow', 'matplotlib'}
+
+IMPORTTIME = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)')
+
+
+def top_level_imports(tree):
+    """The import statements run when the module is loaded, outside any function or class."""
+    imports = []
+    pending = list(tree.body)
+    while pending:
+        node = pending.pop(0)
+        if isinstance(node, (ast.Import, ast.ImportFrom)) and not (isinstance(node, ast.ImportFrom) and node.level):
+            imports.append(node)
+        elif isinstance(node, (ast.If, ast.Try, ast.With)):
+            pending[:0] = [child for child in ast.iter_child_nodes(node) if isinstance(child, ast.stmt)]
+    return imports
+
+
+def lazy_candidates(tree, imports):
+    """Heavy top-level modules whose names are never used outside a function body."""
+    bound = {}
+    for node in imports:
+        for alias in node.names:
+            root = (node.module if isinstance(node, ast.ImportFrom) else alias.name).split('.')[0]
+            if root in HEAVY:
+                bound[alias.asname or alias.name.split('.')[0]] = root
+
+    used_at_top = set()
+
+    def visit(node, in_function):
+        if isinstance(node, ast.Name) and not in_function:
+            used_at_top.add(node.id)
+        deferred = in_function or isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda))
+        for child in ast.iter_child_nodes(node):
+            visit(child, deferred)
+
+    visit(tree, False)
+    used_roots = {root for name, root in bound.items() if name in used_at_top}
+    return sorted(set(bound.values()) - used_roots)
+
+
+def measure(script, repeat):
+    """
+    (startup seconds, {top-level module: import seconds}, modules not
+    installed, lazy candidates) for the script's imports.
+    """
+    source = script.read_text(encoding='utf-8', errors='ignore')
+    tree = ast.parse(source)
+    imports = top_level_imports(tree)
+    # Everything importtime reports after the marker was imported by the step, not by interpreter startup
+    program = "import sys\nsys.stderr.write('MIND_IMPORTS\\n')\nmissing = []\n"
+    for node in imports:
+        program += f"try:\n    {ast.unparse(node)}\nexcept ImportError as e:\n    missing.append(e.name)\n"
+    program += "print(','.join(filter(None, missing)))\n"
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(MIND_PYTHON_DIR), env.get('PYTHONPATH')]))
+    startup = None
+    modules = {}
+    missing = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = subprocess.run(['python', '-X', 'importtime', '-c', program], cwd=script.parent, env=env,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        elapsed = time.perf_counter() - started
+        startup = elapsed if startup is None else min(startup, elapsed)
+        missing = list(dict.fromkeys(name for name in result.stdout.strip().split(',') if name))
+        lines = result.stderr.splitlines()
+        for line in lines[lines.index('MIND_IMPORTS') + 1:] if 'MIND_IMPORTS' in lines else []:
+            match = IMPORTTIME.match(line)
+            # Only modules imported directly by the step, not what they import in turn
+            if match and len(match.group(3)) == 1:
+                name, seconds = match.group(4), int(match.group(2)) / 1e6
+                modules[name] = min(modules.get(name, seconds), seconds)
+    return startup, modules, missing, lazy_candidates(tree, imports)
+
+
+def median_wall_seconds(history_db, report, step):
+    if not history_db.exists():
+        return None
+    connection = sqlite3.connect(history_db)
+    try:
+        rows = connection.execute(
+            "SELECT wall_seconds FROM steps WHERE report = ? AND step = ? AND exit_status = '0' AND mode != 'cached' "
+            "ORDER BY run_id DESC LIMIT 10", (report, step)
+        ).fetchall()
+    except sqlite3.Error:
+        return None
+    finally:
+        connection.close()
+    return statistics.median(row[0] for row in rows) if rows else None
+
+
+def main(reports_dir, repeat=3, only=None):
+    reports_dir = Path(reports_dir).resolve()
+    history_db = reports_dir.parent / 'MIND_logs' / 'history.sqlite'
+
+    started = time.perf_counter()
+    subprocess.run(['python', '-c', 'pass'])
+    bare = time.perf_counter() - started
+    print(f"Bare interpreter start: {bare:.2f}s\n")
+    print(f"{'step':<75} {'startup':>8} {'imports':>8} {'share':>6}  heaviest / lazy candidates")
+
+    results = []
+    for report_dir in sorted(reports_dir.iterdir()):
+        if not (report_dir / 'python').is_dir() or (only and report_dir.name not in only):
+            continue
+        for script in sorted((report_dir / 'python').glob('*.py')):
+            if not re.search(r'\d{2}\.py$', script.name):
+                continue
+            startup, modules, missing, lazy = measure(script, repeat)
+            import_seconds = sum(modules.values())
+            wall = median_wall_seconds(history_db, report_dir.name, script.name)
+            share = import_seconds / wall if wall else None
+            heaviest = sorted(modules.items(), key=lambda item: -item[1])[:3]
+            results.append({
+                'report': report_dir.name,
+                'step': script.name,
+                'startup_seconds': round(startup, 3),
+                'import_seconds': round(import_seconds, 3),
+                'modules': {name: round(seconds, 3) for name, seconds in modules.items()},
+                'missing': missing,
+                'median_wall_seconds': wall,
+                'import_share': round(share, 3) if share is not None else None,
+                'lazy_candidates': lazy,
+            })
+            notes = ', '.join(f"{name} {seconds:.2f}s" for name, seconds in heaviest)
+            if lazy:
+                notes += f" | lazy: {', '.join(lazy)}"
+            if missing:
+                notes += f" | not installed: {', '.join(missing)}"
+            print(f"{report_dir.name + '/' + script.name:<75} {startup:>7.2f}s {import_seconds:>7.2f}s "
+                  f"{format(share, '.0%') if share is not None else '':>6}  {notes}")
+
+    log_dir = reports_dir.parent / 'MIND_logs' / 'imports'
+    log_dir.mkdir(parents=True, exist_ok=True)
+    output = log_dir / f"importtime_{datetime.datetime.now():%Y%m%d_%H%M%S}.json"
+    with open(output, 'w') as f:
+        json.dump({'bare_startup_seconds': round(bare, 3), 'repeat': repeat, 'steps': results}, f, indent=2)
+    print(f"\nWritten to {output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(usage="python MIND_importtime.py [reports_dir] [--repeat 3] [--report <name>]")
+    parser.add_argument('reports_dir', nargs='?', default=str(MIND_PYTHON_DIR.parents[1] / 'MIND_reports'))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--report', action='append', help="only measure this report (may be repeated)")
+    args = parser.parse_args()
+
+    if not Path(args.reports_dir).is_dir():
+        print("Usage: python MIND_importtime.py [reports_dir] [--repeat 3] [--report <name>]")
+        sys.exit(1)
+
+    main(args.reports_dir, repeat=args.repeat, only=args.report)
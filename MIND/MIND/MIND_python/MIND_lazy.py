@@ -0,0 +1,40 @@
+"""
+Lazy imports for step scripts.
+
+    import MIND_lazy
+    pd = MIND_lazy.module('pandas')
+    Image = MIND_lazy.module('PIL.Image')
+
+binds the name at once but only runs the module's import the first time one
+of its attributes is used, so a step that never reaches the code needing
+pandas or PIL does not pay for importing them. A module that is already
+imported (a warm worker imports the common ones ahead of time) is returned
+as it is.
+
+Only whole modules can be lazy: `from openpyxl import Workbook` still imports
+openpyxl on the spot, so write `openpyxl = MIND_lazy.module('openpyxl')` and
+use `openpyxl.Workbook` instead. Extension modules such as pyodbc load when
+bound, which costs little. Use python MIND_importtime.py to see which steps
+spend their time importing.
+"""
+import sys
+import importlib.util
+
+
+def module(name):
+    """The module name, imported on first attribute access."""
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    lazy = importlib.util.module_from_spec(spec)
+    sys.modules[name] = lazy
+    loader.exec_module(lazy)
+    if '.' in name:
+        # As `import PIL.Image` would, so `PIL.Image` resolves from the parent too
+        parent, _, child = name.rpartition('.')
+        setattr(sys.modules[parent], child, lazy)
+    return lazy
@@ -0,0 +1,49 @@
+import re
+import time
+
+
+class StepTimeouts:
+    """
+    How long steps may run, from config.ini:
+
+        [MIND]
+        step_timeout_minutes = 30       every step
+        report_timeout_minutes = 120    the whole run
+        step_retries = 1                times a step that timed out is run again
+        retry_backoff_seconds = 60      wait before the first retry, doubled for each one after
+
+        [MIND_timeouts]
+        00 = 45                         step 00, instead of step_timeout_minutes
+
+    A step's limit is the smaller of its own and the time left for the run.
+    """
+
+    def __init__(self, config):
+        minutes = config.getfloat('MIND', 'step_timeout_minutes', fallback=0)
+        self.default = minutes * 60 if minutes > 0 else None
+        self.per_step = {}
+        if config.has_section('MIND_timeouts'):
+            self.per_step = {int(step): float(minutes) * 60 for step, minutes in config.items('MIND_timeouts')}
+
+        minutes = config.getfloat('MIND', 'report_timeout_minutes', fallback=0)
+        self.deadline = time.time() + minutes * 60 if minutes > 0 else None
+
+        self.retries = config.getint('MIND', 'step_retries', fallback=0)
+        self.backoff = config.getfloat('MIND', 'retry_backoff_seconds', fallback=60)
+
+    def limited(self, script_path):
+        """True when the step has a time limit, and so must run where it can be killed."""
+        return self.for_step(script_path) is not None
+
+    def for_step(self, script_path):
+        """Seconds the step may still run, or None without a limit."""
+        step = int(re.search(r'(\d{2})$', script_path.stem).group(1))
+        limits = [self.per_step.get(step, self.default)]
+        if self.deadline is not None:
+            limits.append(max(self.deadline - time.time(), 0))
+        limits = [limit for limit in limits if limit is not None]
+        return min(limits) if limits else None
+
+    def backoff_for(self, attempt):
+        """Seconds to wait before retry number attempt (1 for the first retry)."""
+        return self.backoff * 2 ** (attempt - 1)
@@ -0,0 +1,107 @@
+"""
+Memory tracing for MIND steps, with tracemalloc.
+
+A traced step writes <prefix>.txt: the traced memory and the top allocation
+sites at the start of the step, at every checkpoint and at the end, followed
+by the sites that had grown the most by the checkpoint with the most memory
+in use. The step's variables are freed before the end checkpoint, so it is
+that growth and the peak that point at large or redundant copies. Each
+section is written as it is taken, so a step killed for running out of
+memory still leaves a trail.
+
+Steps can add checkpoints of their own; outside a traced step this does nothing:
+
+    import MIND_memory
+    MIND_memory.checkpoint('after calendar expansion')
+"""
+import time
+import threading
+import linecache
+import tracemalloc
+from contextlib import contextmanager
+
+# The tracer of the step running in this process, if it is being traced
+_tracer = None
+
+_IGNORED = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, linecache.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+]
+
+
+def _size(nbytes):
+    return f"{nbytes / 1024 / 1024:,.1f} MiB"
+
+
+class MemoryTracer:
+    def __init__(self, path, interval=0, top=15):
+        self.path = path
+        self.interval = interval
+        self.top = top
+        self.lock = threading.Lock()
+        self.started = None
+        self.first = None
+        self.highest = (-1, None, None)
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        tracemalloc.start()
+        self.started = time.time()
+        open(self.path, 'w').close()
+        self.first = self.checkpoint('start')
+        if self.interval > 0:
+            self.thread = threading.Thread(target=self._every_interval, daemon=True)
+            self.thread.start()
+
+    def _every_interval(self):
+        while not self.stopped.wait(self.interval):
+            self.checkpoint('interval')
+
+    def checkpoint(self, label):
+        """Writes the traced memory and top allocation sites now. Returns the snapshot."""
+        with self.lock:
+            snapshot = tracemalloc.take_snapshot().filter_traces(_IGNORED)
+            current, peak = tracemalloc.get_traced_memory()
+            if current > self.highest[0]:
+                self.highest = (current, label, snapshot)
+            with open(self.path, 'a') as f:
+                f.write(f"== {label} at +{time.time() - self.started:.1f}s: "
+                        f"current {_size(current)}, peak {_size(peak)}\n")
+                for stat in snapshot.statistics('lineno')[:self.top]:
+                    f.write(f"  {_size(stat.size):>12}  {stat.count:>10,} blocks  {stat.traceback}\n")
+                f.write("\n")
+            return snapshot
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.checkpoint('end')
+        current, label, snapshot = self.highest
+        with open(self.path, 'a') as f:
+            f.write(f"== growth from start to '{label}', the checkpoint with the most memory in use ({_size(current)})\n")
+            for stat in snapshot.compare_to(self.first, 'lineno')[:self.top]:
+                f.write(f"  {_size(stat.size_diff):>12}  {stat.count_diff:>+10,} blocks  {stat.traceback}\n")
+        tracemalloc.stop()
+
+
+def checkpoint(label):
+    """Records the memory of the running step under label, when the step is being traced."""
+    if _tracer is not None:
+        _tracer.checkpoint(label)
+
+
+@contextmanager
+def traced(prefix, interval=0):
+    """Traces the memory of the block into <prefix>.txt, with a checkpoint every interval seconds if set."""
+    global _tracer
+    _tracer = MemoryTracer(f"{prefix}.txt", interval=interval)
+    _tracer.start()
+    try:
+        yield
+    finally:
+        _tracer.stop()
+        _tracer = None
@@ -0,0 +1,248 @@
+"""
+Run metrics in the Prometheus text format, for node_exporter's textfile collector.
+
+While a step runs, instrument() counts what it does through the libraries
+the reports use, into COUNTERS:
+
+    pandas.read_sql / read_sql_query    queries, rows returned and time taken
+    MIND_db / MIND_querycache           chunked reads, and queries answered from the query cache
+    pyodbc.connect                      connection attempts and failures
+    smtplib.SMTP.sendmail               emails sent and time taken (send_message goes through it)
+    paramiko.SFTPClient.put             files uploaded, bytes and time taken
+
+Libraries are patched when they are imported, so a step that never imports
+one does not pay for it, and uninstrument() puts them back as they were. The counts end up in the run manifest with the
+rest of the step's record, and when the run finishes write_textfile() turns
+the manifest into MIND_logs/metrics/mind_<report>.prom (or [MIND]
+metrics_dir) for node_exporter's --collector.textfile.directory to pick up.
+"""
+import os
+import sys
+import time
+import datetime
+import functools
+from pathlib import Path
+
+COUNTERS = {
+    'queries': 0,
+    'query_rows': 0,
+    'query_seconds': 0.0,
+    'query_cache_hits': 0,
+    'db_connects': 0,
+    'db_connect_failures': 0,
+    'emails': 0,
+    'email_seconds': 0.0,
+    'sftp_puts': 0,
+    'sftp_bytes': 0,
+    'sftp_seconds': 0.0,
+}
+
+
+# The attributes instrument() replaced, as (owner, name, original), for uninstrument()
+_REPLACED = []
+
+
+def _replace(owner, name, replacement):
+    _REPLACED.append((owner, name, getattr(owner, name)))
+    setattr(owner, name, replacement)
+
+
+def _timed_read_sql(read_sql):
+    @functools.wraps(read_sql)
+    def wrapper(*args, **kwargs):
+        started = time.time()
+        result = read_sql(*args, **kwargs)
+        COUNTERS['query_seconds'] += time.time() - started
+        COUNTERS['queries'] += 1
+        # With chunksize the result is an iterator whose rows are not known yet
+        if hasattr(result, 'shape'):
+            COUNTERS['query_rows'] += len(result)
+        return result
+    return wrapper
+
+
+def _patch_pandas(pandas):
+    for name in ('read_sql', 'read_sql_query'):
+        _replace(pandas, name, _timed_read_sql(getattr(pandas, name)))
+
+
+def _patch_pyodbc(pyodbc):
+    connect = pyodbc.connect
+
+    @functools.wraps(connect)
+    def wrapper(*args, **kwargs):
+        COUNTERS['db_connects'] += 1
+        try:
+            return connect(*args, **kwargs)
+        except Exception:
+            COUNTERS['db_connect_failures'] += 1
+            raise
+
+    _replace(pyodbc, 'connect', wrapper)
+
+
+def _patch_smtplib(smtplib):
+    sendmail = smtplib.SMTP.sendmail
+
+    @functools.wraps(sendmail)
+    def wrapper(self, *args, **kwargs):
+        started = time.time()
+        result = sendmail(self, *args, **kwargs)
+        COUNTERS['email_seconds'] += time.time() - started
+        COUNTERS['emails'] += 1
+        return result
+
+    _replace(smtplib.SMTP, 'sendmail', wrapper)
+
+
+def _patch_paramiko(paramiko):
+    put = paramiko.SFTPClient.put
+
+    @functools.wraps(put)
+    def wrapper(self, localpath, *args, **kwargs):
+        started = time.time()
+        result = put(self, localpath, *args, **kwargs)
+        COUNTERS['sftp_seconds'] += time.time() - started
+        COUNTERS['sftp_puts'] += 1
+        COUNTERS['sftp_bytes'] += os.path.getsize(localpath)
+        return result
+
+    _replace(paramiko.SFTPClient, 'put', wrapper)
+
+
+_PATCHES = {
+    'pandas': _patch_pandas,
+    'pyodbc': _patch_pyodbc,
+    'smtplib': _patch_smtplib,
+    'paramiko': _patch_paramiko,
+}
+
+
+class _PatchOnImport:
+    """
+    A sys.meta_path finder that applies a patch from _PATCHES to its module as
+    soon as the module has been imported. (Not derived from importlib.abc,
+    which would add its import to every step's start.)
+    """
+
+    def find_spec(self, name, path, target=None):
+        if name not in _PATCHES:
+            return None
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        if spec.loader is None or not hasattr(spec.loader, 'exec_module'):
+            return spec
+
+        exec_module = spec.loader.exec_module
+
+        def exec_and_patch(module):
+            exec_module(module)
+            _PATCHES[name](module)
+
+        spec.loader.exec_module = exec_and_patch
+        return spec
+
+
+def instrumented():
+    return any(isinstance(finder, _PatchOnImport) for finder in sys.meta_path)
+
+
+def instrument():
+    """Starts counting into COUNTERS. Modules imported already are patched now, the others on import."""
+    if instrumented():
+        return
+    for name, patch in _PATCHES.items():
+        if name in sys.modules:
+            patch(sys.modules[name])
+    sys.meta_path.insert(0, _PatchOnImport())
+
+
+def uninstrument():
+    """Stops counting: restores everything instrument() patched. COUNTERS keep their counts."""
+    sys.meta_path[:] = [finder for finder in sys.meta_path if not isinstance(finder, _PatchOnImport)]
+    while _REPLACED:
+        owner, name, original = _REPLACED.pop()
+        setattr(owner, name, original)
+
+
+def since(started):
+    """What COUNTERS counted since started, an earlier copy of it."""
+    return {name: round(value - started[name], 3) for name, value in COUNTERS.items()}
+
+
+def _labels(**labels):
+    escaped = {name: str(value).replace('\\', '\\\\').replace('"', '\\"') for name, value in labels.items()}
+    return ','.join(f'{name}="{value}"' for name, value in escaped.items())
+
+
+# name: (help, key of the step's record or of its calls; None for success)
+STEP_METRICS = {
+    'mind_step_duration_seconds': ('Wall time of the step in the last run.', 'wall_seconds'),
+    'mind_step_cpu_seconds': ('CPU time of the step in the last run.', 'cpu_seconds'),
+    'mind_step_peak_rss_bytes': ('Peak resident memory of the step in the last run.', 'peak_rss_bytes'),
+    'mind_step_success': ('1 if the step succeeded in the last run, else 0.', None),
+    'mind_step_queries': ('pandas.read_sql calls made by the step in the last run.', 'queries'),
+    'mind_step_query_rows': ('Rows returned by the step\'s queries in the last run.', 'query_rows'),
+    'mind_step_query_seconds': ('Time the step spent in pandas.read_sql in the last run.', 'query_seconds'),
+    'mind_step_query_cache_hits': ('Queries the step answered from the shared query cache in the last run.',
+                                   'query_cache_hits'),
+    'mind_step_db_connects': ('pyodbc.connect attempts by the step in the last run.', 'db_connects'),
+    'mind_step_db_connect_failures': ('pyodbc.connect attempts that failed (and were retried or fatal) in the last run.',
+                                      'db_connect_failures'),
+    'mind_step_emails': ('Emails sent by the step in the last run.', 'emails'),
+    'mind_step_email_seconds': ('Time the step spent sending email in the last run.', 'email_seconds'),
+    'mind_step_sftp_puts': ('Files the step uploaded over SFTP in the last run.', 'sftp_puts'),
+    'mind_step_sftp_bytes': ('Bytes the step uploaded over SFTP in the last run.', 'sftp_bytes'),
+    'mind_step_sftp_seconds': ('Time the step spent uploading over SFTP in the last run.', 'sftp_seconds'),
+}
+
+
+def write_textfile(path, run):
+    """
+    Writes the metrics of a finished run, a RunManifest's run record, to path.
+    The file is replaced in one go, so the collector never reads half of it.
+    """
+    report = run['report']
+    started = datetime.datetime.fromisoformat(run['started'])
+    finished = datetime.datetime.fromisoformat(run['finished'])
+    lines = [
+        '# HELP mind_run_success 1 if the last run of the report succeeded, else 0.',
+        '# TYPE mind_run_success gauge',
+        f'mind_run_success{{{_labels(report=report)}}} {int(run["status"] == "succeeded")}',
+        '# HELP mind_run_duration_seconds Wall time of the last run of the report.',
+        '# TYPE mind_run_duration_seconds gauge',
+        f'mind_run_duration_seconds{{{_labels(report=report)}}} {(finished - started).total_seconds()}',
+        '# HELP mind_run_last_finished_timestamp_seconds When the last run of the report finished.',
+        '# TYPE mind_run_last_finished_timestamp_seconds gauge',
+        f'mind_run_last_finished_timestamp_seconds{{{_labels(report=report)}}} {finished.timestamp()}',
+    ]
+
+    # The last record of a step is the attempt that counted
+    steps = {}
+    for step in run['steps']:
+        steps[step['step']] = step
+    for name, (help_text, key) in STEP_METRICS.items():
+        samples = []
+        for step in steps.values():
+            if key is None:
+                value = int(step['exit_status'] == 0)
+            else:
+                value = step.get(key, (step.get('calls') or {}).get(key))
+            if value is None:
+                continue
+            samples.append(f'{name}{{{_labels(report=report, step=Path(step["step"]).stem)}}} {value}')
+        if samples:
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge'] + samples
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial = path.with_name(path.name + f'.{os.getpid()}.tmp')
+    with open(partial, 'w', newline='\n') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(partial, path)
@@ -0,0 +1,414 @@
+"""
+A local mirror of cw_patient_notes, for reports to read instead of the EHR.
+
+    python MIND_mirror.py [--full]
+
+The mirror holds the COLUMNS below of every note, one zstd-compressed
+Parquet file per month of date_of_service in MIND_mirror/cw_patient_notes
+(none.parquet for notes without one). The first sync, or one with --full,
+reads the whole table. After that a sync asks which dates of service have
+notes entered or changed since the watermark, the latest data_entry_date
+seen, and reads those days again in full, along with the last resync_days
+days. A day is always replaced whole, so no note key is needed and a note
+changed twice is not counted twice. data_entry_time is kept but not used
+for the watermark: it is 12-hour text ('08:00 AM') that does not sort in
+SQL, so the watermark's whole day is read again instead.
+
+A note moved to another date of service, or deleted, stays on its old day
+until that day is read again; run a --full sync now and then (weekly, say)
+to clear those. Settings are in MIND_config/notes_mirror.ini:
+
+    [notes_mirror]
+    max_age_hours = 26
+    resync_days = 14
+
+Reports read the mirror with read_notes(), which returns the notes with
+the dtypes MIND_db.read_sql gives them (see as_queried), or None when the
+mirror is missing, older than max_age_hours, turned off for the report
+([MIND] notes_mirror = false, passed on as MIND_NOTES_MIRROR=off) or pyarrow
+is missing, so the report queries the database as before:
+
+    notes = MIND_mirror.read_notes(['PATID', 'date_of_service'], start, end)
+    if notes is None:
+        notes = MIND_db.read_sql(notes_sql, 'CWS', params=[start, end])
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import datetime
+import importlib.util
+import configparser
+from pathlib import Path
+
+import MIND_db
+
+MIND_ROOT = Path(__file__).resolve().parents[2]
+CONFIG_FILE = MIND_ROOT / 'MIND' / 'MIND_config' / 'notes_mirror.ini'
+
+TABLE = 'SYSTEM.cw_patient_notes'
+
+# The mirrored columns and the dtype each is stored as, so every month file has the same schema
+COLUMNS = {
+    'PATID': 'string',
+    'EPISODE_NUMBER': 'Int64',
+    'date_of_service': 'datetime64[ns]',
+    'date_of_note': 'datetime64[ns]',
+    'service_charge_code': 'string',
+    'service_program_value': 'string',
+    'location_code': 'string',
+    'practitioner_id': 'string',
+    'practitioner_name': 'string',
+    'service_duration': 'float64',
+    'draft_final_code': 'string',
+    'draft_final_value': 'string',
+    'document_routing_status': 'string',
+    'data_entry_date': 'datetime64[ns]',
+    'data_entry_time': 'string',
+}
+
+SELECT = f"SELECT {', '.join(COLUMNS)} FROM {TABLE}"
+
+
+def typed(frame):
+    """frame with every column in its COLUMNS dtype."""
+    import pandas as pd
+
+    frame = frame.copy()
+    for name, dtype in COLUMNS.items():
+        if dtype == 'datetime64[ns]':
+            frame[name] = pd.to_datetime(frame[name], errors='coerce')
+        elif dtype in ('Int64', 'float64'):
+            frame[name] = pd.to_numeric(frame[name], errors='coerce').astype(dtype)
+        else:
+            frame[name] = frame[name].astype(dtype)
+    return frame[list(COLUMNS)]
+
+
+def kinds(frame):
+    """The kind of value (pandas.api.types.infer_dtype) the database returned in each column of frame that has any."""
+    import pandas as pd
+
+    found = {}
+    for name in frame.columns:
+        kind = pd.api.types.infer_dtype(frame[name], skipna=True)
+        if kind != 'empty':
+            found[name] = kind
+    return found
+
+
+def queried_value(value, kind):
+    """A mirrored value as the database returned it, by its column's kind (see kinds)."""
+    if kind == 'date':
+        return value.date()
+    if kind in ('datetime', 'datetime64'):
+        return value.to_pydatetime()
+    if kind == 'integer':
+        return int(value)
+    if kind in ('floating', 'decimal'):
+        return float(value)
+    if kind == 'string':
+        return str(value)
+    return value
+
+
+def as_queried(frame, column_kinds):
+    """
+    frame with the dtypes MIND_db.read_sql gives the same rows. Each
+    column's dtype is the one DataFrame.from_records, as MIND_db uses it,
+    gives a value of the kind column_kinds says the database returned
+    (datetime.date for a DATE column, int, float or str), with a NULL when
+    the column has any; the column is then cast to it whole.
+    """
+    import pandas as pd
+
+    if frame.empty:
+        return pd.DataFrame.from_records([], columns=list(frame.columns))
+    columns = {}
+    for name in frame.columns:
+        column = frame[name].reset_index(drop=True)
+        kind = column_kinds.get(name)
+        present = column.notna()
+        sample = [(queried_value(column[present.idxmax()], kind) if present.any() else None,)]
+        if not present.all():
+            sample.append((None,))
+        dtype = pd.DataFrame.from_records(sample, columns=[name], coerce_float=True)[name].dtype
+        if dtype == object:
+            if kind == 'date':
+                column = column.dt.date
+            elif kind == 'string':
+                column = column.astype(str)
+            column = column.astype(object).where(present, None)
+        else:
+            column = column.astype(dtype)
+        columns[name] = column
+    return pd.DataFrame(columns)
+
+
+def month_of(dates):
+    """The month file name of each date of service, 'none' where there is none."""
+    return dates.dt.strftime('%Y-%m').fillna('none')
+
+
+def day_ranges(days):
+    """Sorted days as (first, last) runs of consecutive days."""
+    ranges = []
+    for day in sorted(days):
+        if ranges and day - ranges[-1][1] == datetime.timedelta(days=1):
+            ranges[-1][1] = day
+        else:
+            ranges.append([day, day])
+    return [tuple(run) for run in ranges]
+
+
+class NotesMirror:
+    """
+    <directory>/<YYYY-MM>.parquet    the notes of a month of date_of_service
+    <directory>/none.parquet         the notes without a date of service
+    <directory>/state.json           watermark, data_entry_time, synced_at, kinds
+    """
+
+    def __init__(self, directory, max_age_hours=26, resync_days=14):
+        self.directory = Path(directory)
+        self.max_age_hours = max_age_hours
+        self.resync_days = resync_days
+
+    @classmethod
+    def from_config(cls, config_file=CONFIG_FILE, directory=None):
+        config = configparser.ConfigParser()
+        config.read(config_file)
+        return cls(
+            directory or MIND_ROOT / 'MIND_mirror' / 'cw_patient_notes',
+            max_age_hours=config.getfloat('notes_mirror', 'max_age_hours', fallback=26),
+            resync_days=config.getint('notes_mirror', 'resync_days', fallback=14),
+        )
+
+    def state(self):
+        try:
+            with open(self.directory / 'state.json', 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_state(self, state):
+        partial = self.directory / f"state.json.{os.getpid()}.tmp"
+        with open(partial, 'w') as f:
+            json.dump(state, f, indent=2)
+        os.replace(partial, self.directory / 'state.json')
+
+    def _write_month(self, directory, month, frame):
+        path = directory / f"{month}.parquet"
+        partial = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        frame.reset_index(drop=True).to_parquet(partial, compression='zstd', index=False)
+        os.replace(partial, path)
+
+    def _read_month(self, month, columns=None):
+        import pandas as pd
+
+        path = self.directory / f"{month}.parquet"
+        if not path.exists():
+            return typed(pd.DataFrame(columns=list(COLUMNS)))[columns or list(COLUMNS)]
+        return pd.read_parquet(path, columns=columns)
+
+    def _typed(self, chunk):
+        """typed(chunk), noting the kind of value the database returned in each column for as_queried."""
+        self.kinds.update(kinds(chunk))
+        return typed(chunk)
+
+    def sync(self, full=False):
+        """Brings the mirror up to date: in full the first time or with full=True, else from the watermark."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        state = self.state()
+        synced_at = datetime.datetime.now().isoformat(timespec='seconds')
+        started = time.time()
+        self.kinds = {}
+        if full or not state or 'watermark' not in state:
+            rows, watermark, entry_time = self._sync_full()
+        else:
+            rows, watermark, entry_time = self._sync_since(state['watermark'])
+        state = self.state() or {}
+        if watermark is not None:
+            state['watermark'] = watermark
+            state['data_entry_time'] = entry_time
+        state['kinds'] = {**state.get('kinds', {}), **self.kinds}
+        state['synced_at'] = synced_at
+        self._write_state(state)
+        print(f"[mirror] {TABLE}: {rows:,} rows read in {time.time() - started:.0f}s, "
+              f"watermark {state.get('watermark')}")
+
+    @staticmethod
+    def _latest_entry(frame):
+        """(data_entry_date, data_entry_time) of the latest entry in frame, or (None, None)."""
+        import pandas as pd
+
+        entered = frame.dropna(subset=['data_entry_date'])
+        if entered.empty:
+            return None, None
+        times = pd.to_datetime(entered['data_entry_time'], format='%I:%M %p', errors='coerce')
+        stamp = entered['data_entry_date'] + (times - times.dt.normalize()).fillna(pd.Timedelta(0))
+        latest = entered.loc[stamp.idxmax()]
+        return latest['data_entry_date'].strftime('%Y-%m-%d'), latest['data_entry_time']
+
+    def _sync_full(self):
+        """Reads the whole table into a staging directory, then swaps it in a month at a time."""
+        import pandas as pd
+
+        staging = self.directory.with_name(self.directory.name + '.staging')
+        shutil.rmtree(staging, ignore_errors=True)
+        parts = staging / 'parts'
+        parts.mkdir(parents=True)
+
+        rows = 0
+        latest = (None, None)
+        for number, chunk in enumerate(MIND_db.read_chunks(SELECT, 'CWS')):
+            chunk = self._typed(chunk)
+            rows += len(chunk)
+            latest = max(latest, self._latest_entry(chunk), key=lambda entry: entry[0] or '')
+            for month, notes in chunk.groupby(month_of(chunk['date_of_service'])):
+                notes.to_parquet(parts / f"{month}.{number:06d}.parquet", compression='zstd', index=False)
+            print(f"  {rows:,} {TABLE} rows read")
+
+        months = sorted({path.name.split('.')[0] for path in parts.glob('*.parquet')})
+        for month in months:
+            frame = pd.concat([pd.read_parquet(path) for path in sorted(parts.glob(f"{month}.*.parquet"))],
+                              ignore_index=True)
+            self._write_month(staging, month, frame)
+        shutil.rmtree(parts)
+
+        for path in staging.glob('*.parquet'):
+            os.replace(path, self.directory / path.name)
+        for path in self.directory.glob('*.parquet'):
+            if path.stem not in months:
+                path.unlink()
+        shutil.rmtree(staging)
+        return rows, latest[0], latest[1]
+
+    def _sync_since(self, watermark):
+        """Reads again the dates of service with notes entered on or after watermark, and the last resync_days days."""
+        import pandas as pd
+
+        changed = MIND_db.read_sql(
+            f"SELECT DISTINCT date_of_service FROM {TABLE} WHERE data_entry_date >= ?",
+            'CWS', params=[watermark], cache=False,
+        )
+        dates = pd.to_datetime(changed['date_of_service'], errors='coerce')
+        today = datetime.date.today()
+        days = {day.date() for day in dates.dropna()}
+        days |= {today - datetime.timedelta(days=back) for back in range(self.resync_days + 1)}
+
+        frames = []
+        for first, last in day_ranges(days):
+            sql = f"{SELECT} WHERE date_of_service BETWEEN ? AND ?"
+            frames += [self._typed(chunk) for chunk in MIND_db.read_chunks(sql, 'CWS', params=[first, last])]
+        if dates.isna().any():
+            frames += [self._typed(chunk) for chunk in MIND_db.read_chunks(f"{SELECT} WHERE date_of_service IS NULL", 'CWS')]
+        fresh = pd.concat(frames, ignore_index=True) if frames else typed(pd.DataFrame(columns=list(COLUMNS)))
+
+        read_days = pd.to_datetime(sorted(days))
+        months = set(month_of(pd.Series(read_days))) | set(month_of(fresh['date_of_service']))
+        if dates.isna().any():
+            months.add('none')
+        for month in sorted(months):
+            kept = self._read_month(month)
+            if month == 'none':
+                kept = kept.iloc[0:0]
+            else:
+                kept = kept[~kept['date_of_service'].dt.normalize().isin(read_days)]
+            self._write_month(self.directory, month,
+                              pd.concat([kept, fresh[month_of(fresh['date_of_service']) == month]], ignore_index=True))
+
+        latest_date, latest_time = self._latest_entry(fresh)
+        if latest_date is None or latest_date < watermark:
+            return len(fresh), watermark, (self.state() or {}).get('data_entry_time')
+        return len(fresh), latest_date, latest_time
+
+    def age_hours(self):
+        """Hours since the last sync, or None when the mirror has never been synced."""
+        state = self.state()
+        if not state or 'synced_at' not in state:
+            return None
+        synced = datetime.datetime.fromisoformat(state['synced_at'])
+        return (datetime.datetime.now() - synced).total_seconds() / 3600
+
+    def read(self, columns=None, start=None, end=None):
+        """
+        The mirrored notes with date_of_service BETWEEN start AND end, as SQL
+        has it (either may be None, and a date end is its midnight), with the
+        dtypes MIND_db.read_sql would give them, or None when the mirror is
+        older than max_age_hours or has never been synced.
+        """
+        import pandas as pd
+
+        columns = list(columns or COLUMNS)
+        unknown = [name for name in columns if name not in COLUMNS]
+        if unknown:
+            raise ValueError(f"Not in the {TABLE} mirror: {', '.join(unknown)}")
+        age = self.age_hours()
+        if age is None or age > self.max_age_hours:
+            print(f"[mirror] {TABLE} mirror is {'missing' if age is None else f'{age:.0f} hours old'}; "
+                  f"querying the database")
+            return None
+
+        start = pd.Timestamp(start) if start is not None else None
+        end = pd.Timestamp(end) if end is not None else None
+        wanted = columns if 'date_of_service' in columns else columns + ['date_of_service']
+        frames = []
+        for path in sorted(self.directory.glob('*.parquet')):
+            month = path.stem
+            if month == 'none':
+                if start is not None or end is not None:
+                    continue
+            elif (start is not None and month < start.strftime('%Y-%m')) or \
+                    (end is not None and month > end.strftime('%Y-%m')):
+                continue
+            frames.append(pd.read_parquet(path, columns=wanted))
+        frame = pd.concat(frames, ignore_index=True) if frames else typed(pd.DataFrame(columns=list(COLUMNS)))[wanted]
+        if start is not None:
+            frame = frame[frame['date_of_service'] >= start]
+        if end is not None:
+            frame = frame[frame['date_of_service'] <= end]
+        state = self.state()
+        print(f"[mirror] {len(frame):,} {TABLE} rows from the mirror synced at {state['synced_at']}")
+        return as_queried(frame[columns], state.get('kinds', {}))
+
+
+_SHARED = []
+
+
+def shared():
+    """The notes mirror reports read, or None when it is off for the report or pyarrow is missing."""
+    if os.getenv('MIND_NOTES_MIRROR', '').strip().lower() in ('off', 'false', '0', 'no'):
+        return None
+    if not _SHARED:
+        mirror = None
+        if importlib.util.find_spec('pyarrow') is not None:
+            mirror = NotesMirror.from_config()
+        _SHARED.append(mirror)
+    return _SHARED[0]
+
+
+def read_notes(columns=None, start=None, end=None):
+    """NotesMirror.read() on the shared mirror, or None when there is none to read."""
+    mirror = shared()
+    return mirror.read(columns, start, end) if mirror is not None else None
+
+
+def main(argv=None):
+    """Syncs the mirror, as Task Scheduler runs it: on its own, with the database settings from MIND.env."""
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(usage="python MIND_mirror.py [--full]")
+    parser.add_argument('--full', action='store_true', help="read the whole table again")
+    args = parser.parse_args(argv)
+
+    if importlib.util.find_spec('pyarrow') is None:
+        print("The notes mirror needs pyarrow")
+        sys.exit(1)
+    load_dotenv(dotenv_path='C:/MIND/MIND/MIND_config/MIND.env')
+    NotesMirror.from_config().sync(full=args.full)
+
+
+if __name__ == "__main__":
+    main()
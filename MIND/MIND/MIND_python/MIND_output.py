@@ -0,0 +1,97 @@
+import datetime
+import threading
+import subprocess
+from collections import deque
+
+# Steps running side by side write to the same log
+LOG_LOCK = threading.Lock()
+
+
+class StepOutput:
+    """
+    A step's stdout and stderr, written to the run's log line by line as they
+    arrive, each line stamped with the time and tagged with the step:
+
+        2026-01-05 06:00:12 [productivity_report_00] Loading appointments...
+        2026-01-05 06:00:40 [productivity_report_00 stderr] UserWarning: ...
+
+    Only the last tail_lines lines are kept in memory, for the error email.
+    """
+
+    def __init__(self, script_path, log_file, tail_lines=200):
+        self.step = script_path.stem
+        self.log_file = log_file
+        self.tail = deque(maxlen=tail_lines)
+
+    def write_line(self, line, stream='stdout'):
+        line = line.rstrip('\r\n')
+        tag = self.step if stream == 'stdout' else f"{self.step} {stream}"
+        stamp = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.tail.append(line)
+        with LOG_LOCK:
+            with open(self.log_file, 'a') as log:
+                log.write(f"{stamp} [{tag}] {line}\n")
+
+    def pump(self, pipe, stream):
+        for line in pipe:
+            self.write_line(line, stream)
+        pipe.close()
+
+    def follow(self, process, timeout=None):
+        """
+        Streams a running process's stdout and stderr into the log until it
+        exits, and returns its exit status. A process still running after
+        timeout seconds is killed and subprocess.TimeoutExpired raised.
+        """
+        readers = [
+            threading.Thread(target=self.pump, args=(process.stdout, 'stdout'), daemon=True),
+            threading.Thread(target=self.pump, args=(process.stderr, 'stderr'), daemon=True),
+        ]
+        for reader in readers:
+            reader.start()
+        try:
+            returncode = process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+            # Anything the step started itself may still hold the pipes open
+            for reader in readers:
+                reader.join(timeout=5)
+            raise
+        for reader in readers:
+            reader.join()
+        return returncode
+
+    def stream(self, stream='stdout'):
+        """A file object for redirect_stdout / redirect_stderr that writes into the log line by line."""
+        return _LineWriter(self, stream)
+
+    def text(self):
+        return '\n'.join(self.tail)
+
+
+class _LineWriter:
+    encoding = 'utf-8'
+
+    def __init__(self, output, stream):
+        self.output = output
+        self.stream = stream
+        self.pending = ''
+
+    def write(self, text):
+        self.pending += text
+        *lines, self.pending = self.pending.split('\n')
+        for line in lines:
+            self.output.write_line(line, self.stream)
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+    def close(self):
+        if self.pending:
+            self.output.write_line(self.pending, self.stream)
+            self.pending = ''
@@ -0,0 +1,64 @@
+import sys
+import cProfile
+import threading
+from pathlib import Path
+from collections import Counter
+from contextlib import contextmanager
+
+
+class StackSampler:
+    """
+    Samples the call stack of one thread every interval seconds, counting
+    identical stacks. write() saves them in the collapsed format read by
+    flamegraph.pl and speedscope: one `outer;inner;innermost count` per line.
+    """
+
+    def __init__(self, thread_id, interval=0.01):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{Path(code.co_filename).name}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+@contextmanager
+def profiled(prefix):
+    """
+    Profiles the block with cProfile and a stack sampler, writing
+    <prefix>.pstats (open with `python -m pstats` or snakeviz) and
+    <prefix>.folded (collapsed stacks for a flame graph).
+    """
+    sampler = StackSampler(threading.get_ident())
+    profiler = cProfile.Profile()
+    sampler.start()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        sampler.stop()
+        profiler.dump_stats(f"{prefix}.pstats")
+        sampler.write(f"{prefix}.folded")
@@ -0,0 +1,235 @@
+"""
+Query results shared by all reports, in MIND_cache/queries.
+
+MIND_db.read_sql (and so read_queries) looks a query up here before sending
+it to the database, and stores what the database returned. Entries are
+keyed by the query's normalized SQL (comments, spacing and the case of
+everything outside string literals do not matter), its parameters and the
+database it ran on, and are stored as zstd-compressed Parquet files.
+
+Only queries reading tables listed in MIND_config/query_cache.ini are
+cached, for as long as the shortest time to live among the tables they
+read:
+
+    [query_cache]
+    max_mb = 4096
+
+    [ttl_minutes]
+    SYSTEM.view_client_episode_history = 240
+
+Tables are matched on their last two name parts, so AVCWS.SYSTEM.x and
+SYSTEM.x are the same table. Every table named after FROM (each one of a
+comma-separated list) or JOIN counts, and a query naming anything that is
+not listed, a CTE or table function included, is not cached. Beyond max_mb
+the least recently used entries are removed.
+
+The cache is off unless a report turns it on: reports that can live with
+results up to a few hours old set query_cache = true in [MIND], and MIND.py
+passes it on to their steps as MIND_QUERY_CACHE=on. Without pyarrow nothing
+is cached.
+"""
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import logging
+import threading
+import importlib.util
+import configparser
+from pathlib import Path
+
+MIND_ROOT = Path(__file__).resolve().parents[2]
+CONFIG_FILE = MIND_ROOT / 'MIND' / 'MIND_config' / 'query_cache.ini'
+
+_LITERALS = re.compile(r"('(?:[^']|'')*')")
+_COMMENTS = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+# Names (quoted parts included), parentheses, commas and anything else one character at a time
+_TOKENS = re.compile(r'(?:\w|"[^"]*")(?:[\w.$#]|"[^"]*")*|\S')
+# Where the tables of a FROM or JOIN end
+_CLAUSE_ENDS = {'where', 'group', 'order', 'having', 'union', 'except', 'intersect', 'join', 'inner', 'left', 'right',
+                'full', 'cross', 'outer', 'apply', 'limit', 'offset', 'fetch', 'for', 'window', ';'}
+
+
+def normalize_sql(sql):
+    """sql without comments, with runs of whitespace made one space and everything outside string literals lower case."""
+    parts = _LITERALS.split(sql)
+    for index in range(0, len(parts), 2):
+        parts[index] = ' '.join(_COMMENTS.sub(' ', parts[index]).lower().split())
+    return ''.join(parts).strip()
+
+
+def tables(sql):
+    """
+    The tables a query reads, as lower case schema.table: the first name
+    after every JOIN, and after FROM and each comma of its list. Subqueries
+    are read for their own FROM clauses.
+    """
+    tokens = _TOKENS.findall(_LITERALS.sub("''", normalize_sql(sql)))
+    found = set()
+    for index, token in enumerate(tokens):
+        if token not in ('from', 'join'):
+            continue
+        position = index + 1
+        while position < len(tokens):
+            name = tokens[position]
+            if name != '(':
+                found.add('.'.join(name.replace('"', '').split('.')[-2:]))
+            # Skip the alias, hints and any ON condition up to the next table of the list or the end of the clause
+            depth = 0
+            for position in range(position + (name != '('), len(tokens)):
+                token = tokens[position]
+                if token == '(':
+                    depth += 1
+                elif token == ')':
+                    depth -= 1
+                if depth < 0 or (depth == 0 and (token == ',' or token in _CLAUSE_ENDS)):
+                    break
+            else:
+                position = len(tokens)
+            if position < len(tokens) and tokens[position] == ',' and depth == 0:
+                position += 1
+                continue
+            break
+    return found
+
+
+class QueryCache:
+    """
+    <directory>/<key>.parquet     the result
+    <directory>/<key>.json        sql, tables, created, last_used, size
+    """
+
+    def __init__(self, directory, ttl_minutes, max_mb=4096):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.ttls = {'.'.join(table.lower().split('.')[-2:]): minutes * 60 for table, minutes in ttl_minutes.items()}
+        self.max_bytes = max_mb * 1024 * 1024
+
+    @classmethod
+    def from_config(cls, config_file=CONFIG_FILE, directory=None):
+        """The cache configured by config_file, or None when it lists no tables."""
+        config = configparser.ConfigParser()
+        config.read(config_file)
+        if not config.has_section('ttl_minutes'):
+            return None
+        ttl_minutes = {table: float(minutes) for table, minutes in config.items('ttl_minutes') if minutes.strip()}
+        if not ttl_minutes:
+            return None
+        return cls(
+            directory or MIND_ROOT / 'MIND_cache' / 'queries',
+            ttl_minutes,
+            max_mb=config.getfloat('query_cache', 'max_mb', fallback=4096),
+        )
+
+    def ttl(self, sql):
+        """Seconds the result of sql may be reused for, or None when it is not cached."""
+        read = tables(sql)
+        if not read or any(table not in self.ttls for table in read):
+            return None
+        return min(self.ttls[table] for table in read)
+
+    def key(self, sql, params, connection_string):
+        digest = hashlib.sha256()
+        digest.update(normalize_sql(sql).encode())
+        digest.update(json.dumps(list(params) if params is not None else None, default=str).encode())
+        digest.update(connection_string.encode())
+        return digest.hexdigest()
+
+    def _write_json(self, path, entry):
+        partial = path.with_name(f"{path.name}.{os.getpid()}_{threading.get_ident()}.tmp")
+        with open(partial, 'w') as f:
+            json.dump(entry, f)
+        os.replace(partial, path)
+
+    def get(self, key, ttl):
+        """The cached result, if it is younger than ttl seconds, else None."""
+        entry_file = self.directory / f"{key}.json"
+        try:
+            with open(entry_file, 'r') as f:
+                entry = json.load(f)
+            if time.time() - entry['created'] > ttl:
+                return None
+            import pandas as pd
+            frame = pd.read_parquet(self.directory / f"{key}.parquet")
+            entry['last_used'] = time.time()
+            self._write_json(entry_file, entry)
+        except (OSError, ValueError, KeyError):
+            # Missing, being replaced or evicted by another run: query the database
+            return None
+        metrics = sys.modules.get('MIND_metrics')
+        if metrics:
+            metrics.COUNTERS['query_cache_hits'] += 1
+        print(f"[DB] Using the cached result from {time.strftime('%H:%M', time.localtime(entry['created']))} "
+              f"({len(frame):,} rows)")
+        return frame
+
+    def put(self, key, frame, sql):
+        """Stores a result. Results Parquet cannot hold (mixed-type columns and the like) are not cached."""
+        path = self.directory / f"{key}.parquet"
+        partial = path.with_name(f"{path.name}.{os.getpid()}_{threading.get_ident()}.tmp")
+        try:
+            frame.to_parquet(partial, compression='zstd')
+        except Exception as e:
+            logging.info("Not caching a query result: %s", e)
+            if partial.exists():
+                partial.unlink()
+            return
+        os.replace(partial, path)
+        now = time.time()
+        self._write_json(self.directory / f"{key}.json", {
+            'sql': normalize_sql(sql),
+            'tables': sorted(tables(sql)),
+            'created': now,
+            'last_used': now,
+            'size': path.stat().st_size,
+        })
+        self.evict()
+
+    def evict(self):
+        """Removes entries past the longest time to live, then the least recently used ones until under max_mb."""
+        longest = max(self.ttls.values())
+        now = time.time()
+        entries = []
+        for entry_file in self.directory.glob('*.json'):
+            try:
+                with open(entry_file, 'r') as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if now - entry['created'] > longest:
+                self._remove(entry_file)
+                continue
+            entries.append((entry['last_used'], entry['size'], entry_file))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry_file in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            logging.info("Evicting cached query result %s", entry_file.stem)
+            self._remove(entry_file)
+            total -= size
+
+    def _remove(self, entry_file):
+        for path in (entry_file, entry_file.with_suffix('.parquet')):
+            try:
+                path.unlink()
+            except OSError:
+                # Still being read by another run; it goes next time
+                pass
+
+
+_SHARED = []
+
+
+def shared():
+    """The cache every step uses, or None when it is off, not configured or pyarrow is missing."""
+    if os.getenv('MIND_QUERY_CACHE', '').strip().lower() not in ('on', 'true', '1', 'yes'):
+        return None
+    if not _SHARED:
+        cache = None
+        if importlib.util.find_spec('pyarrow') is not None:
+            cache = QueryCache.from_config()
+        _SHARED.append(cache)
+    return _SHARED[0]
@@ -0,0 +1,213 @@
+"""
+Daily snapshots of reference tables that barely change, for steps to read
+without going to the database.
+
+    fees = MIND_reference.table('SYSTEM.billing_tx_master_fee_table', 'PM')
+
+    python MIND_reference.py [--force]
+
+table() returns the whole table from its snapshot in
+MIND_reference/<database>/<table>.parquet when the snapshot was taken
+today, and touches neither the network nor the database to do so. The
+first step to ask for a table on a new day takes a new snapshot (reading
+the table once with MIND_db.read_sql) and everyone after it reads that.
+Steps filter and pick columns from the frame themselves, as they would
+have in their query.
+
+Each snapshot has a version stamp next to it, <table>.json:
+
+    version        a hash of the table's contents; it only changes when the contents do
+    refreshed_at   when the snapshot was last taken
+    changed_at     when the version last changed
+    rows
+
+and table() prints the version it read, so the step log shows which
+version of the table a run used. If taking a new snapshot fails, the old
+one is used, with a warning.
+
+MIND_config/reference_tables.ini lists the tables to snapshot ahead of the
+reports when MIND_reference.py runs from Task Scheduler in the early
+morning (--force takes new snapshots even of tables snapshotted today).
+Its [columns] section limits the snapshot of a table to the columns the
+steps use, for tables too large to keep whole or holding user and staff
+details that have no place on local disk; other tables are snapshotted
+whole:
+
+    [tables]
+    SYSTEM.billing_tx_master_fee_table = PM
+
+    [columns]
+    SYSTEM.billing_tx_master_fee_table = SERVICE_CODE, cpt_code, duration_range
+"""
+import os
+import sys
+import json
+import hashlib
+import argparse
+import datetime
+import importlib.util
+import configparser
+from pathlib import Path
+
+import MIND_db
+
+MIND_ROOT = Path(__file__).resolve().parents[2]
+CONFIG_FILE = MIND_ROOT / 'MIND' / 'MIND_config' / 'reference_tables.ini'
+
+
+def database_name(database):
+    """The name of the database behind a MIND_db database name or connection string, e.g. AVPM for 'PM'."""
+    settings = dict(part.split('=', 1) for part in MIND_db.connection_string(database).split(';') if '=' in part)
+    return {name.strip().upper(): value for name, value in settings.items()}.get('DATABASE', database)
+
+
+def version_of(frame):
+    """A short hash of frame's columns and contents."""
+    import pandas as pd
+
+    digest = hashlib.sha256(','.join(map(str, frame.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(frame.astype(str), index=False).values.tobytes())
+    return digest.hexdigest()[:12]
+
+
+class ReferenceSnapshots:
+    """
+    <directory>/<database>/<table>.parquet    the snapshot
+    <directory>/<database>/<table>.json       its version stamp
+    """
+
+    def __init__(self, directory, columns=None):
+        self.directory = Path(directory)
+        # The columns to snapshot of each table that is not snapshotted whole, by lower case table name
+        self.columns = {table.lower(): list(names) for table, names in (columns or {}).items()}
+
+    @classmethod
+    def from_config(cls, config_file=CONFIG_FILE, directory=None):
+        config = configparser.ConfigParser()
+        config.read(config_file)
+        columns = {}
+        if config.has_section('columns'):
+            columns = {table: [name.strip() for name in names.split(',') if name.strip()]
+                       for table, names in config.items('columns')}
+        return cls(directory or MIND_ROOT / 'MIND_reference', columns)
+
+    def _file(self, table, database, suffix):
+        return self.directory / database_name(database) / f"{table.lower()}{suffix}"
+
+    def stamp(self, table, database='PM'):
+        """The version stamp of a table's snapshot, or None when there is none."""
+        try:
+            with open(self._file(table, database, '.json'), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def fresh(self, table, database='PM'):
+        """Whether the table's snapshot was taken today, of the columns configured now."""
+        stamp = self.stamp(table, database)
+        return (bool(stamp) and stamp['refreshed_at'][:10] == datetime.date.today().isoformat()
+                and stamp.get('columns') == self.columns.get(table.lower()))
+
+    def refresh(self, table, database='PM'):
+        """Takes a new snapshot of the table, or of its configured columns, and returns its version stamp."""
+        columns = self.columns.get(table.lower())
+        frame = MIND_db.read_sql(f"SELECT {', '.join(columns) if columns else '*'} FROM {table}", database, cache=False)
+        path = self._file(table, database, '.parquet')
+        path.parent.mkdir(parents=True, exist_ok=True)
+        now = datetime.datetime.now().isoformat(timespec='seconds')
+        version = version_of(frame)
+        previous = self.stamp(table, database) or {}
+
+        partial = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        frame.to_parquet(partial, compression='zstd', index=False)
+        os.replace(partial, path)
+        stamp = {
+            'table': table,
+            'version': version,
+            'refreshed_at': now,
+            'changed_at': previous.get('changed_at', now) if previous.get('version') == version else now,
+            'rows': len(frame),
+            'columns': columns,
+        }
+        stamp_file = self._file(table, database, '.json')
+        partial = stamp_file.with_name(f"{stamp_file.name}.{os.getpid()}.tmp")
+        with open(partial, 'w') as f:
+            json.dump(stamp, f, indent=2)
+        os.replace(partial, stamp_file)
+        return stamp
+
+    def table(self, table, database='PM', columns=None):
+        """
+        The table, or the columns of it named in any case, from today's
+        snapshot, taking one first if there is none yet.
+        """
+        import pandas as pd
+        import pyarrow.parquet as pq
+
+        if not self.fresh(table, database):
+            try:
+                self.refresh(table, database)
+            except Exception as e:
+                if self.stamp(table, database) is None:
+                    raise
+                print(f"[reference] WARNING: could not take a new snapshot of {table} ({e}); "
+                      f"using the one from {self.stamp(table, database)['refreshed_at']}")
+        stamp = self.stamp(table, database)
+        path = self._file(table, database, '.parquet')
+        if columns is not None:
+            # Column names as the caller spells them, as SQL would match them
+            stored = {name.lower(): name for name in pq.read_schema(path).names}
+            missing = [name for name in columns if name.lower() not in stored]
+            if missing:
+                raise KeyError(f"The {table} snapshot has no column {', '.join(missing)}"
+                               f"{' (see [columns] in reference_tables.ini)' if stamp.get('columns') else ''}")
+            frame = pd.read_parquet(path, columns=[stored[name.lower()] for name in columns])
+            frame.columns = list(columns)
+        else:
+            frame = pd.read_parquet(path)
+        print(f"[reference] {table}: version {stamp['version']} of {stamp['refreshed_at']}, {len(frame):,} rows")
+        return frame
+
+
+_SHARED = []
+
+
+def shared():
+    if not _SHARED:
+        _SHARED.append(ReferenceSnapshots.from_config())
+    return _SHARED[0]
+
+
+def table(name, database='PM', columns=None):
+    """ReferenceSnapshots.table() on the shared snapshots in MIND_reference."""
+    return shared().table(name, database, columns)
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+
+    # Run on its own from Task Scheduler, so the database settings are not in the environment yet
+    load_dotenv(dotenv_path='C:/MIND/MIND/MIND_config/MIND.env')
+    parser = argparse.ArgumentParser(usage="python MIND_reference.py [--force]")
+    parser.add_argument('--force', action='store_true', help="take new snapshots even of tables snapshotted today")
+    args = parser.parse_args()
+
+    if importlib.util.find_spec('pyarrow') is None:
+        print("Reference snapshots need pyarrow")
+        sys.exit(1)
+    config = configparser.ConfigParser()
+    config.optionxform = str
+    config.read(CONFIG_FILE)
+    snapshots = shared()
+    failed = False
+    for name, database in config.items('tables') if config.has_section('tables') else []:
+        if not args.force and snapshots.fresh(name, database):
+            print(f"[reference] {name}: taken today already")
+            continue
+        try:
+            stamp = snapshots.refresh(name, database)
+            print(f"[reference] {name}: version {stamp['version']}, {stamp['rows']:,} rows")
+        except Exception as e:
+            print(f"[reference] {name}: FAILED ({e})")
+            failed = True
+    sys.exit(1 if failed else 0)
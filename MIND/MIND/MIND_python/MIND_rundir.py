@@ -0,0 +1,185 @@
+import os
+import sys
+import time
+import shutil
+import logging
+from pathlib import Path
+
+
+def _link(target, link):
+    """Links link to target without copying it: a symlink, or on Windows a junction or hard link."""
+    try:
+        os.symlink(target, link, target_is_directory=target.is_dir())
+        return
+    except OSError:
+        # Symlinks need extra privileges on Windows; junctions and hard links do not
+        if sys.platform != 'win32':
+            raise
+    if target.is_dir():
+        import _winapi
+        _winapi.CreateJunction(str(target), str(link))
+    else:
+        os.link(target, link)
+
+
+def _is_link(path):
+    """True for symlinks and junctions alike."""
+    try:
+        os.readlink(path)
+        return True
+    except (OSError, ValueError):
+        return False
+
+
+def _unlink(link):
+    try:
+        os.unlink(link)
+    except OSError:
+        # Junctions are removed as directories
+        os.rmdir(link)
+
+
+def _move(source, destination):
+    """Moves source over destination, replacing a directory already there."""
+    if source.is_dir() and destination.is_dir():
+        shutil.rmtree(destination)
+    os.replace(source, destination)
+
+
+class RunDirectory:
+    """
+    A working directory of its own for one run of a report, so that two runs
+    of the same report (a backfill next to the nightly run, say) never share
+    temp_data.pkl or temp_params.json.
+
+    <runs_dir>/<run_id>/python/    the steps' working directory
+    <runs_dir>/<run_id>/<entry>    a link to every other entry of the report
+                                   (config/, history directories, .env, ...)
+
+    The step scripts themselves still run from the report's python/ directory.
+    When the run ends, whatever the steps left in the working directory, and
+    any directory they created next to it, is moved back into the report, so
+    the report looks as it did after a run before run directories existed.
+    """
+
+    # Run directories that could not be removed are cleared after this long
+    RETENTION_DAYS = 7
+
+    def __init__(self, base_dir, runs_dir, run_id):
+        self.base_dir = Path(base_dir)
+        self.path = Path(runs_dir) / run_id
+        self.python_dir = self.path / 'python'
+        self.linked = set()
+
+    def create(self, resume=False, resume_from=None, config=None):
+        """
+        Creates the run directory. With resume, the handoff files the last run
+        left in the report (or in the resume_from directory) are copied in, so
+        the run can start at a later step. With config, a ConfigParser, the run
+        gets its own copy of config/ with that config.ini instead of a link.
+        """
+        self.python_dir.mkdir(parents=True)
+        for entry in self.base_dir.iterdir():
+            if entry.name == 'python':
+                continue
+            if entry.name == 'config' and config is not None:
+                shutil.copytree(entry, self.path / 'config')
+                with open(self.path / 'config' / 'config.ini', 'w') as f:
+                    config.write(f)
+            else:
+                _link(entry, self.path / entry.name)
+            self.linked.add(entry.name)
+
+        if resume or resume_from:
+            for entry in Path(resume_from or self.base_dir / 'python').glob('temp_*'):
+                if entry.is_dir():
+                    shutil.copytree(entry, self.python_dir / entry.name)
+                else:
+                    shutil.copy2(entry, self.python_dir / entry.name)
+        return self
+
+    def publish(self):
+        """Moves what the run produced back into the report."""
+        for entry in list(self.python_dir.iterdir()):
+            self._publish(entry, self.base_dir / 'python' / entry.name)
+        for entry in list(self.path.iterdir()):
+            # self.linked also covers a private config/ copy, which stays with the run
+            if entry.name != 'python' and entry.name not in self.linked:
+                self._publish(entry, self.base_dir / entry.name)
+
+    @staticmethod
+    def _publish(source, destination):
+        try:
+            if source.is_dir() and destination.is_dir() and not source.name.startswith('temp_'):
+                # A directory another run created meanwhile, such as a history directory: keep both runs' files
+                shutil.copytree(source, destination, dirs_exist_ok=True)
+                shutil.rmtree(source)
+            else:
+                _move(source, destination)
+        except OSError as e:
+            logging.warning("Could not move %s back to %s: %s", source, destination, e)
+
+    def remove(self):
+        """Removes the run directory. Links are removed first so nothing is deleted through them."""
+        for entry in self.path.iterdir():
+            if _is_link(entry):
+                _unlink(entry)
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    @classmethod
+    def prune(cls, base_dir, runs_dir):
+        """Removes run directories left behind by runs that started more than RETENTION_DAYS ago."""
+        runs_dir = Path(runs_dir)
+        if not runs_dir.exists():
+            return
+        cutoff = time.time() - cls.RETENTION_DAYS * 86400
+        for path in runs_dir.iterdir():
+            if path.is_dir() and path.stat().st_mtime < cutoff:
+                cls(base_dir, runs_dir, path.name).remove()
+
+
+class StepDirectory:
+    """
+    A working directory of its own for one step of a step graph, so that
+    steps running side by side never share temp_data.pkl, its placeholder or
+    temp_params.json.
+
+    <work_dir>_<step>/                 the step's working directory, next to
+                                       work_dir so that ../config still works
+    <work_dir>_<step>/temp_params.json a copy of the run's saved parameters
+    <work_dir>_<step>/<entry>          a link to every other entry of work_dir
+
+    When the step has finished, publish() moves the files it created back into
+    work_dir; its handoff and parameters are left for the runner to merge.
+    """
+
+    # What publish() leaves behind: the step's own handoff, parameters and stats
+    PRIVATE = ('temp_data', 'temp_params.json')
+
+    def __init__(self, work_dir, step):
+        self.work_dir = Path(work_dir)
+        self.path = self.work_dir.parent / f"{self.work_dir.name}_{step:02d}"
+
+    def create(self):
+        self.path.mkdir()
+        for entry in self.work_dir.iterdir():
+            if entry.name == 'temp_params.json':
+                shutil.copy2(entry, self.path / entry.name)
+            elif not entry.name.startswith(self.PRIVATE):
+                _link(entry, self.path / entry.name)
+        return self
+
+    def publish(self):
+        """Moves the files the step created back into work_dir."""
+        for entry in list(self.path.iterdir()):
+            if not _is_link(entry) and not entry.name.startswith(self.PRIVATE):
+                RunDirectory._publish(entry, self.work_dir / entry.name)
+
+    def remove(self):
+        """Removes the step directory, links first so nothing is deleted through them."""
+        if not self.path.exists():
+            return
+        for entry in self.path.iterdir():
+            if _is_link(entry):
+                _unlink(entry)
+        shutil.rmtree(self.path, ignore_errors=True)
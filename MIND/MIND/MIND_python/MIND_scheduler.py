@@ -0,0 +1,239 @@
+"""
+Runs reports on the schedules declared in their config.ini.
+
+    python MIND_scheduler.py [reports_dir] [--once] [--max-reports 4] [--max-db-connections 4]
+
+A report is scheduled by a [MIND_schedule] section:
+
+    [MIND_schedule]
+    rule = semi-monthly monday
+    time = 06:00
+
+with one of these rules:
+
+    daily
+    weekly <weekday>             e.g. weekly monday
+    semi-monthly monday          the Monday after the 15th and the Monday after month end
+    monthly <day>                e.g. monthly 1
+    quarterly <day>              that day of January, April, July and October
+    measurement-year <MM-DD>     once a year, e.g. measurement-year 01-15
+
+The scheduler checks every minute. Reports that are due at the same check
+start together as one `MIND.py --batch` process, which the scheduler does not
+wait for. They share no warm runtime: the batch runs each report as its own
+fresh `MIND.py` process, which imports its libraries and opens its database
+connections itself, and query results are shared (MIND_querycache) only
+between reports that turn the query cache on with query_cache = true. What
+the batch adds is its limits on the reports and database connections in use
+at once.
+
+The batch's output goes to MIND_logs/scheduler/batch_<timestamp>.txt, and a
+later check logs its exit status. A report whose batch is still running when
+it is due again waits for a check after the batch has finished. A run missed
+while the scheduler was down is made up once when it comes back, if it was
+missed within the last catch_up_days (7 by default, set in [MIND_schedule]).
+Without --once it keeps running; with --once it checks a single time and
+exits, for use from Task Scheduler, leaving the batch it started running.
+Such a batch's exit status is then only in its own log in MIND_logs/batch,
+and it is not known to be running at the next check.
+"""
+import sys
+import json
+import time
+import logging
+import argparse
+import datetime
+import subprocess
+import configparser
+from pathlib import Path
+
+MIND_PYTHON_DIR = Path(__file__).resolve().parent
+
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+
+def monday_after(day):
+    """The first Monday strictly after day."""
+    return day + datetime.timedelta(days=(7 - day.weekday()) % 7 or 7)
+
+
+def fires_on(rule, day):
+    """True when the rule schedules a run on day (a datetime.date)."""
+    words = rule.lower().split()
+    kind, arguments = words[0], words[1:]
+
+    if kind == 'daily':
+        return True
+    if kind == 'weekly':
+        return day.weekday() == WEEKDAYS.index(arguments[0])
+    if kind == 'semi-monthly':
+        # The rule productivity_report/bin/check_if_correct_monday.py used to apply
+        month_end = day.replace(day=1) - datetime.timedelta(days=1)
+        return day in (monday_after(month_end), monday_after(day.replace(day=15)))
+    if kind == 'monthly':
+        return day.day == int(arguments[0])
+    if kind == 'quarterly':
+        return day.month in (1, 4, 7, 10) and day.day == int(arguments[0])
+    if kind == 'measurement-year':
+        month, day_of_month = (int(part) for part in arguments[0].split('-'))
+        return (day.month, day.day) == (month, day_of_month)
+    raise ValueError(f"Unknown schedule rule '{rule}'")
+
+
+class Schedule:
+    """The [MIND_schedule] section of one report's config.ini."""
+
+    def __init__(self, report_dir, rule, at, catch_up_days=7):
+        self.report_dir = Path(report_dir)
+        self.rule = rule
+        self.at = at
+        self.catch_up_days = catch_up_days
+        # Fail on a bad rule when the schedule is read rather than when it is first due
+        fires_on(rule, datetime.date.today())
+
+    @classmethod
+    def from_report(cls, report_dir):
+        config = configparser.ConfigParser()
+        config.read(Path(report_dir) / 'config' / 'config.ini')
+        if not config.has_section('MIND_schedule'):
+            return None
+        at = datetime.datetime.strptime(config.get('MIND_schedule', 'time', fallback='06:00'), '%H:%M').time()
+        return cls(report_dir, config.get('MIND_schedule', 'rule'), at,
+                   catch_up_days=config.getint('MIND_schedule', 'catch_up_days', fallback=7))
+
+    def last_due(self, now):
+        """The latest scheduled run at or before now, within catch_up_days, or None."""
+        for days_back in range(self.catch_up_days + 1):
+            day = now.date() - datetime.timedelta(days=days_back)
+            due = datetime.datetime.combine(day, self.at)
+            if due <= now and fires_on(self.rule, day):
+                return due
+        return None
+
+
+def load_schedules(reports_dir):
+    schedules = []
+    for report_dir in sorted(Path(reports_dir).iterdir()):
+        if not (report_dir / 'config' / 'config.ini').exists():
+            continue
+        try:
+            schedule = Schedule.from_report(report_dir)
+        except (ValueError, IndexError, configparser.Error) as e:
+            logging.error("Ignoring the schedule of %s: %s", report_dir.name, e)
+            continue
+        if schedule is not None:
+            schedules.append(schedule)
+    return schedules
+
+
+def read_state(state_file):
+    if not state_file.exists():
+        return {}
+    with open(state_file, 'r') as f:
+        return json.load(f)
+
+
+def write_state(state_file, state):
+    with open(state_file, 'w') as f:
+        json.dump(state, f, indent=2)
+
+
+# Batches this scheduler started that have not been seen to finish: (names, process, output file)
+RUNNING = []
+
+
+def reap():
+    """Logs the exit of every batch that has finished. Returns the names of the reports still running."""
+    running = set()
+    for batch in list(RUNNING):
+        names, process, output = batch
+        status = process.poll()
+        if status is None:
+            running.update(names)
+            continue
+        output.close()
+        RUNNING.remove(batch)
+        log = logging.info if status == 0 else logging.error
+        log("Batch of %s exited with status %s, output in %s", names, status, output.name)
+    return running
+
+
+def check(reports_dir, state_file, max_reports, max_db_connections):
+    """Starts every report that has become due since it last ran, without waiting for them. Returns the reports started."""
+    now = datetime.datetime.now()
+    state = read_state(state_file)
+    running = reap()
+    due = []
+    for schedule in load_schedules(reports_dir):
+        name = schedule.report_dir.name
+        last_due = schedule.last_due(now)
+        if name not in state:
+            # A newly scheduled report starts from now rather than making up old runs
+            state[name] = {'last_due': (last_due or now).isoformat(timespec='minutes')}
+            continue
+        if last_due is not None and last_due > datetime.datetime.fromisoformat(state[name]['last_due']):
+            if name in running:
+                # Left due, so it starts at a check after its batch has finished
+                logging.info("%s is due but its last batch is still running", name)
+                continue
+            due.append(schedule)
+            state[name] = {'last_due': last_due.isoformat(timespec='minutes'), 'started': now.isoformat(timespec='seconds')}
+
+    # Recorded before the run, so a report that fails is not started again every minute
+    write_state(state_file, state)
+
+    if due:
+        names = [schedule.report_dir.name for schedule in due]
+        output = open(state_file.parent / f"batch_{now.strftime('%Y%m%d_%H%M%S')}.txt", 'w')
+        try:
+            process = subprocess.Popen(
+                ['python', str(MIND_PYTHON_DIR / 'MIND.py'), '--batch'] + [str(schedule.report_dir) for schedule in due]
+                + ['--max-reports', str(max_reports), '--max-db-connections', str(max_db_connections)],
+                stdout=output,
+                stderr=subprocess.STDOUT,
+                text=True
+            )
+        except OSError:
+            output.close()
+            raise
+        RUNNING.append((names, process, output))
+        logging.info("Started %s as process %s, output in %s", names, process.pid, output.name)
+    return due
+
+
+def main(reports_dir, once=False, max_reports=4, max_db_connections=4):
+    reports_dir = Path(reports_dir).resolve()
+    log_dir = reports_dir.parent / 'MIND_logs' / 'scheduler'
+    log_dir.mkdir(parents=True, exist_ok=True)
+    logging.basicConfig(
+        filename=log_dir / 'scheduler.txt',
+        level=logging.INFO,
+        format='%(asctime)s %(levelname)s:%(message)s'
+    )
+    state_file = log_dir / 'scheduler_state.json'
+    logging.info("Scheduler started for %s", reports_dir)
+
+    while True:
+        try:
+            check(reports_dir, state_file, max_reports, max_db_connections)
+        except Exception:
+            logging.exception("Scheduler check failed")
+        if once:
+            break
+        # Wake up at the start of the next minute
+        time.sleep(60 - datetime.datetime.now().second)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(usage="python MIND_scheduler.py [reports_dir] [--once] [--max-reports 4] [--max-db-connections 4]")
+    parser.add_argument('reports_dir', nargs='?', default=str(MIND_PYTHON_DIR.parents[1] / 'MIND_reports'))
+    parser.add_argument('--once', action='store_true', help="check once and exit")
+    parser.add_argument('--max-reports', type=int, default=4)
+    parser.add_argument('--max-db-connections', type=int, default=4)
+    args = parser.parse_args()
+
+    if not Path(args.reports_dir).is_dir():
+        print("Usage: python MIND_scheduler.py [reports_dir] [--once] [--max-reports 4] [--max-db-connections 4]")
+        sys.exit(1)
+
+    main(args.reports_dir, once=args.once, max_reports=args.max_reports, max_db_connections=args.max_db_connections)
@@ -0,0 +1,91 @@
+"""
+Launches one MIND step script in a fresh interpreter.
+
+    python MIND_step.py <script> <data_file> <param_file>
+
+The script runs exactly as `python <script> <data_file> <param_file>` would,
+except that its temp_data.pkl reads and writes go to the handoff named by the
+MIND_HANDOFF environment variable (see MIND_handoff.open_handoff), kept at
+MIND_HANDOFF_FILE when that is set. When MIND_STEP_STATS names a file, the
+step's CPU time, peak RSS and handoff bytes are written there as it exits.
+When MIND_PROFILE is set, the step is profiled into <MIND_PROFILE>.pstats and
+<MIND_PROFILE>.folded (see MIND_profile.profiled), and when MIND_TRACE_MEMORY
+is set its memory is traced into <MIND_TRACE_MEMORY>.txt (see MIND_memory).
+The step's queries, emails and SFTP uploads are counted for the stats file
+too (see MIND_metrics).
+
+    python MIND_step.py --warm
+
+starts a warm worker instead: it imports the libraries the steps use, then
+waits for one job on stdin, a JSON object {"args": [script, data_file,
+param_file], "cwd": ..., "env": {...}}, runs it as above and exits. See
+MIND_workers.WarmPool.
+"""
+import os
+import sys
+import json
+import time
+import runpy
+import importlib
+from pathlib import Path
+from contextlib import ExitStack
+
+import MIND_handoff
+import MIND_telemetry
+import MIND_profile
+import MIND_memory
+import MIND_metrics
+
+# Imported by warm workers before they are given a step
+WARM_IMPORTS = ['pandas', 'numpy', 'pyodbc', 'openpyxl', 'PIL.Image', 'dotenv', 'email.mime.multipart', 'smtplib']
+
+
+def run_step(script_path, data_file, param_file, handoff_kind, handoff_file=None):
+    script_path = Path(script_path)
+    sys.argv = [str(script_path), str(data_file), str(param_file)]
+    # Behave like `python <script>`: the script's own directory comes first on sys.path
+    sys.path.insert(0, str(script_path.parent))
+
+    handoff = MIND_handoff.open_handoff(handoff_kind, handoff_file or data_file)
+    with MIND_handoff.redirect(data_file, handoff):
+        runpy.run_path(str(script_path), run_name='__main__')
+
+
+def warm_up():
+    """Imports WARM_IMPORTS, skipping any that are not installed, and waits for a job."""
+    for module in WARM_IMPORTS:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+
+    job = json.loads(sys.stdin.readline())
+    os.chdir(job['cwd'])
+    os.environ.update(job['env'])
+    return job['args']
+
+
+if __name__ == "__main__":
+    MIND_metrics.instrument()
+    if sys.argv[1:] == ['--warm']:
+        args = warm_up()
+    elif len(sys.argv) == 4:
+        args = sys.argv[1:]
+    else:
+        print("Usage: python MIND_step.py <script> <data_file> <param_file>")
+        sys.exit(1)
+
+    # A warm worker's imports happened before it was given the step
+    cpu_started = time.process_time()
+    try:
+        with ExitStack() as diagnosing:
+            if os.getenv('MIND_TRACE_MEMORY'):
+                diagnosing.enter_context(MIND_memory.traced(os.getenv('MIND_TRACE_MEMORY'),
+                                                            float(os.getenv('MIND_TRACE_MEMORY_INTERVAL', '0'))))
+            if os.getenv('MIND_PROFILE'):
+                diagnosing.enter_context(MIND_profile.profiled(os.getenv('MIND_PROFILE')))
+            run_step(args[0], args[1], args[2], os.getenv('MIND_HANDOFF', 'pickle'), os.getenv('MIND_HANDOFF_FILE'))
+    finally:
+        if os.getenv('MIND_STEP_STATS'):
+            MIND_telemetry.write_step_stats(os.getenv('MIND_STEP_STATS'), time.process_time() - cpu_started, MIND_handoff.IO_BYTES,
+                                           MIND_metrics.COUNTERS)
@@ -0,0 +1,102 @@
+import os
+import sys
+import json
+import datetime
+import threading
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process so far, or None where it cannot be read."""
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [
+                ('cb', wintypes.DWORD),
+                ('PageFaultCount', wintypes.DWORD),
+                ('PeakWorkingSetSize', ctypes.c_size_t),
+                ('WorkingSetSize', ctypes.c_size_t),
+                ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                ('PagefileUsage', ctypes.c_size_t),
+                ('PeakPagefileUsage', ctypes.c_size_t),
+            ]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return None
+        return counters.PeakWorkingSetSize
+
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def write_step_stats(path, cpu_seconds, handoff_io, calls=None):
+    """Written by MIND_step.py as the step exits, for the parent to add to the run manifest."""
+    with open(path, 'w') as f:
+        json.dump({
+            'cpu_seconds': cpu_seconds,
+            'peak_rss_bytes': peak_rss_bytes(),
+            'handoff_bytes_read': handoff_io['read'],
+            'handoff_bytes_written': handoff_io['written'],
+            'calls': calls,
+        }, f)
+
+
+def read_step_stats(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        stats = json.load(f)
+    os.remove(path)
+    return stats
+
+
+class RunManifest:
+    """
+    Machine-readable record of one run, written next to the run's log as
+    manifest_<timestamp>.json. Each step entry holds its wall and CPU time,
+    peak RSS, handoff bytes read and written, its queries, emails and SFTP
+    uploads (see MIND_metrics), the shape of every DataFrame in its output and
+    its exit status.
+
+    In-process steps share MIND.py's process, so their peak RSS is the
+    process peak at the end of the step rather than the step's own.
+    """
+
+    def __init__(self, path, report, log_file, settings):
+        self.path = path
+        self.lock = threading.Lock()
+        self.run = {
+            'report': report,
+            'log_file': str(log_file),
+            'started': datetime.datetime.now().isoformat(timespec='seconds'),
+            'finished': None,
+            'status': 'running',
+            'settings': settings,
+            'steps': [],
+        }
+
+    def add_step(self, **record):
+        with self.lock:
+            self.run['steps'].append(record)
+            self.write()
+
+    def finish(self, status):
+        self.run['finished'] = datetime.datetime.now().isoformat(timespec='seconds')
+        self.run['status'] = status
+        self.write()
+
+    def write(self):
+        with open(self.path, 'w') as f:
+            json.dump(self.run, f, indent=2, default=str)
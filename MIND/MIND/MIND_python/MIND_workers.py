@@ -0,0 +1,82 @@
+import json
+import logging
+import threading
+import subprocess
+from pathlib import Path
+
+MIND_STEP = Path(__file__).resolve().parent / 'MIND_step.py'
+
+
+class WarmPool:
+    """
+    Keeps `size` step processes started ahead of time, with pandas, pyodbc,
+    openpyxl and the other libraries in MIND_step.WARM_IMPORTS already
+    imported, so a step does not wait for them.
+
+    Every step still gets a process of its own that exits when the step does;
+    a worker is never reused, so a crash or leftover state stays with its
+    step. Handing a worker a step starts its replacement, which warms up
+    while the step runs.
+    """
+
+    def __init__(self, size, env):
+        self.size = size
+        self.env = env
+        self.lock = threading.Lock()
+        self.spares = []
+        self.closed = False
+        for _ in range(size):
+            self._add_spare()
+
+    def _spawn(self):
+        return subprocess.Popen(
+            ['python', str(MIND_STEP), '--warm'],
+            cwd=MIND_STEP.parent,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            errors='replace',
+            env=self.env
+        )
+
+    def _add_spare(self):
+        worker = self._spawn()
+        with self.lock:
+            if self.closed:
+                worker.kill()
+                worker.wait()
+                return
+            self.spares.append(worker)
+
+    def _take(self):
+        with self.lock:
+            while self.spares:
+                worker = self.spares.pop(0)
+                if worker.poll() is None:
+                    return worker
+                logging.warning("Warm worker %s exited before it was used (status %s)", worker.pid, worker.returncode)
+        logging.info("No warm worker ready; starting one for this step")
+        return self._spawn()
+
+    def start(self, args, cwd, env):
+        """
+        Starts `python MIND_step.py <args>` in a warm worker with the given
+        working directory and environment variables. Returns the worker's
+        Popen, whose stdout and stderr are text pipes.
+        """
+        worker = self._take()
+        threading.Thread(target=self._add_spare, daemon=True).start()
+
+        job = {'args': [str(arg) for arg in args], 'cwd': str(cwd), 'env': env}
+        worker.stdin.write(json.dumps(job) + '\n')
+        worker.stdin.close()
+        return worker
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            spares, self.spares = self.spares, []
+        for worker in spares:
+            worker.kill()
+            worker.wait()
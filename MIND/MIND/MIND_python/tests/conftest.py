@@ -0,0 +1,187 @@
+r"""
+Fixtures for the MIND runner's tests.
+
+    cd MIND\MIND\MIND_python
+    python -m pytest tests
+
+The tests need pytest and python-dotenv; those touching DataFrames also need
+pandas and pyarrow and are skipped without them. Queries run against SQLite
+through the fake pyodbc of the database fixture, so no ODBC driver or
+Avatar server is needed.
+"""
+import os
+import sys
+import types
+import decimal
+import datetime
+import sqlite3
+import logging
+import textwrap
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+@pytest.fixture
+def mind(monkeypatch):
+    """The MIND runner module, with alert emails off and what main() sets up undone afterwards."""
+    pytest.importorskip('dotenv')
+    import MIND
+    import MIND_metrics
+
+    monkeypatch.setattr(MIND, 'SEND_ALERTS', False)
+    environ = dict(os.environ)
+    yield MIND
+    if MIND.LOG_HANDLER is not None:
+        logging.getLogger().removeHandler(MIND.LOG_HANDLER)
+        MIND.LOG_HANDLER.close()
+        MIND.LOG_HANDLER = None
+    os.environ.clear()
+    os.environ.update(environ)
+    MIND_metrics.uninstrument()
+
+
+@pytest.fixture
+def report(tmp_path):
+    """
+    A report laid out as under MIND_reports, with a function that adds a step
+    script: report.step(3, source) writes python/report_03.py.
+    """
+    base = tmp_path / 'MIND_reports' / 'report'
+    (base / 'python').mkdir(parents=True)
+    (base / 'config').mkdir()
+    (base / 'config' / 'config.ini').write_text('[report]\n')
+
+    class Report:
+        path = base
+        python_dir = base / 'python'
+        log_file = tmp_path / 'log.txt'
+
+        @staticmethod
+        def step(number, source):
+            script = base / 'python' / f'report_{number:02d}.py'
+            script.write_text(textwrap.dedent(source))
+            return script
+
+    return Report
+
+
+def fake_pyodbc(database_file):
+    """
+    A stand-in for pyodbc whose connections are in-memory SQLite databases
+    with database_file attached as SYSTEM, so SYSTEM.<table> reads its tables.
+    Columns declared DECIMAL, BOOLEAN or TIMESTAMP come back as Decimal, bool
+    and datetime, as from Avatar. module.connects counts connection attempts;
+    set module.fail_connects to make that many fail as a timeout would.
+    """
+    module = types.ModuleType('pyodbc')
+    sqlite3.register_converter('DECIMAL', lambda value: decimal.Decimal(value.decode()))
+    sqlite3.register_converter('BOOLEAN', lambda value: value not in (b'0', b''))
+    sqlite3.register_converter('TIMESTAMP', lambda value: datetime.datetime.fromisoformat(value.decode()))
+
+    class Error(Exception):
+        pass
+
+    class OperationalError(Error):
+        pass
+
+    class InterfaceError(Error):
+        pass
+
+    class Cursor:
+        def __init__(self, cursor):
+            self._cursor = cursor
+
+        def __getattr__(self, name):
+            return getattr(self._cursor, name)
+
+        def execute(self, sql, *params):
+            try:
+                self._cursor.execute(sql, *params)
+            except sqlite3.Error as e:
+                raise Error(str(e)) from e
+            return self
+
+        def executemany(self, sql, rows):
+            try:
+                self._cursor.executemany(sql, rows)
+            except sqlite3.Error as e:
+                raise Error(str(e)) from e
+            return self
+
+    class Connection:
+        def __init__(self):
+            self._connection = sqlite3.connect(':memory:', check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES)
+            self._connection.execute("ATTACH ? AS SYSTEM", (str(database_file),))
+
+        def cursor(self):
+            return Cursor(self._connection.cursor())
+
+        def commit(self):
+            self._connection.commit()
+
+        def rollback(self):
+            self._connection.rollback()
+
+        def close(self):
+            self._connection.close()
+
+    def connect(connection_string, timeout=None, **options):
+        module.connects += 1
+        if module.fail_connects:
+            module.fail_connects -= 1
+            raise OperationalError('timeout expired')
+        return Connection()
+
+    module.Error, module.OperationalError, module.InterfaceError = Error, OperationalError, InterfaceError
+    module.connect = connect
+    module.connects = 0
+    module.fail_connects = 0
+    return module
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """
+    MIND_db on a SQLite database standing in for both Avatar databases (CWS and
+    PM). database.execute(sql, params) changes its SYSTEM tables directly,
+    running executemany when params is a list;
+    database.pyodbc is the fake pyodbc (see fake_pyodbc).
+    """
+    pytest.importorskip('pandas')
+    database_file = tmp_path / 'system.sqlite'
+    sqlite3.connect(database_file).close()
+    module = fake_pyodbc(database_file)
+    monkeypatch.setitem(sys.modules, 'pyodbc', module)
+    import MIND_db
+    import MIND_querycache
+
+    monkeypatch.setattr(MIND_db, 'pyodbc', module)
+    monkeypatch.setattr(MIND_db, '_POOLS', {})
+    monkeypatch.setattr(MIND_db, 'BACKOFF_SECONDS', 0)
+    monkeypatch.setattr(MIND_db, '_NO_KEY_TABLE', set())
+    monkeypatch.setattr(MIND_querycache, '_SHARED', [])
+    for name, value in {'database_driver_name': 'SQLite', 'database_server': 'localhost', 'database_port': '1972',
+                        'databaseCWS': 'AVCWS', 'databasePM': 'AVPM', 'database_username': 'user',
+                        'database_password': 'secret'}.items():
+        monkeypatch.setenv(name, value)
+
+    class Database:
+        path = database_file
+        pyodbc = module
+
+        @staticmethod
+        def execute(sql, params=()):
+            connection = sqlite3.connect(':memory:')
+            connection.execute("ATTACH ? AS SYSTEM", (str(database_file),))
+            with connection:
+                if isinstance(params, list):
+                    connection.executemany(sql, params)
+                else:
+                    connection.execute(sql, params)
+            connection.close()
+
+    yield Database
+    MIND_db.close_all()
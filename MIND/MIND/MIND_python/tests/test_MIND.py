@@ -0,0 +1,153 @@
+import os
+import json
+import pickle
+
+import pytest
+
+
+# Step 01 deletes its temp_data.pkl and waits while step 02, running beside it, reads its own
+DELETES_ITS_PAYLOAD = """
+    import os, sys, time, json, pickle
+    os.remove('temp_data.pkl')
+    with open('../deleted', 'w') as f:
+        f.write('01')
+    deadline = time.time() + 30
+    while not os.path.exists('../read') and time.time() < deadline:
+        time.sleep(0.05)
+    with open(sys.argv[2]) as f:
+        params = json.load(f)
+    params['saved_by_01'] = 'yes'
+    with open(sys.argv[2], 'w') as f:
+        json.dump(params, f)
+    with open('side_file_01.txt', 'w') as f:
+        f.write('01')
+    with open('temp_data.pkl', 'wb') as f:
+        pickle.dump({'first': 1}, f)
+"""
+
+WAITS_FOR_THE_DELETE = """
+    import os, time, pickle
+    deadline = time.time() + 30
+    while not os.path.exists('../deleted') and time.time() < deadline:
+        time.sleep(0.05)
+    present = os.path.exists('temp_data.pkl')
+    with open('temp_data.pkl', 'rb') as f:
+        pickle.load(f)
+    with open('../read', 'w') as f:
+        f.write('02')
+    with open('temp_data.pkl', 'wb') as f:
+        pickle.dump({'second': present}, f)
+"""
+
+MERGES = """
+    import pickle
+    with open('temp_data.pkl', 'rb') as f:
+        data = pickle.load(f)
+    data['merged'] = True
+    with open('temp_data.pkl', 'wb') as f:
+        pickle.dump(data, f)
+"""
+
+
+def test_parallel_steps_keep_their_own_temp_data(mind, report):
+    scripts = [report.step(1, DELETES_ITS_PAYLOAD), report.step(2, WAITS_FOR_THE_DELETE), report.step(3, MERGES)]
+
+    final = mind.run_scripts_as_dag(scripts, {1: [], 2: [], 3: [1, 2]}, {'setting': 'x'}, report.log_file,
+                                    max_workers=2, work_dir=report.python_dir)
+
+    assert final == {'first': 1, 'second': True, 'merged': True}
+    with open(report.python_dir / 'temp_data.pkl', 'rb') as f:
+        assert pickle.load(f) == final
+    with open(report.python_dir / 'temp_params.json') as f:
+        assert json.load(f) == {'setting': 'x', 'saved_by_01': 'yes'}
+    assert (report.python_dir / 'side_file_01.txt').read_text() == '01'
+    assert not list(report.path.glob('python_*'))
+
+
+def test_failed_step_graph_exits_and_cleans_up(mind, report):
+    scripts = [report.step(1, "raise SystemExit(3)\n"), report.step(2, MERGES)]
+
+    with pytest.raises(SystemExit):
+        mind.run_scripts_as_dag(scripts, {1: [], 2: [1]}, {}, report.log_file, work_dir=report.python_dir)
+
+    assert not list(report.path.glob('python_*'))
+
+
+SAVES_A_PAYLOAD = """
+    import sys, json, pickle
+    with open(sys.argv[2]) as f:
+        params = json.load(f)
+    params['saved'] = params['setting']
+    with open(sys.argv[2], 'w') as f:
+        json.dump(params, f)
+    with open('temp_data.pkl', 'wb') as f:
+        pickle.dump({'setting': params['setting']}, f)
+"""
+
+
+def test_run_leaves_no_trace(mind, report):
+    import logging
+    import smtplib
+    import MIND_metrics
+
+    report.step(0, SAVES_A_PAYLOAD)
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    environ = dict(os.environ)
+    sendmail = smtplib.SMTP.sendmail
+
+    assert mind.run(report.path, {'setting': 'x'}) == {'setting': 'x'}
+
+    assert sorted(path.name for path in report.python_dir.iterdir()) == ['report_00.py']
+    assert root.handlers == handlers and root.level == level
+    assert dict(os.environ) == environ
+    assert smtplib.SMTP.sendmail is sendmail
+    assert not MIND_metrics.instrumented()
+    assert list((report.path.parents[1] / 'MIND_logs' / 'report').glob('log_*.txt'))
+
+
+def test_run_raises_step_failed(mind, report):
+    report.step(0, "raise SystemExit(2)\n")
+    environ = dict(os.environ)
+
+    with pytest.raises(mind.StepFailed):
+        mind.run(report.path)
+
+    assert dict(os.environ) == environ
+    assert sorted(path.name for path in report.python_dir.iterdir()) == ['report_00.py']
+
+
+COUNTS = """
+    import pickle
+    try:
+        with open('temp_data.pkl', 'rb') as f:
+            data = pickle.load(f)
+    except FileNotFoundError:
+        data = None
+    data = {'count': (data or {'count': 0})['count'] + 1}
+    with open('temp_data.pkl', 'wb') as f:
+        pickle.dump(data, f)
+"""
+
+
+@pytest.mark.parametrize('in_process', [False, True])
+def test_resumed_run_starts_from_the_last_payload(mind, report, in_process):
+    report.step(0, COUNTS)
+    report.step(1, COUNTS)
+    mind.main(report.path, in_process=in_process)
+    with open(report.python_dir / 'temp_data.pkl', 'rb') as f:
+        assert pickle.load(f) == {'count': 2}
+
+    assert mind.main(report.path, start_step=1, in_process=in_process) == {'count': 3}
+    with open(report.python_dir / 'temp_data.pkl', 'rb') as f:
+        assert pickle.load(f) == {'count': 3}
+
+
+def test_resumed_step_graph_starts_from_the_last_payload(mind, report):
+    report.step(0, COUNTS)
+    report.step(1, COUNTS)
+    report.step(2, COUNTS)
+    (report.path / 'config' / 'config.ini').write_text('[report]\n\n[MIND_steps]\n01 = 00\n02 = 00\n')
+    mind.main(report.path, end_step=0)
+
+    assert mind.main(report.path, start_step=1) == {'count': 2}
@@ -0,0 +1,81 @@
+import os
+import json
+import time
+
+from MIND_cache import StepCache
+
+
+def cache_entry(cache, tmp_path, key, step, data, params):
+    param_file = tmp_path / f'params_{key}.json'
+    param_file.write_text(json.dumps(params))
+    cache.put(key, step, data, param_file)
+    cache.record(step, key)
+
+
+def test_runs_keep_journals_of_their_own(tmp_path):
+    first = StepCache(tmp_path / 'cache', run_id='first')
+    second = StepCache(tmp_path / 'cache', run_id='second')
+
+    cache_entry(first, tmp_path, 'a1', 1, {'from': 'first'}, {'step': 1})
+    cache_entry(second, tmp_path, 'b2', 2, {'from': 'second'}, {'step': 2})
+    cache_entry(first, tmp_path, 'a3', 3, {'from': 'first'}, {'step': 3})
+
+    assert json.loads((tmp_path / 'cache' / 'journal' / 'first.json').read_text()) == {'1': 'a1', '3': 'a3'}
+    assert json.loads((tmp_path / 'cache' / 'journal' / 'second.json').read_text()) == {'2': 'b2'}
+
+    param_file = tmp_path / 'temp_params.json'
+    assert first.resume_point(3, param_file)[0] == {'from': 'second'}
+    assert json.loads(param_file.read_text()) == {'step': 2}
+    assert first.resume_point(1, param_file) is None
+
+
+def test_newest_output_of_a_step_wins(tmp_path):
+    older = StepCache(tmp_path / 'cache', run_id='older')
+    cache_entry(older, tmp_path, 'old', 1, 'old', {})
+    os.utime(tmp_path / 'cache' / 'journal' / 'older.json', (time.time() - 60, time.time() - 60))
+    newer = StepCache(tmp_path / 'cache', run_id='newer')
+    cache_entry(newer, tmp_path, 'new', 1, 'new', {})
+
+    assert StepCache(tmp_path / 'cache').resume_point(2, tmp_path / 'temp_params.json')[0] == 'new'
+
+
+def test_evict_removes_expired_journals(tmp_path):
+    cache = StepCache(tmp_path / 'cache', run_id='run', max_age_hours=0)
+    cache_entry(cache, tmp_path, 'key', 1, 'data', {})
+
+    cache.evict()
+
+    assert not list((tmp_path / 'cache' / 'journal').glob('*.json'))
+    assert not (tmp_path / 'cache' / 'key').exists()
+
+
+COUNTS_ITS_RUNS = """
+    import pickle
+    with open('../runs.txt', 'a') as f:
+        f.write('ran\\n')
+    with open('temp_data.pkl', 'wb') as f:
+        pickle.dump({'loaded': True}, f)
+"""
+
+ADDS_A_KEY = """
+    import pickle
+    with open('temp_data.pkl', 'rb') as f:
+        data = pickle.load(f)
+    data['added'] = True
+    with open('temp_data.pkl', 'wb') as f:
+        pickle.dump(data, f)
+"""
+
+
+def test_cached_step_is_skipped_and_resumed_from(mind, report):
+    report.step(0, COUNTS_ITS_RUNS)
+    report.step(1, ADDS_A_KEY)
+    (report.path / 'config' / 'config.ini').write_text('[report]\n\n[MIND]\ncache_steps = 00\n')
+
+    assert mind.main(report.path) == {'loaded': True, 'added': True}
+    assert mind.main(report.path) == {'loaded': True, 'added': True}
+    assert (report.path / 'runs.txt').read_text() == 'ran\n'
+
+    # Without the report's temp_data.pkl the restart can only come from the cache
+    (report.python_dir / 'temp_data.pkl').unlink()
+    assert mind.main(report.path, start_step=1) == {'loaded': True, 'added': True}
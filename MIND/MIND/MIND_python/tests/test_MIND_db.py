@@ -0,0 +1,156 @@
+import datetime
+
+import pytest
+
+ROWS = [
+    # id, amount, flag, seen, name
+    (1, '1.50', 1, '2024-01-01 08:00:00', 'a'),
+    (2, '2.25', 0, '2024-01-02 09:30:00', 'b'),
+    (None, '3.00', 1, '2024-01-03 10:00:00', None),
+    (4, None, None, None, None),
+    (5, '5.75', 0, '2024-01-05 12:00:00', 'e'),
+]
+
+
+@pytest.fixture
+def episodes(database):
+    database.execute("CREATE TABLE SYSTEM.episodes (id INTEGER, amount DECIMAL, flag BOOLEAN, seen TIMESTAMP, name TEXT)")
+    database.execute("INSERT INTO SYSTEM.episodes VALUES (?, ?, ?, ?, ?)", ROWS)
+    return "SELECT id, amount, flag, seen, name FROM SYSTEM.episodes ORDER BY rowid"
+
+
+@pytest.mark.parametrize('chunk_rows', [1, 2, 3, 50000])
+def test_read_chunked_matches_read_sql(database, episodes, chunk_rows):
+    import pandas as pd
+    import MIND_db
+
+    whole = MIND_db.read_sql(episodes, cache=False)
+    chunked = MIND_db.read_chunked(episodes, chunk_rows=chunk_rows)
+
+    pd.testing.assert_frame_equal(chunked, whole)
+
+
+def test_each_chunk_has_the_dtypes_read_sql_gives_its_rows(database, episodes):
+    import pandas as pd
+    import MIND_db
+
+    # read_chunks holds its connection until the last chunk, so read them all first
+    for number, chunk in enumerate(list(MIND_db.read_chunks(episodes, chunk_rows=2))):
+        rows = MIND_db.read_sql(f"{episodes} LIMIT 2 OFFSET {number * 2}", cache=False)
+        pd.testing.assert_frame_equal(chunk, rows)
+
+
+def test_read_chunked_keeps_what_each_returns(database, episodes):
+    import MIND_db
+
+    seen = []
+    frame = MIND_db.read_chunked(episodes, each=lambda chunk: chunk[chunk['id'] > 1], chunk_rows=2, progress=seen.append)
+
+    assert frame['id'].tolist() == [2, 4, 5]
+    assert seen == [2, 4, 5]
+    assert frame['seen'].tolist()[0] == datetime.datetime(2024, 1, 2, 9, 30)
+
+
+def test_read_chunks_yields_an_empty_frame_for_no_rows(database, episodes):
+    import MIND_db
+
+    [chunk] = MIND_db.read_chunks(f"{episodes.replace('ORDER BY rowid', 'WHERE id > 99')}")
+
+    assert chunk.empty
+    assert list(chunk.columns) == ['id', 'amount', 'flag', 'seen', 'name']
+
+
+@pytest.fixture
+def notes(database):
+    database.execute("CREATE TABLE SYSTEM.notes (PATID TEXT, note TEXT)")
+    database.execute("INSERT INTO SYSTEM.notes VALUES (?, ?)",
+                     [('1', 'a'), ('2', 'b'), ('2', 'c'), ('3', 'd'), ('4', 'e'), ('5', 'f'), (None, 'g')])
+    return "SELECT n.PATID, n.note FROM SYSTEM.notes n WHERE {keys} ORDER BY n.note"
+
+
+@pytest.fixture
+def key_table(monkeypatch):
+    """A KEY_TABLE that SQLite can create, so read_keyed uses it."""
+    import MIND_db
+
+    monkeypatch.setattr(MIND_db, 'KEY_TABLE_DDL', f"CREATE TEMP TABLE {MIND_db.KEY_TABLE} (k VARCHAR(64))")
+
+
+def notes_of(frame):
+    return frame['note'].tolist()
+
+
+def test_read_keyed_falls_back_to_chunks_of_parameters(database, notes):
+    import MIND_db
+
+    frame = MIND_db.read_keyed(notes, MIND_db.Keys('n.PATID', ['2', '4', '5', 2]), chunk_keys=2)
+
+    assert sorted(notes_of(frame)) == ['b', 'c', 'e', 'f']
+    assert MIND_db.connection_string('CWS') in MIND_db._NO_KEY_TABLE
+
+
+def test_read_keyed_exclude_fallback_drops_keys_and_nulls_as_not_in_would(database, notes):
+    import MIND_db
+
+    frame = MIND_db.read_keyed(notes, MIND_db.Keys('n.PATID', ['2', '4'], exclude=True))
+
+    assert notes_of(frame) == ['a', 'd', 'f']
+    assert frame.index.tolist() == [0, 1, 2]
+
+
+@pytest.mark.parametrize('exclude', [False, True])
+def test_read_keyed_gives_the_same_rows_through_the_key_table(database, notes, key_table, exclude):
+    import MIND_db
+
+    keys = MIND_db.Keys('n.PATID', ['2', '4', '9'], exclude=exclude)
+    through_table = MIND_db.read_keyed(notes, keys)
+    assert not MIND_db._NO_KEY_TABLE
+
+    MIND_db._NO_KEY_TABLE.add(MIND_db.connection_string('CWS'))
+    assert notes_of(through_table) == notes_of(MIND_db.read_keyed(notes, keys, chunk_keys=1))
+
+
+def test_read_keyed_with_no_keys(database, notes):
+    import MIND_db
+
+    assert MIND_db.read_keyed(notes, MIND_db.Keys('n.PATID', [])).empty
+    assert len(MIND_db.read_keyed(notes, MIND_db.Keys('n.PATID', [], exclude=True))) == 7
+
+
+def test_read_queries_runs_plain_and_keyed_queries(database, notes, episodes, key_table, monkeypatch):
+    import MIND_db
+
+    monkeypatch.setenv('MIND_DB_CONNECTIONS', '2')
+    frames = MIND_db.read_queries({
+        'episodes': (episodes, 'CWS'),
+        'notes': (notes, 'CWS', MIND_db.Keys('n.PATID', ['1'])),
+        'counted': ("SELECT COUNT(*) AS n FROM SYSTEM.notes WHERE PATID = ?", 'PM', ['2']),
+    })
+
+    assert list(frames) == ['episodes', 'notes', 'counted']
+    assert len(frames['episodes']) == len(ROWS)
+    assert notes_of(frames['notes']) == ['a']
+    assert frames['counted']['n'].tolist() == [2]
+
+
+def test_read_queries_warns_when_they_share_one_connection(database, episodes, monkeypatch, capsys):
+    import MIND_db
+
+    queries = {'episodes': (episodes, 'CWS'), 'names': ("SELECT name FROM SYSTEM.episodes", 'CWS'),
+               'counted': ("SELECT 1 AS n", 'PM')}
+    MIND_db.read_queries(queries)
+    assert 'WARNING: 2 queries on CWS run one at a time' in capsys.readouterr().out
+
+    monkeypatch.setenv('MIND_DB_CONNECTIONS', '2')
+    MIND_db.read_queries(queries)
+    assert 'WARNING' not in capsys.readouterr().out
+
+
+def test_read_sql_runs_a_query_again_after_a_lost_connection(database, notes):
+    import MIND_db
+
+    database.pyodbc.fail_connects = 1
+    frame = MIND_db.read_sql("SELECT note FROM SYSTEM.notes WHERE PATID = ?", 'CWS', params=['1'], cache=False)
+
+    assert notes_of(frame) == ['a']
+    assert database.pyodbc.connects == 2
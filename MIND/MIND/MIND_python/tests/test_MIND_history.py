@@ -0,0 +1,84 @@
+import sqlite3
+
+import pytest
+
+from MIND_history import RunHistory
+
+
+def past_run(history, mode, wall_seconds, status='succeeded'):
+    return history.record({
+        'report': 'report', 'started': '2026-01-01T06:00:00', 'finished': '2026-01-01T06:01:00',
+        'status': status, 'log_file': 'log.txt', 'settings': {'mode': mode},
+        'steps': [{'step': 'report_00.py', 'mode': 'subprocess', 'started': '2026-01-01T06:00:00',
+                   'wall_seconds': wall_seconds, 'exit_status': 0}],
+    })
+
+
+def test_baseline_counts_full_runs_only(tmp_path):
+    history = RunHistory(tmp_path / 'history.sqlite')
+    for _ in range(3):
+        past_run(history, 'full', 10)
+        past_run(history, 'override', 100)
+        past_run(history, 'partial', 100)
+
+    assert history.baseline('report', 'report_00.py', 100, 10) == {'runs': 3, 'wall_seconds': 10, 'output_rows': None}
+    history.close()
+
+
+def test_history_from_before_run_modes_is_upgraded(tmp_path):
+    connection = sqlite3.connect(tmp_path / 'history.sqlite')
+    connection.execute("CREATE TABLE runs (id INTEGER PRIMARY KEY, report TEXT NOT NULL, started TEXT, finished TEXT, "
+                       "status TEXT, log_file TEXT)")
+    connection.commit()
+    connection.close()
+
+    history = RunHistory(tmp_path / 'history.sqlite')
+    past_run(history, 'partial', 10)
+
+    assert history.connection.execute("SELECT mode FROM runs").fetchall() == [('partial',)]
+    history.close()
+
+
+@pytest.fixture
+def slow_report(mind, report, tmp_path, monkeypatch):
+    """A report whose step 00 has a history of three much faster full runs, and the alerts it emails."""
+    history_db = tmp_path / 'history.sqlite'
+    (report.path / 'config' / 'config.ini').write_text(
+        f"[report]\nsetting = a\n\n[MIND]\nhistory_db = {history_db}\nregression_min_seconds = 0\n")
+    history = RunHistory(history_db)
+    for _ in range(3):
+        past_run(history, 'full', 0.0001)
+    history.close()
+    emails = []
+    monkeypatch.setattr(mind, 'send_email', lambda subject, body, recipient: emails.append(subject))
+    report.history_db = history_db
+    report.emails = emails
+    return report
+
+
+def runs(history_db):
+    connection = sqlite3.connect(history_db)
+    found = connection.execute("SELECT status, mode FROM runs ORDER BY id").fetchall()[3:]
+    connection.close()
+    return found
+
+
+def test_failed_run_is_recorded_without_an_alert(mind, slow_report):
+    slow_report.step(0, "import time\ntime.sleep(0.05)\nraise SystemExit(2)\n")
+
+    with pytest.raises(SystemExit):
+        mind.main(slow_report.path)
+
+    assert runs(slow_report.history_db) == [('failed', 'full')]
+    assert not [subject for subject in slow_report.emails if subject.startswith('SLOW RUN')]
+
+
+def test_only_succeeded_full_runs_are_alerted(mind, slow_report):
+    slow_report.step(0, "import time\ntime.sleep(0.05)\n")
+
+    mind.main(slow_report.path, overrides={'setting': 'b'})
+    assert slow_report.emails == []
+
+    mind.main(slow_report.path)
+    assert runs(slow_report.history_db) == [('succeeded', 'override'), ('succeeded', 'full')]
+    assert len(slow_report.emails) == 1 and slow_report.emails[0].startswith('SLOW RUN: report')
@@ -0,0 +1,137 @@
+import json
+import datetime
+
+import pytest
+
+TODAY = datetime.date.today()
+LAST_MONTH = TODAY - datetime.timedelta(days=40)
+LAST_YEAR = TODAY - datetime.timedelta(days=400)
+
+NOTES_DDL = """
+CREATE TABLE SYSTEM.cw_patient_notes (
+    PATID TEXT, EPISODE_NUMBER INTEGER, date_of_service DATE, date_of_note DATE,
+    service_charge_code TEXT, service_program_value TEXT, location_code TEXT, practitioner_id TEXT,
+    practitioner_name TEXT, service_duration DECIMAL, draft_final_code TEXT, draft_final_value TEXT,
+    document_routing_status TEXT, data_entry_date DATE, data_entry_time TEXT
+)
+"""
+
+
+def note(patid, episode, date_of_service, code='90837', draft='F', entered=None, time='08:00 AM'):
+    entered = entered or date_of_service
+    return (patid, episode, date_of_service, date_of_service, code, 'Outpatient', 'L1', 'P1', 'Smith',
+            '0.75' if code else None, draft, 'Final' if draft else None, None, entered, time)
+
+
+@pytest.fixture
+def notes(database, tmp_path):
+    """SYSTEM.cw_patient_notes in the database, and a mirror of it that has never been synced."""
+    pytest.importorskip('pyarrow')
+    from MIND_mirror import NotesMirror
+
+    database.execute(NOTES_DDL)
+    database.execute("INSERT INTO SYSTEM.cw_patient_notes VALUES (" + ', '.join('?' * 15) + ")", [
+        note('1', 1, LAST_YEAR),
+        note('1', 1, LAST_MONTH, draft=None),
+        note('1', 1, LAST_MONTH),
+        note('2', None, LAST_MONTH, code=None),
+        note('3', 2, None),
+        note('4', 1, TODAY - datetime.timedelta(days=1)),
+    ])
+    return NotesMirror(tmp_path / 'mirror', max_age_hours=1, resync_days=3)
+
+
+def from_database(sql=None, params=None):
+    """What the database returns for sql, by default the mirror's own query."""
+    import MIND_db
+    import MIND_mirror
+
+    return MIND_db.read_sql(sql or MIND_mirror.SELECT, 'CWS', params=params, cache=False)
+
+
+def same_rows(frame, expected):
+    import pandas as pd
+
+    order = list(frame.columns)
+    pd.testing.assert_frame_equal(frame.sort_values(order, ignore_index=True, na_position='first'),
+                                  expected.sort_values(order, ignore_index=True, na_position='first'))
+
+
+def test_read_gives_what_the_database_gives(notes):
+    notes.sync()
+
+    same_rows(notes.read(), from_database())
+    same_rows(notes.read(['PATID', 'EPISODE_NUMBER']).drop_duplicates(ignore_index=True),
+              from_database("SELECT DISTINCT PATID, EPISODE_NUMBER FROM SYSTEM.cw_patient_notes"))
+    same_rows(notes.read(['PATID', 'date_of_service'], LAST_MONTH, TODAY),
+              from_database("SELECT PATID, date_of_service FROM SYSTEM.cw_patient_notes "
+                            "WHERE date_of_service BETWEEN ? AND ?", [LAST_MONTH, TODAY]))
+
+
+def test_read_keeps_the_types_of_an_empty_range(notes):
+    notes.sync()
+
+    frame = notes.read(['PATID', 'EPISODE_NUMBER'], TODAY + datetime.timedelta(days=1))
+    expected = from_database("SELECT PATID, EPISODE_NUMBER FROM SYSTEM.cw_patient_notes WHERE date_of_service > ?",
+                             [TODAY])
+    assert frame.empty
+    assert list(frame.dtypes) == list(expected.dtypes)
+
+
+def test_sync_reads_again_the_days_with_new_or_changed_notes(notes, database):
+    notes.sync()
+    assert notes.state()['watermark'] == (TODAY - datetime.timedelta(days=1)).isoformat()
+
+    database.execute("UPDATE SYSTEM.cw_patient_notes SET service_charge_code = '90834', data_entry_date = ? "
+                     "WHERE date_of_service = ?", (TODAY, LAST_YEAR))
+    database.execute("INSERT INTO SYSTEM.cw_patient_notes VALUES (" + ', '.join('?' * 15) + ")",
+                     note('5', 1, LAST_MONTH, entered=TODAY))
+    database.execute("DELETE FROM SYSTEM.cw_patient_notes WHERE PATID = '4'")
+    notes.sync()
+
+    same_rows(notes.read(), from_database())
+    assert notes.state()['watermark'] == TODAY.isoformat()
+
+
+def test_deleted_note_of_an_old_day_stays_until_a_full_sync(notes, database):
+    notes.sync()
+    database.execute("DELETE FROM SYSTEM.cw_patient_notes WHERE date_of_service = ?", (LAST_YEAR,))
+
+    notes.sync()
+    assert len(notes.read(['PATID'], LAST_YEAR, LAST_YEAR)) == 1
+
+    notes.sync(full=True)
+    assert notes.read(['PATID'], LAST_YEAR, LAST_YEAR).empty
+    same_rows(notes.read(), from_database())
+
+
+def test_read_is_none_when_the_mirror_is_missing_or_stale(notes):
+    assert notes.read() is None
+
+    notes.sync()
+    state = notes.state()
+    state['synced_at'] = (datetime.datetime.now() - datetime.timedelta(hours=2)).isoformat(timespec='seconds')
+    (notes.directory / 'state.json').write_text(json.dumps(state))
+
+    assert notes.read() is None
+
+
+def test_sync_job_reads_the_database_settings_from_mind_env(notes, tmp_path, monkeypatch):
+    import os
+    import dotenv
+    import MIND_mirror
+
+    settings = {name: os.environ[name] for name in os.environ if name.startswith('database')}
+    for name in settings:
+        monkeypatch.delenv(name)
+    env_file = tmp_path / 'MIND.env'
+    env_file.write_text(''.join(f"{name}={value}\n" for name, value in settings.items()))
+    read = []
+    load_dotenv = dotenv.load_dotenv
+    monkeypatch.setattr(dotenv, 'load_dotenv', lambda dotenv_path: read.append(dotenv_path) or load_dotenv(env_file))
+    monkeypatch.setattr(MIND_mirror, 'MIND_ROOT', tmp_path)
+
+    MIND_mirror.main(['--full'])
+
+    assert read == ['C:/MIND/MIND/MIND_config/MIND.env']
+    assert 'watermark' in json.loads((tmp_path / 'MIND_mirror' / 'cw_patient_notes' / 'state.json').read_text())
@@ -0,0 +1,93 @@
+import json
+import time
+
+import pytest
+
+import MIND_querycache
+from MIND_querycache import QueryCache, normalize_sql, tables
+
+
+@pytest.mark.parametrize('sql, expected', [
+    ("SELECT * FROM SYSTEM.a", {'system.a'}),
+    ("SELECT * FROM AVCWS.SYSTEM.a", {'system.a'}),
+    ("SELECT * FROM SYSTEM.a, SYSTEM.b", {'system.a', 'system.b'}),
+    ('SELECT x FROM SYSTEM.a a1, "SYSTEM"."b" AS b2 WHERE a1.x = b2.x', {'system.a', 'system.b'}),
+    ("SELECT * FROM a JOIN b ON a.x = b.x, c WHERE 1 = 1", {'a', 'b', 'c'}),
+    ("SELECT * FROM a INNER JOIN b ON f(a.x, b.x) = 1 LEFT OUTER JOIN c ON 1 = 1", {'a', 'b', 'c'}),
+    ("SELECT * FROM (SELECT * FROM a) s, b", {'a', 'b'}),
+    ("SELECT * FROM a WHERE x IN (SELECT y FROM b, c)", {'a', 'b', 'c'}),
+    ("SELECT 'from q, r' AS label FROM a", {'a'}),
+    ("SELECT * FROM a -- , b\n", {'a'}),
+])
+def test_tables_finds_every_table_of_the_from_list(sql, expected):
+    assert tables(sql) == expected
+
+
+def test_normalize_sql_keeps_literals():
+    assert normalize_sql("SELECT  x\n FROM t /* c */ WHERE y = 'A  b'") == "select x from t where y ='A  b'"
+
+
+def test_ttl_is_the_shortest_and_refuses_unknown_tables(tmp_path):
+    cache = QueryCache(tmp_path, {'SYSTEM.a': 60, 'SYSTEM.b': 10})
+
+    assert cache.ttl("SELECT * FROM SYSTEM.a") == 3600
+    assert cache.ttl("SELECT * FROM SYSTEM.a, SYSTEM.b") == 600
+    assert cache.ttl("SELECT * FROM SYSTEM.a, SYSTEM.other") is None
+    assert cache.ttl("SELECT * FROM SYSTEM.a JOIN SYSTEM.other ON 1 = 1") is None
+    assert cache.ttl("SELECT 1") is None
+
+
+@pytest.fixture
+def notes(database, tmp_path, monkeypatch):
+    """SYSTEM.notes in the database and a query cache that keeps it for an hour."""
+    pytest.importorskip('pyarrow')
+    database.execute("CREATE TABLE SYSTEM.notes (PATID TEXT, note TEXT)")
+    database.execute("INSERT INTO SYSTEM.notes VALUES ('1', 'first')")
+    cache = QueryCache(tmp_path / 'queries', {'SYSTEM.notes': 60})
+    monkeypatch.setattr(MIND_querycache, '_SHARED', [cache])
+    return cache
+
+
+def test_read_sql_reuses_results_only_when_the_report_turns_the_cache_on(database, notes, monkeypatch):
+    import MIND_db
+
+    monkeypatch.setenv('MIND_QUERY_CACHE', 'on')
+    sql = "SELECT PATID, note FROM SYSTEM.notes"
+    assert MIND_db.read_sql(sql).note.tolist() == ['first']
+    database.execute("UPDATE SYSTEM.notes SET note = 'second'")
+
+    assert MIND_db.read_sql(sql).note.tolist() == ['first']
+    assert MIND_db.read_sql(" select patid, NOTE from system.notes ").note.tolist() == ['first']
+    assert MIND_db.read_sql(sql, cache=False).note.tolist() == ['second']
+
+    monkeypatch.delenv('MIND_QUERY_CACHE')
+    assert MIND_db.read_sql(sql).note.tolist() == ['second']
+
+
+def test_read_sql_does_not_cache_queries_of_unlisted_tables(database, notes, monkeypatch):
+    import MIND_db
+
+    monkeypatch.setenv('MIND_QUERY_CACHE', 'on')
+    database.execute("CREATE TABLE SYSTEM.episodes (PATID TEXT)")
+    sql = "SELECT n.note FROM SYSTEM.notes n, SYSTEM.episodes e WHERE n.PATID = e.PATID"
+    database.execute("INSERT INTO SYSTEM.episodes VALUES ('1')")
+    assert MIND_db.read_sql(sql).note.tolist() == ['first']
+    database.execute("DELETE FROM SYSTEM.episodes")
+
+    assert MIND_db.read_sql(sql).empty
+    assert not list(notes.directory.glob('*.parquet'))
+
+
+def test_cached_result_expires_after_its_ttl(database, notes, monkeypatch):
+    import MIND_db
+
+    monkeypatch.setenv('MIND_QUERY_CACHE', 'on')
+    sql = "SELECT note FROM SYSTEM.notes"
+    MIND_db.read_sql(sql)
+    database.execute("UPDATE SYSTEM.notes SET note = 'second'")
+    [entry_file] = notes.directory.glob('*.json')
+    entry = json.loads(entry_file.read_text())
+    entry['created'] = time.time() - 3601
+    entry_file.write_text(json.dumps(entry))
+
+    assert MIND_db.read_sql(sql).note.tolist() == ['second']
@@ -0,0 +1,94 @@
+import json
+import datetime
+
+import pytest
+
+FEES = [
+    ('90837', '90837', '150.00', 'x'),
+    ('90834', '90834', '100.00', 'y'),
+]
+
+
+@pytest.fixture
+def snapshots(database, tmp_path):
+    """SYSTEM.fees in the database, and snapshots of it (only SERVICE_CODE and charge) that have never been taken."""
+    pytest.importorskip('pyarrow')
+    from MIND_reference import ReferenceSnapshots
+
+    database.execute("CREATE TABLE SYSTEM.fees (SERVICE_CODE TEXT, cpt_code TEXT, charge DECIMAL, notes TEXT)")
+    database.execute("INSERT INTO SYSTEM.fees VALUES (?, ?, ?, ?)", FEES)
+    database.execute("CREATE TABLE SYSTEM.programs (program_code TEXT, program_value TEXT)")
+    database.execute("INSERT INTO SYSTEM.programs VALUES ('1', 'Outpatient')")
+    return ReferenceSnapshots(tmp_path / 'reference', columns={'SYSTEM.FEES': ['SERVICE_CODE', 'charge']})
+
+
+def age_snapshot(snapshots, table, days=1):
+    """Makes the table's snapshot look as if it was taken days ago."""
+    stamp_file = snapshots.directory / 'AVPM' / f'{table.lower()}.json'
+    stamp = json.loads(stamp_file.read_text())
+    taken = datetime.datetime.now() - datetime.timedelta(days=days)
+    stamp['refreshed_at'] = taken.isoformat(timespec='seconds')
+    stamp_file.write_text(json.dumps(stamp))
+
+
+def test_snapshot_is_taken_once_a_day(database, snapshots):
+    assert snapshots.table('SYSTEM.programs', 'PM').program_value.tolist() == ['Outpatient']
+    database.execute("UPDATE SYSTEM.programs SET program_value = 'Inpatient'")
+    connects = database.pyodbc.connects
+
+    assert snapshots.table('SYSTEM.programs', 'PM', columns=['PROGRAM_VALUE']).PROGRAM_VALUE.tolist() == ['Outpatient']
+    assert database.pyodbc.connects == connects
+
+    age_snapshot(snapshots, 'SYSTEM.programs')
+    assert snapshots.table('SYSTEM.programs', 'PM').program_value.tolist() == ['Inpatient']
+
+
+def test_version_changes_only_with_the_contents(database, snapshots):
+    first = snapshots.refresh('SYSTEM.programs', 'PM')
+    again = snapshots.refresh('SYSTEM.programs', 'PM')
+    assert again['version'] == first['version'] and again['changed_at'] == first['changed_at']
+
+    database.execute("UPDATE SYSTEM.programs SET program_value = 'Inpatient'")
+    changed = snapshots.refresh('SYSTEM.programs', 'PM')
+    assert changed['version'] != first['version'] and changed['rows'] == 1
+
+
+def test_stale_snapshot_is_used_when_a_new_one_cannot_be_taken(database, snapshots, capsys):
+    snapshots.table('SYSTEM.programs', 'PM')
+    age_snapshot(snapshots, 'SYSTEM.programs')
+    database.execute("DROP TABLE SYSTEM.programs")
+
+    assert snapshots.table('SYSTEM.programs', 'PM').program_value.tolist() == ['Outpatient']
+    assert 'WARNING: could not take a new snapshot of SYSTEM.programs' in capsys.readouterr().out
+    assert not snapshots.fresh('SYSTEM.programs', 'PM')
+
+
+def test_missing_snapshot_that_cannot_be_taken_fails(database, snapshots):
+    database.execute("DROP TABLE SYSTEM.programs")
+
+    with pytest.raises(database.pyodbc.Error):
+        snapshots.table('SYSTEM.programs', 'PM')
+
+
+def test_only_the_configured_columns_are_snapshotted(snapshots):
+    fees = snapshots.table('SYSTEM.fees', 'PM')
+
+    assert list(fees.columns) == ['SERVICE_CODE', 'charge']
+    assert fees.charge.tolist() == [150.0, 100.0]
+    assert snapshots.stamp('SYSTEM.fees', 'PM')['columns'] == ['SERVICE_CODE', 'charge']
+    with pytest.raises(KeyError, match='reference_tables.ini'):
+        snapshots.table('SYSTEM.fees', 'PM', columns=['cpt_code'])
+
+    # A snapshot of other columns than are configured now is taken again
+    snapshots.columns['system.fees'] = ['SERVICE_CODE', 'cpt_code']
+    assert not snapshots.fresh('SYSTEM.fees', 'PM')
+    assert snapshots.table('SYSTEM.fees', 'PM', columns=['cpt_code']).cpt_code.tolist() == ['90837', '90834']
+
+
+def test_from_config_reads_the_columns_section(database, tmp_path):
+    from MIND_reference import ReferenceSnapshots
+
+    config_file = tmp_path / 'reference_tables.ini'
+    config_file.write_text("[tables]\nSYSTEM.fees = PM\n\n[columns]\nSYSTEM.Fees = SERVICE_CODE, charge\n")
+
+    assert ReferenceSnapshots.from_config(config_file, tmp_path).columns == {'system.fees': ['SERVICE_CODE', 'charge']}
@@ -0,0 +1,65 @@
+import json
+import datetime
+
+import pytest
+
+import MIND_scheduler
+
+
+class Batch:
+    """A stand-in for the Popen of a batch, running until finish() is called."""
+    started = []
+
+    def __init__(self, args, stdout, stderr, text):
+        self.args = args
+        self.pid = 1000 + len(Batch.started)
+        self.returncode = None
+        Batch.started.append(self)
+
+    def poll(self):
+        return self.returncode
+
+    def finish(self, status=0):
+        self.returncode = status
+
+
+@pytest.fixture
+def scheduler(tmp_path, monkeypatch):
+    """A daily report due since midnight, last run yesterday, and the scheduler's state file."""
+    report_dir = tmp_path / 'MIND_reports' / 'daily_report'
+    (report_dir / 'config').mkdir(parents=True)
+    (report_dir / 'config' / 'config.ini').write_text('[MIND_schedule]\nrule = daily\ntime = 00:00\n')
+    state_file = tmp_path / 'scheduler_state.json'
+    yesterday = datetime.datetime.combine(datetime.date.today() - datetime.timedelta(days=1), datetime.time())
+    state_file.write_text(json.dumps({'daily_report': {'last_due': yesterday.isoformat(timespec='minutes')}}))
+    monkeypatch.setattr(MIND_scheduler.subprocess, 'Popen', Batch)
+    monkeypatch.setattr(MIND_scheduler, 'RUNNING', [])
+    monkeypatch.setattr(Batch, 'started', [])
+    return report_dir.parent, state_file
+
+
+def test_check_starts_due_reports_without_waiting(scheduler):
+    reports_dir, state_file = scheduler
+
+    due = MIND_scheduler.check(reports_dir, state_file, 4, 4)
+
+    assert [schedule.report_dir.name for schedule in due] == ['daily_report']
+    [batch] = Batch.started
+    assert batch.args[2:4] == ['--batch', str(reports_dir / 'daily_report')]
+    assert batch.poll() is None
+    assert json.loads(state_file.read_text())['daily_report']['last_due'].endswith('T00:00')
+
+
+def test_report_is_not_started_again_while_its_batch_runs(scheduler):
+    reports_dir, state_file = scheduler
+    MIND_scheduler.check(reports_dir, state_file, 4, 4)
+    # Due again, as if a day had passed while the batch ran
+    state_file.write_text(json.dumps({'daily_report': {'last_due': '2000-01-01T00:00'}}))
+
+    assert MIND_scheduler.check(reports_dir, state_file, 4, 4) == []
+    assert len(Batch.started) == 1
+
+    Batch.started[0].finish()
+    assert len(MIND_scheduler.check(reports_dir, state_file, 4, 4)) == 1
+    assert len(Batch.started) == 2
+    assert len(MIND_scheduler.RUNNING) == 1
@@ -1,7 +1,9 @@
-import os, sys, time, json, pickle, configparser
+import os, sys, json, pickle, configparser
 from datetime import datetime
-import pandas as pd, numpy as np, pyodbc
+import pandas as pd, numpy as np
 from dotenv import load_dotenv
+import MIND_db
+import MIND_reference
 
 # ------------------------------ CLI
 if len(sys.argv) != 3:
@@ -16,19 +18,6 @@ if os.path.exists(data_file):
         pass
 
 # ------------------------------ Helpers
-def get_db_connection(conn_str, retries=4, timeout=60):
-    for i in range(retries):
-        try:
-            print(f"[DB] attempt {i + 1}/{retries}")
-            cn = pyodbc.connect(conn_str, timeout=timeout, autocommit=True)
-            cn.cursor().arraysize = 10000
-            return cn
-        except pyodbc.Error as e:
-            if i == retries - 1:
-                raise
-            print("  connection failed:", e)
-            time.sleep(5)
-
 def split_range(txt: str):
     if not txt:
         return 0, 99999
@@ -60,16 +49,6 @@ print(f"[INFO] Measurement Year: {MEASURE_YEAR}")
 print(f"[INFO] CPT whitelist entries: {len(SDOH_CPT_CODES)}")
 print(f"[INFO] Excluding financial classes: {EXCLUDE_CLASSES}")
 
-# ------------------------------ Connections
-drv, srv, prt = os.getenv("database_driver_name"), os.getenv("database_server"), os.getenv("database_port")
-uid, pwd        = os.getenv("database_username"), os.getenv("database_password")
-cws_db, pm_db   = os.getenv("databaseCWS"), os.getenv("databasePM")
-if not all([drv, srv, prt, uid, pwd, cws_db, pm_db]):
-    raise RuntimeError("Missing DB env-vars")
-
-CWS_CONN = f"DRIVER={{{drv}}};SERVER={srv};PORT={prt};DATABASE={cws_db};UID={uid};PWD={pwd}"
-PM_CONN = f"DRIVER={{{drv}}};SERVER={srv};PORT={prt};DATABASE={pm_db};UID={uid};PWD={pwd}"
-
 # ------------------------------ SQL
 NOTES_SQL = """
 SELECT
@@ -116,22 +95,29 @@ SELECT PATID,
 FROM   AVPM.SYSTEM.patient_current_demographics
 """
 
-MAP_BASE = """
-SELECT SERVICE_CODE,
-        COALESCE(cpt_code, ub_04_code) AS base_code,
-        modifier_x_ref,
-        duration_range
-FROM   {table}
-WHERE  effective_date <= ?
-  AND (end_date IS NULL OR end_date >= ?)
-  AND location_code IS NULL
-  AND program_code  IS NULL
-  AND practitioner_category_code IS NULL
-  AND age_range IS NULL
-"""
-
-LG_SQL  = MAP_BASE.format(table="system.billing_tx_max_liab_by_guar")
-LG2_SQL = MAP_BASE.format(table="system.billing_tx_master_fee_table")
+def service_map(table):
+    """
+    SERVICE_CODE, base_code (cpt_code, else ub_04_code), modifier_x_ref and
+    duration_range of the fee table rows in effect during the measurement
+    year with no location, program, practitioner category or age range,
+    from the table's daily snapshot (MIND_reference).
+    """
+    fees = MIND_reference.table(table, "PM", columns=[
+        "SERVICE_CODE", "cpt_code", "ub_04_code", "modifier_x_ref", "duration_range",
+        "effective_date", "end_date", "location_code", "program_code",
+        "practitioner_category_code", "age_range",
+    ])
+    effective = pd.to_datetime(fees["effective_date"], errors="coerce")
+    ended     = pd.to_datetime(fees["end_date"], errors="coerce")
+    in_effect = (effective <= pd.Timestamp(END_DATE)) & (ended.isna() | (ended >= pd.Timestamp(START_DATE)))
+    general   = fees[["location_code", "program_code", "practitioner_category_code", "age_range"]].isna().all(axis=1)
+    fees = fees[in_effect & general]
+    return pd.DataFrame({
+        "SERVICE_CODE":   fees["SERVICE_CODE"],
+        "base_code":      fees["cpt_code"].where(fees["cpt_code"].notna(), fees["ub_04_code"]),
+        "modifier_x_ref": fees["modifier_x_ref"],
+        "duration_range": fees["duration_range"],
+    }).reset_index(drop=True)
 
 COVERAGE_SQL = """
 SELECT  e.PATID, EPISODE_NUMBER, e.GUARANTOR_ID,
@@ -145,18 +131,19 @@ WHERE   e.cov_effective_date <= ?
   AND  (e.cov_expiration_date >= ? OR e.cov_expiration_date IS NULL)
 """
 
-# ------------------------------ Fetch
-with get_db_connection(CWS_CONN) as cn:
-    df_notes = pd.read_sql(NOTES_SQL, cn, params=(START_DATE, END_DATE))
-    df_hrsn  = pd.read_sql(HRSN_SQL,  cn, params=(START_DATE, END_DATE))
-    df_demo  = pd.read_sql(DEMO_SQL,  cn)
-    df_epi   = pd.read_sql(EPISODE_SQL, cn)
-
-with get_db_connection(PM_CONN) as cn:
-    df_lg  = pd.read_sql(LG_SQL,  cn, params=(END_DATE, START_DATE))
-    df_lg2 = pd.read_sql(LG2_SQL, cn, params=(END_DATE, START_DATE))
-    df_cov = pd.read_sql(COVERAGE_SQL, cn, params=(END_DATE, START_DATE))
-    df_re  = pd.read_sql(RACE_ETH_SQL, cn)
+# ------------------------------ Fetch (side by side, see [MIND] db_connections)
+frames = MIND_db.read_queries({
+    "notes": (NOTES_SQL, "CWS", (START_DATE, END_DATE)),
+    "hrsn":  (HRSN_SQL,  "CWS", (START_DATE, END_DATE)),
+    "demo":  (DEMO_SQL,  "CWS"),
+    "epi":   (EPISODE_SQL, "CWS"),
+    "cov":   (COVERAGE_SQL, "PM", (END_DATE, START_DATE)),
+    "re":    (RACE_ETH_SQL, "PM"),
+})
+df_notes, df_hrsn, df_demo, df_epi = frames["notes"], frames["hrsn"], frames["demo"], frames["epi"]
+df_cov, df_re = frames["cov"], frames["re"]
+df_lg  = service_map("system.billing_tx_max_liab_by_guar")
+df_lg2 = service_map("system.billing_tx_master_fee_table")
 
 # ------------------------------ Map transform
 for m in (df_lg, df_lg2):
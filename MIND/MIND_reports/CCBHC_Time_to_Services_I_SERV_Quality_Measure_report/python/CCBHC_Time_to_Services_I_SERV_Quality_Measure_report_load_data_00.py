@@ -1,10 +1,12 @@
 #!/usr/bin/env python3
 # 00.py – Data loader for CCBHC I‑SERV Sub‑measures 1 & 2
 
-import os, sys, time, json, pickle, configparser
+import os, sys, json, pickle, configparser
 from datetime import datetime
-import pandas as pd, pyodbc
+import pandas as pd
 from dotenv import load_dotenv
+import MIND_db
+import MIND_mirror
 
 # ───────────────────────────────────────────────────────
 # CLI arguments
@@ -25,16 +27,6 @@ if os.path.exists(data_file):
 # Helpers
 # ────────────────────────────────────────────────────
 
-def get_db_connection(conn_string, max_retries=4, timeout=60):
-    for attempt in range(1, max_retries + 1):
-        try:
-            print(f"[DB] attempt {attempt}/{max_retries}")
-            return pyodbc.connect(conn_string, timeout=timeout)
-        except pyodbc.Error:
-            if attempt == max_retries:
-                raise
-            time.sleep(5)
-
 def build_windows(my):
     start = pd.Timestamp(f"{my}-01-01")
     end   = pd.Timestamp(f"{my}-12-31")
@@ -83,17 +75,6 @@ with open(param_file, "w", encoding="utf-8") as f:
 print(f"[INFO] Measurement Year = {MEASURE_YEAR}")
 print(f"[INFO] Excluding financial classes: {EXCLUDE_CLASSES}")
 
-# DB connections
-drv, srv, prt = os.getenv("database_driver_name"), os.getenv("database_server"), os.getenv("database_port")
-uid, pwd      = os.getenv("database_username"), os.getenv("database_password")
-cws_db, pm_db = os.getenv("databaseCWS"), os.getenv("databasePM")
-
-if not all([drv, srv, prt, uid, pwd, cws_db, pm_db]):
-    raise ValueError("Missing one or more DB env‑vars")
-
-CWS_CONN = f"DRIVER={{{drv}}};SERVER={srv};PORT={prt};DATABASE={cws_db};UID={uid};PWD={pwd}"
-PM_CONN  = f"DRIVER={{{drv}}};SERVER={srv};PORT={prt};DATABASE={pm_db};UID={uid};PWD={pwd}"
-
 # SQL queries
 appt_sql = """
 SELECT  a.PATID, a.patient_name, a.STAFFID, a.staff_name,
@@ -143,17 +124,29 @@ WHERE   e.cov_effective_date <= ?
   AND  (e.cov_expiration_date >= ? OR e.cov_expiration_date IS NULL)
 """
 
-# Load DataFrames
-with get_db_connection(PM_CONN) as conn_pm:
-    df_appt = pd.read_sql(appt_sql, conn_pm, params=(WIN["DENOM_START"].date(), WIN["MY_END"].date()))
-    df_demo = pd.read_sql(demo_sql, conn_pm)
-
-with get_db_connection(CWS_CONN) as conn_cws:
-    df_notes = pd.read_sql(notes_sql, conn_cws, params=(WIN["DENOM_START"].date(), WIN["MY_END"].date()))
-    df_assess = pd.read_sql(assessment_sql, conn_cws, params=(WIN["DENOM_START"].date(), WIN["MY_END"].date()))
-
-with get_db_connection(PM_CONN) as conn_pm:
-    df_cov = pd.read_sql(coverage_sql, conn_pm, params=(WIN["MY_END"].date(), WIN["DENOM_START"].date()))
+# Notes from the local mirror (MIND_mirror) when it is current, filtered as notes_sql does
+df_notes = MIND_mirror.read_notes(
+    ["PATID", "EPISODE_NUMBER", "date_of_service", "service_charge_code", "draft_final_code"],
+    WIN["DENOM_START"], WIN["MY_END"],
+)
+if df_notes is not None:
+    df_notes = df_notes[df_notes["draft_final_code"].eq("F") & df_notes["service_charge_code"].notna()]
+    df_notes = df_notes.drop(columns=["draft_final_code"]).reset_index(drop=True)
+
+# Load DataFrames, side by side (see [MIND] db_connections)
+queries = {
+    "appt":   (appt_sql, "PM", (WIN["DENOM_START"].date(), WIN["MY_END"].date())),
+    "demo":   (demo_sql, "PM"),
+    "assess": (assessment_sql, "CWS", (WIN["DENOM_START"].date(), WIN["MY_END"].date())),
+    "cov":    (coverage_sql, "PM", (WIN["MY_END"].date(), WIN["DENOM_START"].date())),
+}
+if df_notes is None:
+    queries["notes"] = (notes_sql, "CWS", (WIN["DENOM_START"].date(), WIN["MY_END"].date()))
+frames = MIND_db.read_queries(queries)
+df_appt, df_demo, df_cov = frames["appt"], frames["demo"], frames["cov"]
+df_assess = frames["assess"]
+if df_notes is None:
+    df_notes = frames["notes"]
 
 # Clean and filter
 for df in (df_appt, df_notes, df_assess, df_demo, df_cov):
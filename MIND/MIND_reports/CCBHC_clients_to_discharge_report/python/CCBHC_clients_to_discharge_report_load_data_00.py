@@ -1,13 +1,13 @@
 import os
 import sys
-import pyodbc
 import pandas as pd
 from datetime import datetime
 import pickle
 import configparser
 import json
-import time
 import glob
+import MIND_db
+import MIND_mirror
 
 # Ensure proper usage by checking the number of command-line arguments
 if len(sys.argv) != 3:
@@ -18,21 +18,6 @@ if len(sys.argv) != 3:
 data_file = sys.argv[1]
 param_file = sys.argv[2]
 
-# Helper function for connecting with retries
-def get_db_connection(conn_string, max_retries=4, timeout=60):
-    attempt = 0
-    while attempt < max_retries:
-        try:
-            print(f"Attempt {attempt + 1} of {max_retries} to connect to the database...")
-            conn = pyodbc.connect(conn_string, timeout=timeout)
-            print("Database connection successful.")
-            return conn
-        except pyodbc.OperationalError as e:
-            print(f"Database connection failed on attempt {attempt + 1}: {e}")
-            attempt += 1
-            time.sleep(5)
-    raise Exception(f"Could not connect to the database after {max_retries} attempts.")
-
 try:
     # ------------------------------------------------
     # 1) Load existing data (if any) + read parameters
@@ -66,30 +51,36 @@ try:
     today = datetime.today()
 
     # --------------------------------------------
-    # 2) Connect to the CWS database
-    # --------------------------------------------
-    cws_conn_string = (
-        f"DRIVER={{{os.getenv('database_driver_name')}}};"
-        f"SERVER={os.getenv('database_server')};"
-        f"PORT={os.getenv('database_port')};"
-        f"DATABASE={os.getenv('databaseCWS')};"
-        f"UID={os.getenv('database_username')};"
-        f"PWD={os.getenv('database_password')}"
-    )
-    cws_conn = get_db_connection(cws_conn_string)
-
+    # 2-3) Retrieve service notes (cw_patient_notes, Miscellaneous_Note_V2)
+    #      on a pooled CWS connection (MIND_db)
     # --------------------------------------------
-    # 3) Retrieve service notes (cw_patient_notes, Miscellaneous_Note_V2)
-    # --------------------------------------------
-    query_pn = """
-    SELECT
-        PATID,
-        EPISODE_NUMBER,
-        date_of_service,
-        service_charge_code
-    FROM AVCWS.SYSTEM.cw_patient_notes
-    """
-    df_pn = pd.read_sql(query_pn, cws_conn)
+    def latest_notes(notes):
+        """The notes on the last date of service of each PATID + EPISODE_NUMBER (all of them on a tie)."""
+        notes = notes.dropna(subset=['PATID', 'EPISODE_NUMBER', 'date_of_service'])
+        notes = notes.astype({'PATID': str, 'EPISODE_NUMBER': str})
+        notes['date_of_service'] = pd.to_datetime(notes['date_of_service'])
+        last_date = notes.groupby(['PATID', 'EPISODE_NUMBER'])['date_of_service'].transform('max')
+        return notes[notes['date_of_service'] == last_date]
+
+    # Every note ever written, from the local mirror (MIND_mirror) when it is
+    # current, else read in chunks, keeping only each episode's latest notes,
+    # which are all that is used below
+    df_pn = MIND_mirror.read_notes(['PATID', 'EPISODE_NUMBER', 'date_of_service', 'service_charge_code'])
+    if df_pn is not None:
+        df_pn = latest_notes(df_pn)
+    else:
+        query_pn = """
+        SELECT
+            PATID,
+            EPISODE_NUMBER,
+            date_of_service,
+            service_charge_code
+        FROM AVCWS.SYSTEM.cw_patient_notes
+        """
+        df_pn = MIND_db.read_chunked(
+            query_pn, 'CWS', latest_notes,
+            progress=lambda rows: print(f"  {rows:,} cw_patient_notes rows read")
+        )
 
     query_mn = """
     SELECT
@@ -99,13 +90,9 @@ try:
         Reason_Value AS service_charge_code
     FROM AVCWS.SYSTEM.Miscellaneous_Note_V2
     """
-    df_mn = pd.read_sql(query_mn, cws_conn)
+    df_mn = MIND_db.read_sql(query_mn, 'CWS')
 
-    df_combined_notes = pd.concat([df_pn, df_mn], ignore_index=True)
-    df_combined_notes.dropna(subset=['PATID', 'EPISODE_NUMBER', 'date_of_service'], inplace=True)
-    df_combined_notes['PATID'] = df_combined_notes['PATID'].astype(str)
-    df_combined_notes['EPISODE_NUMBER'] = df_combined_notes['EPISODE_NUMBER'].astype(str)
-    df_combined_notes['date_of_service'] = pd.to_datetime(df_combined_notes['date_of_service'])
+    df_combined_notes = latest_notes(pd.concat([df_pn, df_mn], ignore_index=True))
 
     # --------------------------------------------
     # 4) Retrieve active clients from view_client_episode_history
@@ -118,7 +105,7 @@ try:
     FROM SYSTEM.view_client_episode_history
     WHERE date_of_discharge IS NULL
     """
-    df_ceh = pd.read_sql(query_ceh, cws_conn)
+    df_ceh = MIND_db.read_sql(query_ceh, 'CWS')
     df_ceh['PATID'] = df_ceh['PATID'].astype(str)
     df_ceh['EPISODE_NUMBER'] = df_ceh['EPISODE_NUMBER'].astype(str)
 
@@ -172,7 +159,7 @@ try:
     FROM AVCWS.SYSTEM.NOMS
     WHERE Option_Desc = 'NOMs'
     """
-    df_noms = pd.read_sql(query_noms_discharge, cws_conn)
+    df_noms = MIND_db.read_sql(query_noms_discharge, 'CWS')
 
     # —— make sure PATID_2 is the same type as df_all_clients['Client ID']:
     df_noms['PATID_2'] = df_noms['PATID_2'].astype(str)
@@ -247,18 +234,8 @@ try:
 
 
     # --------------------------------------------
-    # 6) Connect to the PM database for appt_data
+    # 6) Query the PM database for appt_data
     # --------------------------------------------
-    pm_conn_string = (
-        f"DRIVER={{{os.getenv('database_driver_name')}}};"
-        f"SERVER={os.getenv('database_server')};"
-        f"PORT={os.getenv('database_port')};"
-        f"DATABASE={os.getenv('databasePM')};"
-        f"UID={os.getenv('database_username')};"
-        f"PWD={os.getenv('database_password')}"
-    )
-    pm_conn = get_db_connection(pm_conn_string)
-
     query_appt = """
     SELECT
         PATID,
@@ -267,8 +244,7 @@ try:
     FROM AVPM.SYSTEM.appt_data
     WHERE appointment_date > GETDATE()  -- future appointments only
     """
-    df_appt = pd.read_sql(query_appt, pm_conn)
-    pm_conn.close()
+    df_appt = MIND_db.read_sql(query_appt, 'PM')
 
     df_appt['PATID'] = df_appt['PATID'].astype(str)
     df_appt['EPISODE_NUMBER'] = df_appt['EPISODE_NUMBER'].astype(str)
@@ -1,12 +1,12 @@
 import os
-import pyodbc
 import pandas as pd
 import logging
-import time
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from configparser import ConfigParser
 import glob
+import MIND_db
+import MIND_mirror
 
 # Load environment variables from MIND.env
 load_dotenv(dotenv_path='C:/MIND/MIND/MIND_config/MIND.env')
@@ -28,46 +28,13 @@ days = int(config.get("sqlquery", "days"))  # Maximum days for lookup (not used
 nomsdate = int(config.get("nomsdate", "days_lookback"))  # Only clients admitted in this period
 program_list = config.get("nomsdate", "program_list")
 
-# Database credentials from environment variables
-database_driver = os.getenv('database_driver_name')
-database_server = os.getenv('database_server')
-database_port = os.getenv('database_port')
-database_username = os.getenv('database_username')
-database_password = os.getenv('database_password')
-
-databasePM = os.getenv('databasePM')
-databaseCWS = os.getenv('databaseCWS')
-
-# Function to establish database connections with retry logic
-def connect_with_retries(driver, server, port, database, username, password, retries=4, timeout=60):
-    for attempt in range(retries):
-        try:
-            logging.info(f"Attempt {attempt + 1} to connect to {database}.")
-            conn = pyodbc.connect(
-                f"DRIVER={driver};SERVER={server};PORT={port};DATABASE={database};UID={username};PWD={password}",
-                timeout=timeout
-            )
-            logging.info(f"Successfully connected to {database}.")
-            return conn
-        except pyodbc.OperationalError as e:
-            logging.warning(f"Database connection attempt {attempt + 1} failed: {e}")
-            if attempt < retries - 1:
-                time.sleep(5)  # Wait before retrying
-            else:
-                logging.error(f"All {retries} connection attempts failed.")
-                raise
-
-# Establish connections with retries
-connPM = connect_with_retries(database_driver, database_server, database_port, databasePM, database_username, database_password)
-connCWS = connect_with_retries(database_driver, database_server, database_port, databaseCWS, database_username, database_password)
-
 # Query admissions for the past `nomsdate` days
 admission_query = f"""
     SELECT PATID, EPISODE_NUMBER, admission_date, program_value
     FROM SYSTEM.admission_data 
     WHERE admission_date >= DATEADD(day, -{nomsdate}, GETDATE())
 """
-df = pd.read_sql(admission_query, connPM)
+df = MIND_db.read_sql(admission_query, 'PM')
 
 # Check if we retrieved any data
 if df.empty:
@@ -75,9 +42,14 @@ if df.empty:
     print(f"No admissions found within the last {nomsdate} days. Exiting script.")
     exit()
 
-# Query for valid services
-services_query = "SELECT DISTINCT PATID, EPISODE_NUMBER FROM SYSTEM.cw_patient_notes"
-df_services = pd.read_sql(services_query, connCWS)
+# Query for valid services, from the local notes mirror (MIND_mirror) when it is current,
+# made distinct as SELECT DISTINCT does (NULLs included)
+df_services = MIND_mirror.read_notes(['PATID', 'EPISODE_NUMBER'])
+if df_services is not None:
+    df_services = df_services.drop_duplicates(ignore_index=True)
+else:
+    services_query = "SELECT DISTINCT PATID, EPISODE_NUMBER FROM SYSTEM.cw_patient_notes"
+    df_services = MIND_db.read_sql(services_query, 'CWS')
 
 # Check if we retrieved any service data
 if df_services.empty:
@@ -25,7 +25,6 @@ import os
 import sys
 import json
 import pickle
-import time
 import argparse
 import configparser
 import pyodbc
@@ -35,6 +34,10 @@ from datetime import date
 import pandas as pd
 from dotenv import load_dotenv
 
+import MIND_db
+import MIND_mirror
+import MIND_reference
+
 # ─────────────── 0. helpers ────────────────────────────────────────────────
 def clean_value(val):
     """
@@ -122,15 +125,6 @@ def conn_str(db):
         f"UID={user};PWD={pwd};Encrypt=no"
     )
 
-def connect(cs, retries=8, tout=60):
-    for i in range(1, retries + 1):
-        try:
-            return pyodbc.connect(cs, timeout=tout)
-        except pyodbc.Error as e:
-            print(f"  connection attempt {i}/{retries} failed -> {e}")
-            time.sleep(5)
-    raise RuntimeError("DB connection failed.")
-
 # ─────────────── 3. load pickle / params ──────────────────────────────────
 data = {}
 if Path(DATA_FILE).exists():
@@ -147,26 +141,36 @@ if Path(DATA_FILE).exists():
 with open(PARAM_FILE, "r", encoding="utf-8") as f:
     params = json.load(f)
 
-# ─────────────── 4. connect to AVPM / AVCWS ───────────────────────────────
-pm_conn  = connect(conn_str(db_pm))
-cws_conn = connect(conn_str(db_cws))
+# ─────────────── 4. AVPM / AVCWS ──────────────────────────────────────────
+# Queries run side by side on pooled connections (MIND_db.read_queries) once
+# the open episodes are known. The facility, staff and program tables come
+# from their daily snapshots (MIND_reference).
+PM, CWS = conn_str(db_pm), conn_str(db_cws)
 
 print("Running queries…")
 
-# ─────────────── 5. open episodes ─────────────────────────────────────────
-df_episode = pd.read_sql(
+# ─────────────── 5. open episodes + facility defaults ─────────────────────
+df_episode = MIND_db.read_sql(
     """
     SELECT PATID, EPISODE_NUMBER, program_value
     FROM   SYSTEM.episode_history
     WHERE  date_of_discharge IS NULL
     """,
-    pm_conn,
+    PM,
+)
+df_facility = MIND_reference.table("SYSTEM.table_facility_defaults", PM,
+                                   columns=["FACILITY", "provider_name", "provider_phone"])
+df_practice = (
+    df_facility[df_facility["FACILITY"].astype(str) == "1"]
+    [["provider_name", "provider_phone"]]
+    .reset_index(drop=True)
 )
-patid_sql = ",".join(f"'{pid}'" for pid in df_episode.PATID.unique())
+# The PATIDs of every open episode go to the server in a temporary table
+# (MIND_db.read_keyed), whatever their number; {keys} below stands for them.
+patids = df_episode.PATID.unique()
 
-# ─────────────── 6. latest finalised note ─────────────────────────────────
-df_notes = pd.read_sql(
-    f"""
+# ─────────────── 6. latest note, demographics, guarantors ─────────────────
+NOTES_SQL = """
 SELECT PATID, EPISODE_NUMBER, program_value,
        practitioner_id AS STAFFID, practitioner_name, date_of_service
 FROM (
@@ -182,58 +186,28 @@ FROM (
    AND e.EPISODE_NUMBER = n.EPISODE_NUMBER
    AND e.date_of_discharge IS NULL
   WHERE n.draft_final_code = 'F'
-    AND n.PATID IN ({patid_sql})
+    AND {keys}
 ) x
 WHERE rn = 1
-""",
-    cws_conn,
-)
-
-# ─────────────── 7. provider directory ────────────────────────────────────
-staff_ids = df_notes.STAFFID.dropna().unique().tolist()
-staff_sql = ",".join(str(s) for s in staff_ids) if staff_ids else "''"
-
-df_staff = pd.read_sql(
-    f"""
-    SELECT STAFFID,
-           staff_name,
-           prac_credentials_value,
-           NPI_number
-    FROM   SYSTEM.staff_enrollment_history
-    WHERE  STAFFID IN ({staff_sql})
-    """,
-    pm_conn,
-)
-
-if not df_staff.empty:
-    split = df_staff["staff_name"].str.split(",", n=1, expand=True)
-    df_staff["FIRST_NAME"] = split[1].str.strip()
-    df_staff["LAST_NAME"]  = split[0].str.strip()
-else:
-    df_staff["FIRST_NAME"] = df_staff["LAST_NAME"] = ""
+"""
 
-df_staff.rename(
-    columns={
-        "prac_credentials_value": "HONORIFICS",
-        "NPI_number": "NPI",
-    },
-    inplace=True,
-)
+# The open episodes of the active clients, to pick their latest notes from the
+# local notes mirror (MIND_mirror) as NOTES_SQL does on the server
+OPEN_EPISODES_SQL = """
+SELECT PATID, EPISODE_NUMBER, program_value
+FROM   SYSTEM.view_client_episode_history
+WHERE  date_of_discharge IS NULL
+  AND  {keys}
+"""
 
-# ─────────────── 8. demographics ──────────────────────────────────────────
-df_demo = pd.read_sql(
-    f"""
+DEMO_SQL = """
     SELECT *
     FROM   SYSTEM.patient_current_demographics
-    WHERE  PATID IN ({patid_sql})
-    """,
-    pm_conn,
-)
-
-# ─────────────── 9. two most recent billed guarantors ─────────────────────
-print("Pulling guarantor info for active clients…")
+    WHERE  {keys}
+    """
 
-CHUNK_SQL = """
+# two most recent billed guarantors
+GUAR_SQL = """
 SELECT  b.PATID,
         g.guarantor_name    AS INSURER,
         s.subs_policy       AS POLICY_NUMBER,
@@ -245,23 +219,97 @@ LEFT    JOIN SYSTEM.billing_guar_subs_data s
        ON b.PATID = s.PATID
       AND b.GUARANTOR_ID = s.GUARANTOR_ID
       AND b.EPISODE_NUMBER = s.EPISODE_NUMBER
-WHERE   b.PATID IN ({patid_in})
+WHERE   {keys}
 GROUP BY b.PATID, g.guarantor_name, s.subs_policy
 """
 
-chunk_size = 5000
-patids     = df_episode.PATID.unique().tolist()
-frames     = []
+def latest_final_notes(notes, episodes, patids):
+    """NOTES_SQL on mirrored notes: the latest final note of each open episode of the patids."""
+    keys = ["PATID", "EPISODE_NUMBER"]
+    notes = notes[notes["draft_final_code"].eq("F") & notes["PATID"].astype(str).isin(set(map(str, patids)))]
+    # The episodes first, so the keys keep their dtypes whatever NULLs the notes had
+    notes = episodes.dropna(subset=keys).merge(notes.dropna(subset=keys), on=keys)
+    # ROW_NUMBER() ... ORDER BY date_of_service DESC, whose NULLs come last
+    notes = notes.sort_values("date_of_service", ascending=False, na_position="last").drop_duplicates(keys)
+    return (
+        notes.rename(columns={"practitioner_id": "STAFFID"})
+        [["PATID", "EPISODE_NUMBER", "program_value", "STAFFID", "practitioner_name", "date_of_service"]]
+        .reset_index(drop=True)
+    )
+
+print("Pulling notes, demographics and guarantor info for active clients…")
+mirrored_notes = MIND_mirror.read_notes(
+    ["PATID", "EPISODE_NUMBER", "practitioner_id", "practitioner_name", "date_of_service", "draft_final_code"]
+)
+queries = {
+    "demo":       (DEMO_SQL, PM, MIND_db.Keys("PATID", patids)),
+    "guarantors": (GUAR_SQL, PM, MIND_db.Keys("b.PATID", patids)),
+}
+if mirrored_notes is None:
+    queries["notes"] = (NOTES_SQL, CWS, MIND_db.Keys("n.PATID", patids))
+else:
+    queries["episodes"] = (OPEN_EPISODES_SQL, CWS, MIND_db.Keys("PATID", patids))
+frames = MIND_db.read_queries(queries)
+if mirrored_notes is None:
+    df_notes = frames["notes"]
+else:
+    df_notes = latest_final_notes(mirrored_notes, frames["episodes"], patids)
+df_demo  = frames["demo"]
+df_guar  = frames["guarantors"]
+
+# ─────────────── 7. program enrolment (up to 10) ──────────────────────────
+prog_seen = (
+    df_notes.groupby(["PATID", "program_value"], as_index=False)["date_of_service"].max()
+    .rename(columns={"date_of_service": "last_service"})
+    .sort_values(["PATID", "last_service"], ascending=[True, False])
+)
+prog_seen["rn"] = prog_seen.groupby("PATID").cumcount() + 1
+df_prog_enroll = (
+    prog_seen[prog_seen["rn"] <= 10]
+    .pivot(index="PATID", columns="rn", values="program_value")
+    .add_prefix("PROGRAM_")
+    .reset_index()
+)
+
+# ─────────────── 8. provider directory + program contacts ─────────────────
+def as_ids(ids):
+    """Staff IDs as text, without the .0 a float column gives them, to match across tables."""
+    return ids.astype(str).str.replace(r"\.0$", "", regex=True)
+
+staff_ids = set(as_ids(df_notes.STAFFID.dropna()))
+prog_vals = prog_seen["program_value"].dropna().unique()
 
-for idx in range(0, len(patids), chunk_size):
-    chunk = patids[idx: idx + chunk_size]
-    sql   = CHUNK_SQL.format(patid_in=",".join(f"'{p}'" for p in chunk))
-    frame = pd.read_sql(sql, pm_conn)
-    frames.append(frame)
-    print(f"  -> chunk {idx//chunk_size+1}: {len(frame):,} rows")
+df_staff = MIND_reference.table("SYSTEM.staff_enrollment_history", PM,
+                                columns=["STAFFID", "staff_name", "prac_credentials_value", "NPI_number"])
+df_staff = df_staff[as_ids(df_staff["STAFFID"]).isin(staff_ids)].reset_index(drop=True)
+
+if prog_vals.size:
+    df_prog_defs = MIND_reference.table("SYSTEM.table_program_definition", PM,
+                                        columns=["program_value", "program_X_fax_number", "program_X_phone_number"])
+    df_prog_defs = (
+        df_prog_defs[df_prog_defs["program_value"].isin(prog_vals)]
+        .rename(columns={"program_X_fax_number": "FAX", "program_X_phone_number": "PHONE"})
+        .reset_index(drop=True)
+    )
+else:
+    df_prog_defs = pd.DataFrame()
+
+if not df_staff.empty:
+    split = df_staff["staff_name"].str.split(",", n=1, expand=True)
+    df_staff["FIRST_NAME"] = split[1].str.strip()
+    df_staff["LAST_NAME"]  = split[0].str.strip()
+else:
+    df_staff["FIRST_NAME"] = df_staff["LAST_NAME"] = ""
 
-df_guar = pd.concat(frames, ignore_index=True)
+df_staff.rename(
+    columns={
+        "prac_credentials_value": "HONORIFICS",
+        "NPI_number": "NPI",
+    },
+    inplace=True,
+)
 
+# ─────────────── 9. two most recent billed guarantors ─────────────────────
 # filter out non-insurance guarantors
 if non_ins_list:
     print(" Excluding non-insurance guarantors:", non_ins_list)
@@ -297,45 +345,7 @@ else:
 df_insurance = clean_df(df_insurance)
 print(f"Guarantor rows after pivot: {len(df_insurance):,}")
 
-# ─────────────── 10. program enrolment (up to 10) ─────────────────────────
-prog_seen = (
-    df_notes.groupby(["PATID", "program_value"], as_index=False)["date_of_service"].max()
-    .rename(columns={"date_of_service": "last_service"})
-    .sort_values(["PATID", "last_service"], ascending=[True, False])
-)
-prog_seen["rn"] = prog_seen.groupby("PATID").cumcount() + 1
-df_prog_enroll = (
-    prog_seen[prog_seen["rn"] <= 10]
-    .pivot(index="PATID", columns="rn", values="program_value")
-    .add_prefix("PROGRAM_")
-    .reset_index()
-)
-
-# ─────────────── 11. program contacts ─────────────────────────────────────
-prog_vals = prog_seen["program_value"].dropna().unique()
-df_prog_defs = (
-    pd.read_sql(
-        f"""
-        SELECT program_value,
-               program_X_fax_number   AS FAX,
-               program_X_phone_number AS PHONE
-        FROM   SYSTEM.table_program_definition
-        WHERE  program_value IN ({','.join(f"'{v}'" for v in prog_vals)})
-        """,
-        pm_conn,
-    ) if prog_vals.size else pd.DataFrame()
-)
-
-# ─────────────── 12. facility defaults ────────────────────────────────────
-df_practice = pd.read_sql(
-    """
-    SELECT provider_name, provider_phone
-    FROM   SYSTEM.table_facility_defaults
-    WHERE  FACILITY = '1'
-    """,
-    pm_conn,
-)
-
+# ─────────────── 10. facility defaults ────────────────────────────────────
 practice_email = cfg.get("report", "practice_main_email", fallback="")
 if df_practice.empty:
     df_practice = pd.DataFrame({
@@ -350,14 +360,11 @@ else:
     }, inplace=True)
     df_practice["PRACTICE_EMAIL"] = practice_email
 
-# ─────────────── 13. clean all frames ─────────────────────────────────────
+# ─────────────── 11. clean all frames ─────────────────────────────────────
 for df in (df_episode, df_notes, df_staff, df_demo, df_prog_enroll, df_prog_defs, df_practice):
     clean_df(df)
 
-pm_conn.close()
-cws_conn.close()
-
-# ─────────────── 14. save raw frames ──────────────────────────────────────
+# ─────────────── 12. save raw frames ──────────────────────────────────────
 data.update(
     df_episode      = df_episode,
     df_notes        = df_notes,
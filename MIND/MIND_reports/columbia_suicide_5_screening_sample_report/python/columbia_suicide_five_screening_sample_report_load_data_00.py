@@ -1,5 +1,3 @@
-import pandas as pd
-import pyodbc
 from datetime import datetime
 from dotenv import load_dotenv
 import os
@@ -8,33 +6,11 @@ import pickle
 import json
 import glob
 
+import MIND_db
+
 # Load environmental variables from .env file
 load_dotenv()
 
-# Database connection details from .env file
-database_server = os.getenv('database_server')
-database_port = os.getenv('database_port')
-databaseCWS = os.getenv('databaseCWS')
-database_username = os.getenv('database_username')
-database_password = os.getenv('database_password')
-database_driver_name = os.getenv('database_driver_name')
-
-# Database connection using the structured connection string
-connection_string = (
-    f"DRIVER={{{database_driver_name}}};"
-    f"SERVER={database_server};"
-    f"PORT={database_port};"
-    f"DATABASE={databaseCWS};"
-    f"UID={database_username};"
-    f"PWD={database_password};"
-)
-try:
-    conn = pyodbc.connect(connection_string)
-    print("Connected to the database successfully")
-except Exception as e:
-    print(f"Failed to connect to the database: {e}")
-    sys.exit(1)
-
 # Define the current date
 current_date = datetime.now()
 
@@ -56,9 +32,8 @@ for filename in history_files:
     with open(filename, 'r') as file:
         previously_sampled_patids.extend(file.read().splitlines())
 
-# Construct the SQL query
+# Construct the SQL query; {keys} excludes the previously sampled PATIDs (MIND_db.read_keyed)
 test_names = ["'TEST'", "'test'", "'Test'", "'testing'", "'TESTING'", "'Testing'"]
-exclusion_clause = f"AND s.PATID NOT IN ({', '.join('?' for _ in previously_sampled_patids)})" if previously_sampled_patids else ""
 query = f"""
 SELECT s.PATID, s.Assess_Date, d.patient_home_phone
 FROM SYSTEM.Columbia_Suicide_Screening s
@@ -68,20 +43,16 @@ AND (d.patient_name_first NOT IN ({', '.join(test_names)})
 AND d.patient_name_last NOT IN ({', '.join(test_names)}))
 AND (UPPER(s.Staff_Step_Taken) NOT LIKE '%TEST%'
 AND UPPER(s.Staff_Step_Taken) NOT LIKE '%TESTING%')
-{exclusion_clause}
+AND {{keys}}
 """
 
 # Execute the query and fetch the data into a DataFrame
-params = tuple(previously_sampled_patids) if previously_sampled_patids else ()
 try:
-    df = pd.read_sql(query, conn, params=params)
+    df = MIND_db.read_keyed(query, MIND_db.Keys('s.PATID', previously_sampled_patids, exclude=True), 'CWS')
 except Exception as e:
     print(f"Error executing SQL query: {e}")
     sys.exit(1)
 
-# Close the database connection
-conn.close()
-
 # Ensure we have distinct PATID
 distinct_df = df[['PATID', 'patient_home_phone']].drop_duplicates()
 
@@ -1,9 +1,7 @@
 import os
 import pickle
-import pandas as pd
-import pyodbc
 from dotenv import load_dotenv
-from time import sleep
+import MIND_db
 
 # Load environment variables
 load_dotenv(dotenv_path='C:/MIND/MIND/MIND_config/MIND.env')
@@ -23,84 +21,52 @@ if os.path.exists(data_file):
 else:
     raise FileNotFoundError(f"{data_file} does not exist.")
 
-# Database connection details from environment variables
-server = os.getenv('database_server')
-port = os.getenv('database_port')
-databaseCWS = os.getenv('databaseCWS')
-username = os.getenv('database_username')
-password = os.getenv('database_password')
-driver = os.getenv('database_driver_name')
-
-# Ensure the driver is specified correctly
-if not driver:
-    raise ValueError("ODBC driver not specified in the environment variables.")
+def most_recent_episodes(episodes):
+    """The most recent record of each PATID + EPISODE_NUMBER in episodes."""
+    episodes = episodes.copy()
+    # Ensure the EPN_uniqueid column is in the correct format for sorting
+    episodes['EPN_uniqueid'] = episodes['EPN_uniqueid'].astype(str)
 
-# Construct the connection string with the timeout parameter
-conn_stringCWS = (
-    f'DRIVER={{{driver}}};'
-    f'SERVER={server};'
-    f'PORT={port};'
-    f'DATABASE={databaseCWS};'
-    f'UID={username};'
-    f'PWD={password};'
-    f'Timeout=60'
-)
+    # Extract the numeric part for sorting and identify the most recent records
+    episodes['EPN_uniqueid_numeric'] = episodes['EPN_uniqueid'].apply(lambda x: int(x.split('.')[1]))
+    most_recent = episodes.loc[episodes.groupby(['PATID', 'EPISODE_NUMBER'])['EPN_uniqueid_numeric'].idxmax()]
 
-# Retry logic for connecting to the database
-max_retries = 4
-conn = None
-for attempt in range(1, max_retries + 1):
-    try:
-        print(f"Attempt {attempt} to connect to the database...")
-        conn = pyodbc.connect(conn_stringCWS)
-        print("Database connection successful.")
-        break  # Exit loop if connection is successful
-    except pyodbc.Error as e:
-        print(f"Database connection failed on attempt {attempt}: {e}")
-        if attempt == max_retries:
-            print("Maximum retry attempts reached. Exiting.")
-            exit(1)
-        print("Retrying in 5 seconds...")
-        sleep(5)
+    # Drop the temporary numeric column
+    return most_recent.drop(columns=['EPN_uniqueid_numeric'])
 
-# Query and process data
-try:
-    # Query the SYSTEM.view_client_episode_history
-    query = "SELECT * FROM SYSTEM.view_client_episode_history"
+calendar_patids = set(calendar_df['PATID'])
 
-    # Execute the query and load the data into a DataFrame
-    client_episode_history_df = pd.read_sql(query, conn)
-    print("client_episode_history_df loaded successfully:")
+def calendar_episodes(chunk):
+    # Only the clients on the calendar, and only the newest record of each of
+    # their episodes, are kept from each chunk of the (whole) history
+    chunk = chunk[chunk['PATID'].isin(calendar_patids)]
+    return most_recent_episodes(chunk[['PATID', 'EPISODE_NUMBER', 'EPN_uniqueid', 'program_value']])
 
-    # Ensure the EPN_uniqueid column is in the correct format for sorting
-    client_episode_history_df['EPN_uniqueid'] = client_episode_history_df['EPN_uniqueid'].astype(str)
+# Query the SYSTEM.view_client_episode_history
+query = "SELECT * FROM SYSTEM.view_client_episode_history"
 
-    # Extract the numeric part for sorting and identify the most recent records
-    client_episode_history_df['EPN_uniqueid_numeric'] = client_episode_history_df['EPN_uniqueid'].apply(lambda x: int(x.split('.')[1]))
-    most_recent_episode_df = client_episode_history_df.loc[
-        client_episode_history_df.groupby(['PATID', 'EPISODE_NUMBER'])['EPN_uniqueid_numeric'].idxmax()
-    ]
-
-    # Drop the temporary numeric column
-    most_recent_episode_df = most_recent_episode_df.drop(columns=['EPN_uniqueid_numeric'])
+# Read it in chunks, reducing each chunk as it arrives
+client_episode_history_df = MIND_db.read_chunked(
+    query, 'CWS', calendar_episodes,
+    progress=lambda rows: print(f"  {rows:,} episode history rows read")
+)
+print("client_episode_history_df loaded successfully:")
 
-    # Merge the program_value column from the most recent episode records into the calendar_df
-    calendar_df = calendar_df.merge(
-        most_recent_episode_df[['PATID', 'EPISODE_NUMBER', 'program_value']], 
-        on=['PATID', 'EPISODE_NUMBER'], 
-        how='left'
-    )
+# The most recent record of each episode across all the chunks
+most_recent_episode_df = most_recent_episodes(client_episode_history_df)
 
-    print("Updated calendar_df with program_value column:")
+# Merge the program_value column from the most recent episode records into the calendar_df
+calendar_df = calendar_df.merge(
+    most_recent_episode_df[['PATID', 'EPISODE_NUMBER', 'program_value']], 
+    on=['PATID', 'EPISODE_NUMBER'], 
+    how='left'
+)
 
-    # Save the updated calendar_df to the temp_data.pkl file
-    data['calendar_df'] = calendar_df
-    with open(data_file, 'wb') as f:
-        pickle.dump(data, f)
+print("Updated calendar_df with program_value column:")
 
-    print(f"Filtered calendar_df saved to {data_file}")
+# Save the updated calendar_df to the temp_data.pkl file
+data['calendar_df'] = calendar_df
+with open(data_file, 'wb') as f:
+    pickle.dump(data, f)
 
-finally:
-    if conn:
-        conn.close()
-        print("Database connection closed.")
+print(f"Filtered calendar_df saved to {data_file}")
@@ -4,8 +4,7 @@ import sys
 import pandas as pd
 from datetime import datetime
 from dotenv import load_dotenv
-import pyodbc
-import time
+import MIND_db
 
 # Load environment variables
 load_dotenv(dotenv_path='C:/MIND/MIND/MIND_config/MIND.env')
@@ -30,41 +29,9 @@ else:
     # Ensure the 'date' column is in datetime format
     calendar_df['date'] = pd.to_datetime(calendar_df['date'])
 
-# Build the connection string
-conn_str = (
-    f"DRIVER={{{os.getenv('database_driver_name')}}};"
-    f"SERVER={os.getenv('database_server')};"
-    f"PORT={os.getenv('database_port')};"
-    f"DATABASE={os.getenv('databaseCWS')};"
-    f"UID={os.getenv('database_username')};"
-    f"PWD={os.getenv('database_password')};"
-    f"Timeout=60"  # Set a timeout of 60 seconds
-)
-
-# Function to connect to the database with retry logic
-def connect_with_retry(retries=4, delay=10):
-    attempt = 0
-    while attempt < retries:
-        try:
-            conn = pyodbc.connect(conn_str)
-            print("Database connection established.")
-            return conn
-        except pyodbc.Error as e:
-            print(f"Database connection attempt {attempt + 1} failed: {e}")
-            attempt += 1
-            if attempt < retries:
-                print(f"Retrying in {delay} seconds...")
-                time.sleep(delay)
-            else:
-                print("All retry attempts failed. Exiting.")
-                raise
-
-# Establish the database connection with retries
-conn = connect_with_retry()
-
 # Query to select data from eMAR_rescheduled_hours
 query = "SELECT * FROM eMAR.eMAR_rescheduled_hours"
-emar_df = pd.read_sql(query, conn)
+emar_df = MIND_db.read_sql(query, 'CWS')
 
 # Ensure date columns are in datetime format
 calendar_df['date'] = pd.to_datetime(calendar_df['date'])
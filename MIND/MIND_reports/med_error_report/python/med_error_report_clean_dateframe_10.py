@@ -4,6 +4,7 @@ import os
 import pickle
 import pandas as pd
 from dotenv import load_dotenv
+import MIND_handoff
 
 # Load environment variables
 load_dotenv(dotenv_path='C:/MIND/MIND/MIND_config/MIND.env')
@@ -16,7 +17,8 @@ if os.path.exists(data_file):
     with open(data_file, 'rb') as f:
         data = pickle.load(f)
         if 'calendar_df' in data:
-            calendar_df = data['calendar_df']
+            # Only the columns kept below are read when MIND runs with the Arrow handoff
+            calendar_df = MIND_handoff.frame(data, 'calendar_df', columns=['PATID', 'date', 'admin_hrs_default', 'admin_instruct_formatted', 'med_descr_ext_formatted', 'order_code_description', 'program_value'])
             print("calendar_df loaded successfully:")
         else:
             raise KeyError("calendar_df not found in the loaded data.")
@@ -26,9 +28,6 @@ else:
 
  
 
-# Keep only the required columns
-calendar_df = calendar_df[['PATID', 'date', 'admin_hrs_default', 'admin_instruct_formatted', 'med_descr_ext_formatted', 'order_code_description', 'program_value']]
-
 # Strip out the time part from the date column
 calendar_df['date'] = pd.to_datetime(calendar_df['date']).dt.strftime('%Y_%m_%d')
 
@@ -1,9 +1,8 @@
 import os
 import pickle
-import pyodbc
-import pandas as pd
 from datetime import datetime
 from dotenv import load_dotenv
+import MIND_db
 
 # Load environment variables
 load_dotenv()
@@ -15,57 +14,21 @@ pkl_file_path = os.path.join(current_dir, 'temp_data.pkl')
 with open(pkl_file_path, 'rb') as f:
     df = pickle.load(f)
 
-# Database connection details from environment variables
-server = os.getenv('database_server')
-port = os.getenv('database_port')
-databaseCWS = os.getenv('databaseCWS')
-username = os.getenv('database_username')
-password = os.getenv('database_password')
-driver = os.getenv('database_driver_name')
-
-# Ensure the driver is specified correctly
-if not driver:
-    raise ValueError("ODBC driver not specified in the environment variables.")
-
-# Construct the connection string (with 60-second timeout)
-conn_stringCWS = (
-    f"DRIVER={{{driver}}};"
-    f"SERVER={server};"
-    f"PORT={port};"
-    f"DATABASE={databaseCWS};"
-    f"UID={username};"
-    f"PWD={password};"
-    "Timeout=60"
-)
+# Create a SQL query
+sql_query = "SELECT * FROM SYSTEM.view_client_episode_history"
 
-# Retry logic: up to 4 attempts to connect
-MAX_ATTEMPTS = 4
-conn = None
-for attempt in range(MAX_ATTEMPTS):
-    try:
-        print(f"Attempt {attempt + 1} to connect to the database...")
-        conn = pyodbc.connect(conn_stringCWS)
-        print("Successfully connected to the database.")
-        break  # Exit the loop on successful connection
-    except pyodbc.Error as e:
-        print(f"Connection attempt {attempt + 1} failed: {e}")
-        if attempt < MAX_ATTEMPTS - 1:
-            print("Retrying...")
-        else:
-            print("Failed to connect after 4 attempts. Exiting script.")
-            exit(1)
-
-try:
-    # Create a SQL query
-    sql_query = "SELECT * FROM SYSTEM.view_client_episode_history"
-
-    # Use pandas to execute the SQL query and store the result in a DataFrame
-    client_episode_history_df = pd.read_sql(sql_query, conn)
-    print("client_episode_history_df loaded successfully")
-
-finally:
-    if conn:
-        conn.close()
+# Read the whole history in chunks, keeping only the discharges of clients in df
+patids = set(df['PATID'])
+
+def discharges(chunk):
+    chunk = chunk[chunk['date_of_discharge'].notnull() & chunk['PATID'].isin(patids)]
+    return chunk[['PATID', 'EPISODE_NUMBER', 'date_of_discharge']]
+
+client_episode_history_df = MIND_db.read_chunked(
+    sql_query, 'CWS', discharges,
+    progress=lambda rows: print(f"  {rows:,} episode history rows read")
+)
+print("client_episode_history_df loaded successfully")
 
 # Create a mapping from 'PATID' and 'EPISODE_NUMBER' to 'date_of_discharge' 
 # for records where 'date_of_discharge' is not null
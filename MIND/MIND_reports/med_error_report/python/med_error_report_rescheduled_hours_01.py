@@ -2,9 +2,8 @@ import os
 import pickle
 import json
 from dotenv import load_dotenv
-import pyodbc
 import pandas as pd
-from time import sleep
+import MIND_db
 
 # Load environment variables
 load_dotenv(dotenv_path='C:/MIND/MIND/MIND_config/MIND.env')
@@ -47,54 +46,27 @@ param_file = os.path.join(current_dir, 'temp_params.json')
 
 df, parameters = load_data(data_file, param_file)
 
-def load_rescheduled_hours(conn_string, retries=4, delay=5):
-    attempts = 0
-    while attempts < retries:
-        try:
-            # Define the SQL query to fetch rescheduled hours
-            sql_query = """
-            SELECT *
-            FROM eMAR.eMAR_hrs_of_admin_hist
-            """
-
-            # Connect to the database
-            conn = pyodbc.connect(conn_string)
-
-            # Execute the query and load the data into a DataFrame
-            rescheduled_hours_df = pd.read_sql_query(sql_query, conn)
-
-            # Close the connection
-            conn.close()
-
-            print("Rescheduled hours data loaded successfully")
-            return rescheduled_hours_df
-
-        except pyodbc.Error as e:
-            attempts += 1
-            print(f"Connection attempt {attempts} failed: {str(e)}")
-            if attempts < retries:
-                print(f"Retrying in {delay} seconds...")
-                sleep(delay)
-            else:
-                raise
-
-# Get database credentials from environment variables
-server = os.getenv('database_server')
-port = os.getenv('database_port')
-database = os.getenv('databaseCWS')  
-username = os.getenv('database_username')
-password = os.getenv('database_password')
-driver_name = os.getenv('database_driver_name')
-
-# Verify environment variables
-if not all([server, port, database, username, password, driver_name]):
-    raise ValueError("One or more environment variables are missing.")
-
-# Construct the connection string
-conn_string = f'DRIVER={{{driver_name}}};SERVER={server};PORT={port};DATABASE={database};UID={username};PWD={password};Timeout=60'
+def load_rescheduled_hours(df):
+    # The history covers every order ever written; read it in chunks and keep
+    # only the edits of the orders in df, the only ones that can match below
+    sql_query = """
+    SELECT *
+    FROM eMAR.eMAR_hrs_of_admin_hist
+    """
+    orders = pd.MultiIndex.from_frame(df[['PATID', 'order_unique_id']].drop_duplicates())
+
+    def orders_in_df(chunk):
+        return chunk[pd.MultiIndex.from_frame(chunk[['PATID', 'order_unique_id']]).isin(orders)]
+
+    rescheduled_hours_df = MIND_db.read_chunked(
+        sql_query, 'CWS', orders_in_df,
+        progress=lambda rows: print(f"  {rows:,} rescheduled hours rows read")
+    )
+    print("Rescheduled hours data loaded successfully")
+    return rescheduled_hours_df
 
 # Load rescheduled hours data
-rescheduled_hours_df = load_rescheduled_hours(conn_string)
+rescheduled_hours_df = load_rescheduled_hours(df)
 
 # Display the loaded rescheduled hours DataFrame
 print(f"Rescheduled hours DataFrame shape: {rescheduled_hours_df.shape}")
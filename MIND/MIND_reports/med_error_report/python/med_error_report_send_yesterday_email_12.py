@@ -11,7 +11,6 @@ from pathlib import Path
 from PIL import Image
 from configparser import ConfigParser
 from dotenv import load_dotenv
-import pandas as pd
 from io import BytesIO
 
 # Load environment variables from the .env file
@@ -58,7 +57,8 @@ if not smtp_email or not smtp_port or not smtp_server:
 smtp_port = int(smtp_port)
 
 # Format the filter_date for the subject and filename
-filter_date_formatted = pd.to_datetime(filter_date).strftime('%Y-%m-%d')
+# Step 11 saves it as YYYY-MM-DD; parsing it with datetime spares this step importing pandas
+filter_date_formatted = datetime.strptime(filter_date, '%Y-%m-%d').strftime('%Y-%m-%d')
 subject = f'No Documentation Med Error Report for {filter_date_formatted}'
 body_date_info = f'for {filter_date_formatted}'
 
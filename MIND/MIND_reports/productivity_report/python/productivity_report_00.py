@@ -14,6 +14,7 @@ from dotenv import load_dotenv
 from pathlib import Path
 import pickle
 import json
+import MIND_reference
 
 # Load environment variables from MIND.env file
 load_dotenv(dotenv_path='C:/MIND/MIND/MIND_config/MIND.env')
@@ -944,16 +945,9 @@ availability_df = availability_df.groupby(['Practitioner ID', 'Site'], as_index=
 
 user_roles = user_roles.split(',')
 
-# Create a new connection
-conn = pyodbc.connect(conn_stringPM)
-
-# Create a SQL query to select all data from the SYSTEM.RADplus_users table
-sql_query = "SELECT staff_member_id AS STAFFID, USERROLE FROM SYSTEM.RADplus_users"
-
-# Execute the SQL query and store the result in a DataFrame
-all_data_df = pd.read_sql(sql_query, conn)
-
-conn.close()
+# Staff roles from the daily snapshot of SYSTEM.RADplus_users (MIND_reference)
+all_data_df = MIND_reference.table("SYSTEM.RADplus_users", "PM", columns=["staff_member_id", "USERROLE"])
+all_data_df = all_data_df.rename(columns={"staff_member_id": "STAFFID"})
 
 
 
@@ -1062,12 +1056,10 @@ if use_note_table == "1" and use_note_billing_charge_table == "0":
     df_csv = pd.read_csv(productivity_service_code_list_location)
     conn = pyodbc.connect(conn_stringPM)
     
-    # Define the first SQL query
-    sql_query1 = """
-        SELECT DISTINCT SERVICE_CODE, cpt_code, charge, duration_range 
-        FROM SYSTEM.billing_tx_master_fee_table 
-    """
-    df1 = pd.read_sql(sql_query1, conn)
+    # Service codes from the daily snapshot of the fee table (MIND_reference)
+    df1 = MIND_reference.table("SYSTEM.billing_tx_master_fee_table", "PM",
+                               columns=["SERVICE_CODE", "cpt_code", "charge", "duration_range"])
+    df1 = df1.drop_duplicates().reset_index(drop=True)
     
     df1[['duration_range_start', 'duration_range_end']] = df1['duration_range'].str.split('-', expand=True)
     df1[['duration_range_start', 'duration_range_end']] = df1[['duration_range_start', 'duration_range_end']].apply(pd.to_numeric)